@@ -10,13 +10,16 @@ import os
 
 from gae_handlers import ApiHandler, RestHandler, InvalidParamType, Route
 from handlers import (Emails, MandrillTemplates, Networks, NetworkCode,
-                      UsersNetworks, OrganizationDashboards, Programs,
-                      ProgramsSearch, ReportPdf, Reports, Responses,
-                      ParentReports, TeamsResponses)
+                      UsersNetworks, OrganizationDashboards,
+                      ParticipantsExport, Programs, ProgramsSearch,
+                      ReportBatches, ReportPdf, Reports, Responses,
+                      ResponsesExport, ResponsesHistory, ParentReports,
+                      TeamsResponses)
 from model import (Model, SqlModel, Classroom, Cycle, Digest, Email, Metric,
                    Notification, Organization, Participant, Program, Report,
-                   SecretValue, Survey, Team, JsonTextValueLengthError,
-                   JsonTextDictLengthError, User)
+                   InvalidRoster, RosterImport, SecretValue, Survey, Team,
+                   JsonTextValueLengthError, JsonTextDictLengthError, User,
+                   PrefetchesCachedProperties, cached_properties)
 from permission import (has_captain_permission, has_contact_permission, owns,
                         organization_membership_removal_allowed,
                         team_membership_removal_allowed)
@@ -229,7 +232,7 @@ class TeamsUsers(RestHandler):
         self.response.headers['Allow'] = 'GET, HEAD'
 
 
-class Organizations(RestHandler):
+class Organizations(PrefetchesCachedProperties, RestHandler):
     model = Organization
     requires_auth = True
 
@@ -363,7 +366,7 @@ class OrganizationCode(ApiHandler):
         self.write(org)
 
 
-class UsersOrganizations(ApiHandler):
+class UsersOrganizations(PrefetchesCachedProperties, ApiHandler):
     model = Organization
     requires_auth = True
 
@@ -386,7 +389,7 @@ class UsersOrganizations(ApiHandler):
         self.write(Organization.query_by_user(user, program_id=program_id))
 
 
-class TeamsOrganizations(ApiHandler):
+class TeamsOrganizations(PrefetchesCachedProperties, ApiHandler):
     model = Organization
     requires_auth = True
 
@@ -464,6 +467,7 @@ class OrganizationReportData(ApiHandler):
         captain_ids = list(set(t.captain_id for t in teams))
         users_by_id = {u.uid: u for u in User.get_by_id(captain_ids)}
 
+        cached_properties.prefetch(teams)
         team_dicts = [t.to_client_dict() for t in teams]
         for t in team_dicts:
             t['captain_name'] = users_by_id[t['captain_id']].name
@@ -476,7 +480,7 @@ class OrganizationReportData(ApiHandler):
         })
 
 
-class Teams(RestHandler):
+class Teams(PrefetchesCachedProperties, RestHandler):
     model = Team
     requires_auth = True
 
@@ -730,7 +734,7 @@ class Teams(RestHandler):
         self.set_jwt(jwt_helper.encode(payload))
 
 
-class UsersTeams(ApiHandler):
+class UsersTeams(PrefetchesCachedProperties, ApiHandler):
     requires_auth = True
 
     def get(self, user_id):
@@ -764,7 +768,7 @@ class UsersTeams(ApiHandler):
         return self.http_method_not_allowed('GET, HEAD')
 
 
-class OrganizationsTeams(ApiHandler):
+class OrganizationsTeams(PrefetchesCachedProperties, ApiHandler):
     requires_auth = True
 
     def get(self, org_id):
@@ -828,7 +832,7 @@ class OrganizationsUsers(RestHandler):
         self.response.headers['Allow'] = 'GET, HEAD'
 
 
-class Classrooms(RestHandler):
+class Classrooms(PrefetchesCachedProperties, RestHandler):
     model = Classroom
     requires_auth = True
 
@@ -970,26 +974,26 @@ class CheckRoster(RestHandler):
         # Public endpoint for verifying that the student_id appears in the roster
         # of the classroom associated with the provided code.
 
+        # Classroom, team, program, and cycles all come from memcache when
+        # warm, leaving the roster check as the only query.
         code = code.replace('-', ' ')
-        classroom = Classroom.get_by_code(code)
+        context = Classroom.get_code_context(code)
 
-        if not classroom:
+        if not context:
             return self.http_not_found()
 
-        team = Team.get_by_id(classroom.team_id)
-        program = Program.get_by_id(team.program_id)
-
-        if program.use_classrooms:
+        if context['use_classrooms']:
             results = Participant.get_for_classroom(
-                classroom.team_id,
-                classroom.uid,
+                context['team_id'],
+                context['classroom_id'],
                 [student_id],  # get_for_classroom() will strip
             )
         else:
             # Some programs don't use rosters/classrooms, so tell Neptune that
             # any arbitrary student id is "on the roster".
             results = [
-                Participant.create(student_id=student_id, team_id=team.uid)
+                Participant.create(student_id=student_id,
+                                   team_id=context['team_id'])
             ]
 
         if len(results) == 0:
@@ -1000,7 +1004,7 @@ class CheckRoster(RestHandler):
 
         # If there's an active cycle, add some information about it so
         # Neptune can record data differently for different cycles.
-        cycle = Cycle.get_current_for_team(classroom.team_id)
+        cycle_dict = Classroom.get_current_cycle_from_context(context)
         cycle_keys = (
           'uid',
           'team_id',
@@ -1008,8 +1012,7 @@ class CheckRoster(RestHandler):
           'start_date',
           'end_date',
         )
-        if cycle:
-            cycle_dict = cycle.to_client_dict()
+        if cycle_dict:
             response.update(cycle={k: cycle_dict[k] for k in cycle_keys})
         return self.write(response)
 
@@ -1316,15 +1319,6 @@ class Participants(RestHandler):
         return (has_contact_permission(user, classroom) or
                 has_captain_permission(user, team))
 
-    def put(self, id=None):
-        ppt = super(Participants, self).put(id)
-
-        if ppt:
-            affected_classrooms = Classroom.get(team_id=ppt.team_id)
-            for cl in affected_classrooms:
-                cl.num_students = Participant.count_for_classroom(cl.uid)
-            Classroom.put_multi(affected_classrooms)
-
     def patch(self, id=None):
         if id:
             return self.http_method_not_allowed('HEAD, GET, PUT')
@@ -1383,14 +1377,10 @@ class Participants(RestHandler):
                 ppt.classroom_ids.append(classroom_id)
                 updated_ppts.append(ppt)
 
-        # Insert them all at once.
+        # Insert them all at once. This also counts them in num_students of
+        # the classroom.
         Participant.put_multi(new_ppts + updated_ppts)
 
-        # Update num_students on classroom
-        classroom.num_students = \
-            Participant.count_for_classroom(classroom.uid)
-        classroom.put()
-
         self.write(new_ppts + existing_ppts)
 
     def delete(self, id=None):
@@ -1422,6 +1412,100 @@ class Rosters(RestHandler):
             self.write(Participant.get_for_team(team.uid))
 
 
+class ClassroomsRosterImports(RestHandler):
+    model = RosterImport
+    requires_auth = True
+
+    def post(self, classroom_id):
+        """Add students to a classroom from a csv roster.
+
+        The body is csv, with a header row naming the columns, e.g.
+
+            student_id,in_target_group
+            ABC123,true
+
+        Students are saved a chunk at a time, see RosterImport. The body is
+        buffered whole before this runs, so rosters are limited by the request
+        size App Engine allows, but only a chunk of participants is built at
+        once. If the upload fails partway, send the same file again with
+        ?import_id=<uid> to pick up where it left off. Responds with the
+        import and its counts.
+        """
+        classroom = Classroom.get_by_id(classroom_id)
+        if not classroom:
+            return self.http_not_found()
+
+        user = self.get_current_user()
+        team = Team.get_by_id(classroom.team_id)
+        if not (has_contact_permission(user, classroom) or
+                has_captain_permission(user, team)):
+            return self.http_forbidden('must be captain or main contact.')
+
+        # From the query string, so the body is only read as csv.
+        import_id = self.request.GET.get('import_id', None)
+        if import_id:
+            roster_import = RosterImport.get_by_id(import_id)
+            if (
+                not roster_import or
+                roster_import.classroom_id != classroom.uid
+            ):
+                return self.http_not_found()
+            if roster_import.user_id != user.uid:
+                return self.http_forbidden("May only resume your own import.")
+        else:
+            roster_import = None
+
+        try:
+            # Parsed a row at a time from the buffered body, rather than
+            # building every participant first.
+            rows = RosterImport.read_rows(self.request.body_file)
+        except InvalidRoster as e:
+            return self.http_bad_request(e.args[0])
+
+        if roster_import is None:
+            roster_import = RosterImport.create(
+                classroom_id=classroom.uid,
+                team_id=classroom.team_id,
+                user_id=user.uid,
+            )
+            roster_import.put()
+
+        try:
+            roster_import.process(rows)
+        except InvalidRoster as e:
+            return self.http_bad_request(
+                "Invalid roster after row {}: {} Fix the file and send it "
+                "again with ?import_id={} to continue."
+                .format(roster_import.rows_processed, e.args[0],
+                        roster_import.uid)
+            )
+
+        self.write(roster_import)
+
+
+class RosterImports(RestHandler):
+    model = RosterImport
+    requires_auth = True
+
+    def get(self, id=None):
+        """Progress of an import, see ClassroomsRosterImports."""
+        if id is None:
+            return self.http_method_not_allowed('HEAD, GET')
+
+        roster_import = RosterImport.get_by_id(id)
+        if not roster_import:
+            return self.http_not_found()
+
+        user = self.get_current_user()
+        if (
+            roster_import.user_id != user.uid and
+            not owns(user, roster_import.classroom_id)
+        ):
+            return self.http_forbidden()
+
+        self.write(roster_import)
+
+
 api_routes = [
     Route('/api/invitations', Invitations),
     Route('/api/version', Version),
@@ -1468,6 +1552,8 @@ api_routes = [
     Route('/api/<parent_type:teams>/<rel_id>/survey', TeamsSurvey),
 
     Route('/api/reports', Reports),
+    # Before /api/reports/<id>, which would also match.
+    Route('/api/reports/batch', ReportBatches),
     Route('/api/reports/<id>', Reports),
     Route('/api/<parent_type:(networks|organizations|teams)>/<rel_id>/reports',
           ParentReports),
@@ -1486,12 +1572,20 @@ api_routes = [
 
     Route('/api/responses', Responses),
     Route('/api/responses/<id>', Responses),
+    Route('/api/responses/<id>/history', ResponsesHistory),
     Route('/api/<parent_type:teams>/<rel_id>/responses', TeamsResponses),
+    Route('/api/<parent_type:(teams|cycles|programs)>/<rel_id>/responses/export',
+          ResponsesExport),
 
     Route('/api/participants', Participants),
     Route('/api/participants/<id>', Participants),
+    Route('/api/classrooms/<classroom_id>/roster_imports',
+          ClassroomsRosterImports),
+    Route('/api/roster_imports/<id>', RosterImports),
     Route('/api/<parent_type:(teams|classrooms)>/<rel_id>/participants',
           Rosters),
+    Route('/api/<parent_type:(teams|classrooms|programs)>/<rel_id>/participants/export',
+          ParticipantsExport),
 
     Route('/api/digests', Digests),
     Route('/api/digests/<id>', Digests),
@@ -0,0 +1,38 @@
+"""
+Counters
+===========
+
+Simple operational metrics, e.g. cache hits or bytes uploaded, kept as
+memcache counters. They're approximate: memcache may drop them at any time,
+so read them as "since about when the counter was last evicted", and log
+anything that must not be lost. Gauges, e.g. how far behind a queue is, are
+kept the same way but overwritten rather than added to.
+
+Counters are grouped by a prefix, one per feature, e.g.
+
+    counters.increment('participation', {'hit': 3, 'miss': 1})
+    counters.get('participation', ['hit', 'miss'])  # {'hit': 3, 'miss': 1}
+"""
+from google.appengine.api import memcache
+
+
+def key(prefix, name):
+    return 'counter:{}:{}'.format(prefix, name)
+
+
+def increment(prefix, counts):
+    """Add to counters. Args: prefix - str, counts - dict of name to int."""
+    increments = {key(prefix, n): v for n, v in counts.items() if v}
+    if increments:
+        memcache.offset_multi(increments, initial_value=0)
+
+
+def record(prefix, values):
+    """Set gauges. Args: prefix - str, values - dict of name to number."""
+    memcache.set_multi({key(prefix, n): v for n, v in values.items()})
+
+
+def get(prefix, names):
+    """Dict of name to current count, zero if never set."""
+    stored = memcache.get_multi([key(prefix, n) for n in names])
+    return {n: stored.get(key(prefix, n), 0) for n in names}
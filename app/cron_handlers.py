@@ -1,5 +1,4 @@
 from google.appengine.api import taskqueue
-from google.appengine.api import urlfetch
 from oauth2client.service_account import ServiceAccountCredentials
 import cloudstorage as gcs
 import datetime
@@ -17,14 +16,19 @@ from model import (
     Email,
     ErrorChecker,
     Notification,
+    Organization,
     Program,
     Report,
+    ResponseBackup,
+    ResponseHistory,
     SecretValue,
     Team,
     User,
+    keyset,
 )
 import config
 import cron_rserve
+import schema_check
 import slow_query
 import util
 
@@ -116,6 +120,8 @@ class TeamParticipation(CronHandler):
     across a whole team in a given cycle by querying it periodically and
     storing it with the cycle.
     """
+    team_participation_shard_size = 100
+
     def get(self, date_str=None):
         try:
             # Make sure this is a valid date.
@@ -123,16 +129,21 @@ class TeamParticipation(CronHandler):
         except:
             date_str = util.datelike_to_iso_string(datetime.date.today())
 
-        # Launch a separate task to get participation for each team, to make
-        # sure we can scale memory and cpu time easily.
-        teams = Team.get(n=float('inf'))
-        for t in teams:
+        # Launch a separate task to get participation for each shard of
+        # teams, so memory and cpu time scale easily, while each task still
+        # combines many classrooms into few requests to Neptune.
+        # Each page of teams is a shard, so only one page is in memory.
+        team_ids = []
+        shards = keyset.pages(Team, n=self.team_participation_shard_size)
+        for teams in shards:
+            shard_ids = [t.uid for t in teams]
             taskqueue.add(
-                url='/task/{}/team_participation/{}'.format(t.uid, date_str),
+                url='/task/team_participation_batch/{}'.format(date_str),
+                params={'team_ids': ','.join(shard_ids)},
                 queue_name='default',
             )
+            team_ids += shard_ids
 
-        team_ids = [t.uid for t in teams]
         logging.info("Started tasks for {} teams".format(len(team_ids)))
         self.response.write(json.dumps({'team_ids': team_ids}))
 
@@ -152,6 +163,15 @@ class RServeReports(CronHandler):
         should_force = self.request.get('force', 'false') == 'true'
         really_send = self.request.get('really_send', 'true') == 'true'
 
+        # Optionally split the units into tasks, each with its own call to
+        # RServe, so one slow call doesn't time out the whole program.
+        try:
+            batch_size = int(self.request.get('batch_size', 0))
+        except ValueError:
+            self.error(400)
+            self.response.write("Invalid batch_size, expected an integer.")
+            return
+
         script_to_label = {
             'ep': 'ep19',
             'beleset': 'beleset19',
@@ -186,35 +206,17 @@ class RServeReports(CronHandler):
             self.write(fetch_params)
             return
 
-        try:
-            result = urlfetch.fetch(**fetch_params)
-        except urlfetch.DeadlineExceededError as e:
-            logging.warning(
-                "RServe took a long time to reply (caught a "
-                "DeadlineExceededError). Exiting without checking "
-                "results. Original error message follows."
+        if batch_size > 0:
+            num_tasks = cron_rserve.queue_batches(
+                script,
+                payload['reporting_units'],
+                batch_size,
+                send_email=self.request.get('send_email', None) != 'false',
             )
-            logging.warning(e.message)
+            self.write({'tasks': num_tasks})
             return
 
-        if not result:
-            raise Exception("No response from RServe.")
-
-        if result.status_code >= 300:
-            # App Engine will consider this cron job to have failed, and will
-            # follow any retry instructions in cron.yaml.
-            raise Exception("Non-successful response from RServe: {} {}"
-                            .format(result.status_code, result.content))
-
-        logging.info("response status: {}".format(result.status_code))
-        try:
-            json.loads(result.content)
-            # ok, it's valid
-            logging.info(util.truncate_json(result.content))
-            logging.info(result.content)
-        except:
-            # just log as text
-            logging.info(result.content)
+        cron_rserve.send(script, payload)
 
 
 class RServeStatus(CronHandler):
@@ -352,6 +354,45 @@ class ReleasePreviews(CronHandler):
         return notes
 
 
+class BackupResponses(CronHandler):
+    """Write buffered response backups in batches, see ResponseBackup."""
+    def get(self):
+        self.write(ResponseBackup.drain())
+
+
+class RecomputeCachedProperties(CronHandler):
+    """Recompute cached counts marked out of date, see
+    HasCachedProperties.mark_dirty()."""
+    def get(self):
+        self.write({
+            model.__name__: model.recompute_dirty()
+            for model in (Classroom, Organization, Team)
+        })
+
+
+class ReconcileNumStudents(CronHandler):
+    """Fix classroom num_students that has drifted from the roster, see
+    Classroom.reconcile_num_students()."""
+    def get(self):
+        self.write(Classroom.reconcile_num_students())
+
+
+class CheckIndices(CronHandler):
+    """Log indices that models declare but the db lacks, see
+    schema_check.check_indices()."""
+    def get(self):
+        self.write(schema_check.check_indices())
+
+
+class CompactResponseHistory(CronHandler):
+    """Fold old response history into daily snapshots, see
+    ResponseHistory.compact(). Compacts a limited number of responses each
+    run; the rest are left for the next."""
+    def get(self):
+        self.write(ResponseHistory.compact(
+            max_responses=ResponseHistory.max_responses_per_compact))
+
+
 class ExportSlowQueryLog(CronHandler):
     def get(self):
         log_bucket = 'tritonplatform-logs'
@@ -405,6 +446,11 @@ cron_routes = [
     Route('/cron/rserve/status/<action:(serving|stopped)>', RServeStatus),
     Route('/cron/release_previews', ReleasePreviews),
     Route('/cron/export_slow_query_log', ExportSlowQueryLog),
+    Route('/cron/backup_responses', BackupResponses),
+    Route('/cron/recompute_cached_properties', RecomputeCachedProperties),
+    Route('/cron/reconcile_num_students', ReconcileNumStudents),
+    Route('/cron/compact_response_history', CompactResponseHistory),
+    Route('/cron/check_indices', CheckIndices),
     Route('/cron/sql_backup/<instance>/<db>/<bucket>', BackupSqlToGcsHandler),
     Route('/cron/clean_gcs_bucket/<bucket>', CleanGcsBucket),
 ]
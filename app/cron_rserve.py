@@ -3,35 +3,81 @@
 import json
 import logging
 import os
+from google.appengine.api import taskqueue
 from google.appengine.api import urlfetch
 
 from gae_handlers import rserve_jwt
 from gae_models import DatastoreModel
-from model import Classroom, Organization, Report, SecretValue, Team
+from model import Classroom, Organization, SecretValue, Team, keyset
+import mysql_connection
 import util
 
 
+# Push queue for RServe batches, see queue.yaml.
+queue_name = 'rserve'
+
+
 def get_report_parents(program, week, should_force):
     # Look up teams and classrooms relevant to the requested script.
-    orgs = Organization.get(program_id=program.uid, n=float('inf'))
-    teams = Team.get(program_id=program.uid, n=float('inf'))
-    classrooms = Classroom.get_by_program(program.uid)
-
     if should_force:
         # Don't skip any, re-request them all.
-        skip_parent_ids = []
-    else:
-        # Find all the reports for the current period that have already
-        # been generated and don't re-request them.
-        existing_reports = Report.get(issue_date=week, n=float('inf'))
-        skip_parent_ids = [r.parent_id for r in existing_reports]
+        # The payload lists them all, but read them a page at a time.
+        where = {'program_id': program.uid}
+        return (
+            list(keyset.walk(Organization, where, n=1000)),
+            list(keyset.walk(Team, where, n=1000)),
+            Classroom.get_by_program(program.uid),
+        )
 
+    # Skip any that already have a report for the current period, letting
+    # the db match them up.
     return (
-        [o for o in orgs if o.uid not in skip_parent_ids],
-        [t for t in teams if t.uid not in skip_parent_ids],
-        [c for c in classrooms if c.uid not in skip_parent_ids],
+        get_unreported(Organization, program.uid, week),
+        get_unreported(Team, program.uid, week),
+        get_unreported(Classroom, program.uid, week),
     )
 
+
+def get_unreported(klass, program_id, week):
+    """Entities of a program with no report issued on the given date.
+
+    Args:
+        klass - one of Organization, Team, or Classroom.
+        program_id - str
+        week - str, YYYY-MM-DD, the issue date of the reports.
+    """
+    if klass is Classroom:
+        # Classrooms only know their program through their team.
+        program_join = 'JOIN `team` t ON p.`team_id` = t.`uid`'
+        program_field = 't.`program_id`'
+    else:
+        program_join = ''
+        program_field = 'p.`program_id`'
+
+    # Reports with other dates are dropped by the IS NULL, so each parent
+    # appears at most once.
+    query = '''
+        SELECT p.*
+        FROM `{table}` p
+        {program_join}
+        LEFT JOIN `report` r
+          ON r.`parent_id` = p.`uid`
+          AND r.`issue_date` = %s
+        WHERE {program_field} = %s
+          AND r.`uid` IS NULL
+    '''.format(
+        table=klass.table,
+        program_join=program_join,
+        program_field=program_field,
+    )
+    params = (week, program_id)
+
+    with mysql_connection.connect() as sql:
+        row_dicts = sql.select_query(query, params)
+
+    return [klass.row_dict_to_obj(d) for d in row_dicts]
+
+
 def build_payload(orgs, teams, all_classrooms, secrets, ru_whitelist=[]):
     """Compose the request payload RServe expects to start a job.
 
@@ -51,48 +97,67 @@ def build_payload(orgs, teams, all_classrooms, secrets, ru_whitelist=[]):
 
     # Further filter by whitelist, if present.
     if len(ru_whitelist) > 0:
+        ru_whitelist = set(ru_whitelist)
         orgs = [o for o in orgs if o.uid in ru_whitelist]
         teams = [t for t in teams if t.uid in ru_whitelist]
         classrooms = [c for c in classrooms if c.uid in ru_whitelist]
 
-    rep_unit_entities = orgs + teams + classrooms
+    url_bases = get_url_bases()
     payload = {
-        'reporting_units': [
-            build_reporting_unit(obj) for obj in rep_unit_entities
-        ],
+        'reporting_units': (
+            [build_reporting_unit(o, 'Organization', url_bases)
+             for o in orgs] +
+            [build_reporting_unit(t, 'Team', url_bases) for t in teams] +
+            [build_reporting_unit(c, 'Classroom', url_bases)
+             for c in classrooms]
+        ),
     }
 
     for s in secrets:
         payload[s] = secrets[s]
 
-    logging.info("organizations: {}".format(len(teams)))
+    logging.info("organizations: {}".format(len(orgs)))
     logging.info("teams: {}".format(len(teams)))
     logging.info("classrooms: {}".format(len(classrooms)))
     logging.info("reporting units:")
-    logging.info("\n".join(e.uid for e in rep_unit_entities))
+    logging.info("\n".join(ru['id'] for ru in payload['reporting_units']))
 
     return payload
 
 
-def build_reporting_unit(entity):
-    """Compose dict describing one unit for which to generate a report."""
-    neptune_url_base = '{protocol}://{domain}'.format(
-        protocol='http' if util.is_localhost() else 'https',
-        domain=('localhost:8888' if util.is_localhost()
-                else os.environ['NEPTUNE_DOMAIN']),
-    )
-    triton_url_base = '{protocol}://{domain}'.format(
-        protocol='http' if util.is_localhost() else 'https',
-        domain=('localhost:10080' if util.is_localhost()
-                else os.environ['HOSTING_DOMAIN']),
-    )
+def get_url_bases():
+    """Protocol and domain of Neptune and Triton, for RServe to post to."""
+    return {
+        'neptune': '{protocol}://{domain}'.format(
+            protocol='http' if util.is_localhost() else 'https',
+            domain=('localhost:8888' if util.is_localhost()
+                    else os.environ['NEPTUNE_DOMAIN']),
+        ),
+        'triton': '{protocol}://{domain}'.format(
+            protocol='http' if util.is_localhost() else 'https',
+            domain=('localhost:10080' if util.is_localhost()
+                    else os.environ['HOSTING_DOMAIN']),
+        ),
+    }
+
+
+def build_reporting_unit(entity, kind=None, url_bases=None):
+    """Compose dict describing one unit for which to generate a report.
+
+    When building many, pass the kind and get_url_bases() rather than working
+    them out for each one.
+    """
+    if kind is None:
+        kind = DatastoreModel.get_kind(entity)
+    if url_bases is None:
+        url_bases = get_url_bases()
 
     # Assemble the URLs that RServe will need to post back to.
     dataset_url = '{base}/api/datasets?parent_id={parent_id}'.format(
-        base=neptune_url_base,
+        base=url_bases['neptune'],
         parent_id=entity.uid,
     )
-    report_url = '{base}/api/reports'.format(base=triton_url_base)
+    report_url = '{base}/api/reports'.format(base=url_bases['triton'])
 
     reporting_unit = {
         'id': entity.uid,
@@ -101,11 +166,11 @@ def build_reporting_unit(entity):
         'post_url': dataset_url,
         'post_report_url': report_url,
     }
-    if DatastoreModel.get_kind(entity) == 'Organization':
+    if kind == 'Organization':
         reporting_unit['organization_id'] = entity.uid
-    elif DatastoreModel.get_kind(entity) == 'Team':
+    elif kind == 'Team':
         reporting_unit['team_id'] = entity.uid
-    elif DatastoreModel.get_kind(entity) == 'Classroom':
+    elif kind == 'Classroom':
         # This kind of report needs two ids because it reports on two levels
         # at once. Classroom data is present in the context of team data.
         reporting_unit['team_id'] = entity.team_id
@@ -113,6 +178,66 @@ def build_reporting_unit(entity):
     return reporting_unit
 
 
+def queue_batches(script, reporting_units, batch_size, send_email=True):
+    """Split reporting units into tasks that each call RServe, so one slow
+    call only holds up its own batch. See task_handlers.RServeReportsBatch.
+
+    Secrets aren't put in the tasks; each task looks them up.
+
+    Returns number of tasks queued.
+    """
+    url = '/task/rserve_reports/{}'.format(script)
+    if not send_email:
+        url = util.set_query_parameters(url, send_email='false')
+
+    num_tasks = 0
+    for i in range(0, len(reporting_units), batch_size):
+        taskqueue.add(
+            url=url,
+            payload=json.dumps(reporting_units[i:i + batch_size]),
+            headers={'Content-Type': 'application/json'},
+            queue_name=queue_name,
+        )
+        num_tasks += 1
+
+    logging.info("Queued {} RServe tasks for {} reporting units."
+                 .format(num_tasks, len(reporting_units)))
+    return num_tasks
+
+
+def send(script, payload):
+    """Post a payload to RServe and check the result."""
+    try:
+        result = urlfetch.fetch(**get_fetch_params(script, payload))
+    except urlfetch.DeadlineExceededError as e:
+        logging.warning(
+            "RServe took a long time to reply (caught a "
+            "DeadlineExceededError). Exiting without checking "
+            "results. Original error message follows."
+        )
+        logging.warning(e.message)
+        return
+
+    if not result:
+        raise Exception("No response from RServe.")
+
+    if result.status_code >= 300:
+        # App Engine will consider this cron job or task to have failed, and
+        # will follow any retry instructions in cron.yaml or queue.yaml.
+        raise Exception("Non-successful response from RServe: {} {}"
+                        .format(result.status_code, result.content))
+
+    logging.info("response status: {}".format(result.status_code))
+    try:
+        json.loads(result.content)
+        # ok, it's valid
+        logging.info(util.truncate_json(result.content))
+        logging.info(result.content)
+    except:
+        # just log as text
+        logging.info(result.content)
+
+
 def get_fetch_params(script, payload):
     """Designed to be used as kwargs in urlfetch.fetch()"""
     return {
@@ -0,0 +1,70 @@
+"""
+Export
+===========
+
+Writing exports of whole tables, e.g. every participant in a program, as
+newline-delimited json or csv.
+
+App Engine holds a whole response in instance memory before sending it, up to
+32MB, so an export is served a page at a time rather than all at once. Each
+page is read with a keyset cursor (see model/keyset.py) and links to the next
+in its Link header; clients follow the links until there isn't one.
+
+    participants, cursor = Participant.export('Team', team_id, n=page_size)
+    lines = export.ndjson_lines(p.to_client_dict() for p in participants)
+"""
+import csv
+import datetime
+import json
+import StringIO
+
+import config
+import util
+
+
+# Rows per page of an export, if not specified. Pages of more than
+# max_page_size are served as that many.
+page_size = 1000
+max_page_size = 1000
+
+content_types = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def ndjson_lines(dicts):
+    """Generate a line of json for each dict."""
+    for d in dicts:
+        yield json.dumps(d, default=util.json_dumps_default) + '\n'
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.strftime(config.iso_datetime_format)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (str, bool, int, long, float)):
+        return value
+    # Lists and dicts, e.g. classroom_ids or a response body.
+    return json.dumps(value, default=util.json_dumps_default)
+
+
+def csv_lines(dicts, columns):
+    """Generate a header line naming columns, then a line for each dict."""
+    buffer = StringIO.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(columns)
+    yield flush()
+    for d in dicts:
+        writer.writerow([csv_value(d.get(c, None)) for c in columns])
+        yield flush()
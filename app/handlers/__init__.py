@@ -1,8 +1,9 @@
 from .emails import Emails
+from .exports import ParticipantsExport, ResponsesExport
 from .mandrill_templates import MandrillTemplates
 from .networks import Networks, NetworkCode, UsersNetworks
 from .organization_dashboards import OrganizationDashboards
-from .reports import ReportPdf, Reports, ParentReports
-from .responses import Responses, TeamsResponses
+from .reports import ReportBatches, ReportPdf, Reports, ParentReports
+from .responses import Responses, ResponsesHistory, TeamsResponses
 from .programs import Programs
 from .programs_search import ProgramsSearch
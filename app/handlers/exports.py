@@ -0,0 +1,171 @@
+import datetime
+
+from gae_handlers import RestHandler
+from model import (Classroom, Cycle, Participant, Program, Response, Team,
+                   keyset)
+from permission import has_captain_permission, owns
+import config
+import export
+import util
+
+
+class Export(RestHandler):
+    """Writes a page of the entities of a parent as ndjson or csv.
+
+    Query string params:
+        format: 'ndjson' (default) or 'csv'. Every csv page starts with a
+            header line.
+        modified_since: iso datetime, only entities modified at or after this
+            time. Exports are in order of modified, so the last modified time
+            seen is the next export's modified_since. Entities modified in
+            that same second are sent again.
+        n: int, entities per page, at most max_page_size.
+        cursor: str, where to pick up, from the url in the previous page's
+            Link header. There's no Link header on the last page.
+    """
+    requires_auth = True
+
+    # See the export module.
+    page_size = export.page_size
+    max_page_size = export.max_page_size
+
+    def write_page(self, get_page, filename):
+        """Respond with a page of entities, and a link to the next.
+
+        Args:
+            get_page: function taking modified_since, cursor, and n, and
+                returning a tuple of (list of entities, next cursor), e.g.
+                Participant.export().
+            filename: str, without extension.
+        """
+        export_format = self.request.get('format', 'ndjson')
+        if export_format not in export.content_types:
+            return self.http_bad_request(
+                "Invalid `format`, expected one of: {}"
+                .format(', '.join(sorted(export.content_types))))
+
+        since_str = self.request.get('modified_since', None)
+        if since_str:
+            try:
+                modified_since = datetime.datetime.strptime(
+                    since_str, config.iso_datetime_format)
+            except ValueError:
+                return self.http_bad_request(
+                    "Invalid `modified_since`, expected an iso datetime: {}"
+                    .format(since_str))
+        else:
+            modified_since = None
+
+        try:
+            n = min(int(self.request.get('n', self.page_size)),
+                    self.max_page_size)
+        except ValueError:
+            n = 0
+        if n < 1:
+            return self.http_bad_request("Invalid `n`.")
+
+        try:
+            entities, next_cursor = get_page(
+                modified_since, self.request.get('cursor', None), n)
+        except keyset.InvalidCursor:
+            return self.http_bad_request("Invalid `cursor`.")
+
+        dicts = (e.to_client_dict() for e in entities)
+        if export_format == 'csv':
+            columns = [f.name
+                       for f in self.model.py_table_definition['fields']]
+            lines = export.csv_lines(dicts, columns)
+        else:
+            lines = export.ndjson_lines(dicts)
+
+        self.response.headers.update({
+            'Cache-Control': 'private, no-cache',
+            'Content-Disposition': 'attachment; filename={}.{}'.format(
+                filename, export_format),
+            'Content-Type': export.content_types[export_format],
+        })
+        # Same params, picking up after this page.
+        if next_cursor:
+            next_url = util.set_query_parameters(
+                self.request.url, cursor=next_cursor)
+            self.response.headers['Link'] = '<{}>; rel="next"'.format(
+                next_url)
+
+        for line in lines:
+            self.response.write(line)
+
+    def post(self, *args, **kwargs):
+        self.http_method_not_allowed('GET, HEAD')
+
+    def put(self, *args, **kwargs):
+        self.http_method_not_allowed('GET, HEAD')
+
+    def delete(self, *args, **kwargs):
+        self.http_method_not_allowed('GET, HEAD')
+
+
+class ParticipantsExport(Export):
+    model = Participant
+
+    def get(self, parent_type, rel_id):
+        user = self.get_current_user()
+
+        if parent_type == 'programs':
+            parent = Program.get_by_id(rel_id)
+            if not parent:
+                return self.http_not_found()
+            if not user.super_admin:
+                return self.http_forbidden(
+                    "Only super admins can export a program.")
+        else:
+            klass = Team if parent_type == 'teams' else Classroom
+            parent = klass.get_by_id(rel_id)
+            if not parent:
+                return self.http_not_found()
+            if not owns(user, parent):
+                return self.http_forbidden("Must be on the team.")
+
+        kind = Participant.get_kind(parent.uid)
+        return self.write_page(
+            lambda since, cursor, n: Participant.export(
+                kind, parent.uid, since, cursor, n),
+            '{}-participants'.format(parent.short_uid),
+        )
+
+
+class ResponsesExport(Export):
+    model = Response
+
+    # Bodies make responses much bigger than other entities, and a whole page
+    # has to fit in instance memory.
+    page_size = 100
+    max_page_size = 100
+
+    def get(self, parent_type, rel_id):
+        user = self.get_current_user()
+
+        if parent_type == 'programs':
+            parent = Program.get_by_id(rel_id)
+            if not parent:
+                return self.http_not_found()
+            if not user.super_admin:
+                return self.http_forbidden(
+                    "Only super admins can export a program.")
+        else:
+            klass = Team if parent_type == 'teams' else Cycle
+            parent = klass.get_by_id(rel_id)
+            if not parent:
+                return self.http_not_found()
+            team = (parent if parent_type == 'teams'
+                    else Team.get_by_id(parent.team_id))
+            if not owns(user, team) and not has_captain_permission(user, team):
+                return self.http_forbidden(
+                    "Only team members can get responses.")
+
+        # Private bodies are redacted as in TeamsResponses.
+        kind = Response.get_kind(parent.uid)
+        return self.write_page(
+            lambda since, cursor, n: Response.export(
+                user, kind, parent.uid, since, cursor, n),
+            '{}-responses'.format(parent.short_uid),
+        )
@@ -1,7 +1,8 @@
 import logging
 
 from gae_handlers import ApiHandler
-from model import Classroom, Cycle, Organization, Response, Team, User
+from model import (Classroom, Cycle, Organization, Response, Team, User,
+                   cached_properties)
 from permission import owns
 
 class OrganizationDashboards(ApiHandler):
@@ -22,6 +23,7 @@ class OrganizationDashboards(ApiHandler):
         responses = Response.get_for_teams(user, team_ids)
         users = User.query_by_team(team_ids)
 
+        cached_properties.prefetch(classrooms + teams)
         self.write({
             'classrooms': [e.to_client_dict() for e in classrooms],
             'cycles': [e.to_client_dict() for e in cycles],
@@ -1,7 +1,8 @@
 import logging
 
 from gae_handlers import RestHandler
-from model import Classroom, Organization, Program, Team, User
+from model import (Classroom, Organization, Program, Team, User,
+                   cached_properties)
 from permission import owns
 
 
@@ -35,6 +36,7 @@ class ProgramsSearch(RestHandler):
         classrooms = Classroom.query_by_name(search_str, program.uid)
         users = User.query_by_name_or_email(search_str)
 
+        cached_properties.prefetch(orgs + teams + classrooms)
         self.write({
             'organizations': [e.to_client_dict() for e in orgs],
             'teams': [e.to_client_dict() for e in teams],
@@ -48,6 +50,7 @@ class ProgramsSearch(RestHandler):
         teams = Team.query_by_user(user, program_id)
         classrooms = Classroom.query_by_contact(user, program_id)
 
+        cached_properties.prefetch(orgs + teams + classrooms)
         return {
             'organizations': [e.to_client_dict() for e in orgs],
             'teams': [e.to_client_dict() for e in teams],
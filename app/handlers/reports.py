@@ -1,8 +1,12 @@
+from google.appengine.ext import blobstore
 import cloudstorage as gcs
 import hashlib
+import json
 import logging
 import os
+import re
 
+import counters
 import jwt_helper
 import util
 from gae_handlers import ApiHandler, RestHandler
@@ -14,13 +18,16 @@ from model import (
     SqlModel,
     Team,
 )
-from permission import has_captain_permission, has_contact_permission, owns
+from permission import filter_owned, has_captain_permission, owns
 
 
 class Reports(RestHandler):
     model = Report
     requires_auth = False  # Custom implentation; accepts rsa-based jwts also
 
+    # Bytes of an upload read at a time.
+    chunk_size = 1024 * 1024
+
     def patch(self):
         # Allow RServe to call this endpoint, then fall back on regular auth.
         user, error = self.authenticate_rserve()
@@ -172,12 +179,14 @@ class Reports(RestHandler):
     def save_file(self, filename, field_storage, org_id=None, team_id=None,
                   classroom_id=None):
         """GCS files are saved by their md5 hash, so uploading the same file
-        many times has no effect (other than io). Uploading a different file to
-        the same classroom and filename changes the reference on the report
-        object in the db, but doesn't delete previous uploads in cloud storage.
+        many times has no effect; if the hash is already stored the file isn't
+        written again. Uploading a different file to the same classroom and
+        filename changes the reference on the report object in the db, but
+        doesn't delete previous uploads in cloud storage.
         A history of uploads for a given report can be found by searching the
         upload bucket for files with the header 'x-goog-meta-task-id:[classroom
-        uid]'.
+        uid]', although a file stored first for another classroom will only
+        have that classroom's header.
 
         Filenames as uploaded are preserved:
 
@@ -206,11 +215,15 @@ class Reports(RestHandler):
         # type: str, MIME type, e.g. 'application/pdf'
         # filename: str, file name as uploaded
 
-        file_contents = field_storage.file.read()
-        file_hash = hashlib.md5(file_contents).hexdigest()
-
-        field_storage.file.seek(0, os.SEEK_END)
-        file_size = field_storage.file.tell()
+        # Hash and measure the upload a chunk at a time, rather than holding
+        # all of it in memory.
+        md5 = hashlib.md5()
+        file_size = 0
+        field_storage.file.seek(0)
+        for chunk in iter(lambda: field_storage.file.read(self.chunk_size), ''):
+            md5.update(chunk)
+            file_size += len(chunk)
+        file_hash = md5.hexdigest()
 
         content_type = field_storage.type
 
@@ -220,23 +233,45 @@ class Reports(RestHandler):
             file_hash,
         )
 
-        open_kwargs = {
-            'content_type': content_type,
-            # These will be headers on the stored file.
-            'options': dict(
-                {
-                    # Not actually used, but seems smart to keep track of.
-                    'Content-Disposition': 'attachment; filename=' + filename,
-                },
-                # Theoretically allows figuring out an attachment history for
-                # a given classroom.
-                **meta_headers
-            ),
-            'retry_params': gcs.RetryParams(backoff_factor=1.1),
-        }
+        try:
+            gcs.stat(gcs_path)
+            exists = True
+        except gcs.NotFoundError:
+            exists = False
+
+        if exists:
+            counters.increment('report_uploads', {
+                'files_deduplicated': 1,
+                'bytes_deduplicated': file_size,
+            })
+        else:
+            open_kwargs = {
+                'content_type': content_type,
+                # These will be headers on the stored file.
+                'options': dict(
+                    {
+                        # Not actually used, but seems smart to keep track
+                        # of.
+                        'Content-Disposition':
+                            'attachment; filename=' + filename,
+                    },
+                    # Theoretically allows figuring out an attachment history
+                    # for a given classroom.
+                    **meta_headers
+                ),
+                'retry_params': gcs.RetryParams(backoff_factor=1.1),
+            }
 
-        with gcs.open(gcs_path, 'w', **open_kwargs) as gcs_file:
-            gcs_file.write(file_contents)
+            field_storage.file.seek(0)
+            with gcs.open(gcs_path, 'w', **open_kwargs) as gcs_file:
+                for chunk in iter(
+                        lambda: field_storage.file.read(self.chunk_size), ''):
+                    gcs_file.write(chunk)
+
+            counters.increment('report_uploads', {
+                'files_written': 1,
+                'bytes_written': file_size,
+            })
 
         report = Report.create(
             organization_id=org_id,
@@ -288,6 +323,158 @@ class Reports(RestHandler):
             self.error(404)
 
 
+class ReportBatches(Reports):
+    """Save many dataset-based reports in one request, for RServe.
+
+    Takes a JSON array, or one JSON object per line if the content type is
+    application/x-ndjson. Each object has the same params as a JSON POST to
+    /api/reports. Responds with a result for each, in order, like
+
+        {'status': 200, 'uid': 'Report_XYZ'}
+        {'status': 400, 'error': "Team not found: Team_XYZ"}
+
+    so failures can be retried individually.
+    """
+
+    def post(self):
+        # Allow RServe to call this endpoint, then fall back on regular auth.
+        user, error = self.authenticate_rserve()
+        if not user:
+            user = self.get_current_user()
+            error = ''
+
+        # Replaces function of `requires_auth = True`.
+        if user.user_type == 'public':
+            return self.http_unauthorized()
+
+        if not user.super_admin:
+            return self.http_forbidden()
+
+        records = self.parse_records()
+        if records is None:
+            return self.http_bad_request(
+                "Expected a JSON array, or application/x-ndjson.")
+
+        # Look up all the parents at once.
+        ids = {'classroom_id': set(), 'team_id': set(),
+               'organization_id': set()}
+        for record in records:
+            if isinstance(record, dict):
+                for k in ids:
+                    if record.get(k, None):
+                        ids[k].add(str(record[k]))
+
+        classrooms = {c.uid: c for c in
+                      Classroom.get_by_id(list(ids['classroom_id'])) if c}
+        ids['team_id'].update(c.team_id for c in classrooms.values())
+        teams = {t.uid: t for t in Team.get_by_id(list(ids['team_id'])) if t}
+        orgs = {o.uid: o for o in
+                Organization.get_by_id(list(ids['organization_id'])) if o}
+
+        results = []
+        reports = []
+        for record in records:
+            report, error = self.record_to_report(record, classrooms, teams,
+                                                  orgs)
+            if error:
+                results.append({'status': 400, 'error': error})
+            else:
+                results.append(None)
+                reports.append(report)
+
+        saved = iter(Report.put_multi_for_parent_file(reports))
+        results = [r or {'status': 200, 'uid': next(saved).uid}
+                   for r in results]
+
+        self.write(results)
+
+    def parse_records(self):
+        """List of decoded records; None if the body is unreadable. Lines of
+        ndjson that aren't valid stay in the list as strings, to be reported
+        as errors individually."""
+        content_type = self.request.headers.get('Content-Type', '')
+        if 'application/x-ndjson' in content_type:
+            records = []
+            for line in self.request.body.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    records.append(line)
+            return records
+
+        try:
+            records = json.loads(self.request.body)
+        except ValueError:
+            return None
+        return records if isinstance(records, list) else None
+
+    def record_to_report(self, record, classrooms, teams, orgs):
+        """Returns (report, error message)."""
+        if not isinstance(record, dict):
+            return (None, "Invalid record: {}".format(record))
+
+        def get(k, type_):
+            v = record.get(k, None)
+            return None if v is None else type_(v)
+
+        org_id = get('organization_id', str)
+        team_id = get('team_id', str)
+        classroom_id = get('classroom_id', str)
+
+        if classroom_id:
+            if classroom_id not in classrooms:
+                return (None, "Classroom not found: {}".format(classroom_id))
+            team_id = classrooms[classroom_id].team_id
+        if team_id and team_id not in teams:
+            return (None, "Team not found: {}".format(team_id))
+        if org_id and org_id not in orgs:
+            return (None, "Organization not found: {}".format(org_id))
+        if not get('filename', unicode):
+            return (None, "Missing filename.")
+
+        kwargs = {
+            'classroom_id': classroom_id,
+            'dataset_id': get('dataset_id', str),
+            'filename': get('filename', unicode),
+            'issue_date': get('issue_date', str),
+            'notes': get('notes', unicode),
+            'organization_id': org_id,
+            'team_id': team_id,
+            'template': get('template', str),
+        }
+        # As with a single POST, leave preview out if absent so it gets the
+        # default value defined in the db. Strings like "false" are read as
+        # get_param() would, rather than as truthy.
+        preview = record.get('preview', None)
+        if preview in (True, False):
+            kwargs['preview'] = bool(preview)
+        elif (isinstance(preview, basestring) and
+              preview.lower() in ('true', 'false')):
+            kwargs['preview'] = preview.lower() == 'true'
+        elif preview is not None:
+            return (None, "Invalid preview, expected a boolean: {}"
+                          .format(preview))
+
+        try:
+            return (Report.create(**kwargs), None)
+        except Exception as e:
+            return (None, unicode(e))
+
+    def get(self, *args, **kwargs):
+        self.http_method_not_allowed('POST')
+
+    def put(self, *args, **kwargs):
+        self.http_method_not_allowed('POST')
+
+    def patch(self, *args, **kwargs):
+        self.http_method_not_allowed('POST')
+
+    def delete(self, *args, **kwargs):
+        self.http_method_not_allowed('POST')
+
+
 class ParentReports(ApiHandler):
     def get(self, parent_type, rel_id):
         if parent_type == 'networks':
@@ -359,12 +546,7 @@ class ParentReports(ApiHandler):
 
         # ...but limit access to classroom reports.
         classroom_reports = [r for r in all_reports if r.classroom_id]
-        classroom_ids = [r.classroom_id for r in classroom_reports]
-        classrooms = {c.uid: c for c in Classroom.get_by_id(classroom_ids)}
-
-        for report in classroom_reports:
-            if has_contact_permission(user, classrooms[report.classroom_id]):
-                allowed_reports.append(report)
+        allowed_reports += filter_owned(user, classroom_reports)
 
         # Add a custom link for users to access each report.
         self.write([
@@ -419,6 +601,9 @@ class ReportPdf(ApiHandler):
     model = Report
     requires_auth = False  # we'll use a token in the query string instead
 
+    md5_pattern = re.compile(r'^[0-9a-f]{32}$')
+    range_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+
     def get(self, parent_type, rel_id, filename):
         # Always require a jwt that specifies this path/report. This allows
         # shareable, expiring links.
@@ -453,19 +638,95 @@ class ReportPdf(ApiHandler):
         # here, because reports are shared by link, and we already checked for
         # a jwt in the query string.
 
+        # Stored files are named by the md5 of their contents (see
+        # Reports.save_file()), so the name is a strong ETag.
+        etag = self.get_etag(report)
+        if etag and self.client_has(etag):
+            self.response.status = 304
+            self.response.headers['ETag'] = etag
+            return
+
+        try:
+            size = gcs.stat(report.gcs_path).st_size
+        except gcs.NotFoundError:
+            logging.error("Couldn't find a gcs file for report {}"
+                          .format(report.to_dict()))
+            return self.http_not_found()
+
         self.response.headers.update({
+            'Accept-Ranges': 'bytes',
+            # Reports are shared by link, so no public caches, and check
+            # the ETag before reusing a cached copy.
+            'Cache-Control': 'private, no-cache',
             'Content-Disposition': 'inline; filename={}'.format(
                 report.filename),
             # Unicode not allowed in headers.
             'Content-Type': str(report.content_type),
         })
-        try:
-            with gcs.open(report.gcs_path, 'r') as gcs_file:
-                self.response.write(gcs_file.read())
-        except gcs.NotFoundError:
-            logging.error("Couldn't find a gcs file for report {}"
-                          .format(report.to_dict()))
-            self.http_not_found()
+        if etag:
+            self.response.headers['ETag'] = etag
+
+        byte_range = self.get_byte_range(size, etag)
+        if byte_range is False:
+            self.response.status = 416
+            self.response.headers['Content-Range'] = 'bytes */{}'.format(size)
+            return
+        elif byte_range:
+            # App Engine answers with a 206 and the Content-Range.
+            self.response.headers[blobstore.BLOB_RANGE_HEADER] = byte_range
+
+        # App Engine replaces the empty body with the file, copied straight
+        # from GCS, rather than it passing through this instance's memory.
+        self.response.headers[blobstore.BLOB_KEY_HEADER] = str(
+            blobstore.create_gs_key('/gs' + report.gcs_path))
+
+    def get_etag(self, report):
+        file_hash = (report.gcs_path or '').split('/')[-1]
+        if self.md5_pattern.match(file_hash):
+            return '"{}"'.format(file_hash)
+        return None
+
+    def client_has(self, etag):
+        header = self.request.headers.get('If-None-Match', '')
+        # Weak comparison, as the spec requires for If-None-Match.
+        tags = [t.strip().replace('W/', '', 1) for t in header.split(',')]
+        return etag in tags or '*' in tags
+
+    def get_byte_range(self, size, etag):
+        """Interpret the Range header.
+
+        Returns None to send the whole file, a Range header value for App
+        Engine to serve, or False if the range can't be satisfied. Invalid
+        and unsupported ranges, e.g. "bytes=5-3" or multiple ranges, are
+        ignored, and the whole file is sent.
+        """
+        header = self.request.headers.get('Range', None)
+        if not header:
+            return None
+
+        # Ranges are only good for the version of the file the client has.
+        if_range = self.request.headers.get('If-Range', None)
+        if if_range and if_range != etag:
+            return None
+
+        match = self.range_pattern.match(header.strip())
+        if not match:
+            return None
+
+        first, last = match.groups()
+        if first == '':
+            # Suffix range, e.g. the last 500 bytes: "bytes=-500".
+            if last == '':
+                return None
+            if int(last) == 0:
+                return False
+        else:
+            if last != '' and int(last) < int(first):
+                return None
+            if int(first) >= size:
+                return False
+
+        return 'bytes={}-{}'.format(first, last)
 
     def post(self):
         self.http_method_not_allowed('GET, HEAD')
@@ -1,9 +1,13 @@
+import datetime
+
 from gae_handlers import RestHandler
 from model import (
   JsonTextValueLengthError,
   JsonTextDictLengthError,
+  JsonTextLengthError,
   Response,
   ResponseBodyKeyConflict,
+  ResponseHistory,
   ResponseIndexConflict,
   ResponseNotFound,
   SqlModel,
@@ -57,6 +61,8 @@ class Responses(RestHandler):
             return self.http_payload_too_large("Value too long.")
         except JsonTextDictLengthError:
             return self.http_payload_too_large("Body has too many keys.")
+        except JsonTextLengthError:
+            return self.http_payload_too_large("Body too long.")
         self.write(new_entity)
 
     def put(self, id=None):
@@ -83,6 +89,8 @@ class Responses(RestHandler):
             return self.http_payload_too_large("Value too long.")
         except JsonTextDictLengthError:
             return self.http_payload_too_large("Body has too many keys.")
+        except JsonTextLengthError:
+            return self.http_payload_too_large("Body too long.")
         except ResponseBodyKeyConflict as e:
             return self.http_conflict({
                 'message': (
@@ -94,6 +102,108 @@ class Responses(RestHandler):
 
         self.write(entity)
 
+    def patch(self, id=None):
+        """Change individual keys of a response body.
+
+        Expects a json list of operations, e.g.
+
+            [
+                {"op": "set", "key": "q1", "value": "foo",
+                 "modified": "2019-01-01T00:00:00Z"},
+                {"op": "remove", "key": "q2",
+                 "modified": "2019-01-01T00:00:00Z"}
+            ]
+
+        Each modified time is when the client last saw that key, or null for
+        a new key. Conflicts are handled as with PUT, including ?force=true.
+
+        Responds with only the changed keys and their new modified times, see
+        Response.patch_body().
+        """
+        if id is None:
+            # Batch requests to the collection, see RestHandler.
+            return super(Responses, self).patch()
+
+        id = self.model.get_long_uid(id)
+
+        if not owns(self.get_current_user(), id):
+            return self.http_forbidden()
+
+        force = self.request.get('force', None) == 'true'  # from query str
+        ops = self.process_json_body()
+
+        if not isinstance(ops, list):
+            return self.http_bad_request("Expected a list of operations.")
+        for op in ops:
+            if (
+                not isinstance(op, dict) or
+                op.get('op', None) not in ('set', 'remove') or
+                not isinstance(op.get('key', None), basestring)
+            ):
+                return self.http_bad_request(
+                    "Invalid operation: {}".format(op))
+
+        try:
+            result = Response.patch_body(id, ops, force)
+        except ResponseNotFound:
+            return self.http_not_found()
+        except JsonTextValueLengthError:
+            return self.http_payload_too_large("Value too long.")
+        except JsonTextDictLengthError:
+            return self.http_payload_too_large("Body has too many keys.")
+        except JsonTextLengthError:
+            return self.http_payload_too_large("Body too long.")
+        except ResponseBodyKeyConflict as e:
+            return self.http_conflict({
+                'message': (
+                    "Keys conflict: {}. Repeat with ?force=true to override."
+                    .format(', '.join(e.args[0]))
+                ),
+                'keys': e.args[0],
+            })
+
+        self.write(result)
+
+
+class ResponsesHistory(RestHandler):
+    model = Response
+    requires_auth = True
+
+    def get(self, id):
+        """A response as it was at some time, from its history.
+
+        Expects an `at` query string param, an iso datetime, with or without
+        microseconds. Defaults to now. See ResponseHistory.get_as_of().
+        """
+        id = self.model.get_long_uid(id)
+
+        if not owns(self.get_current_user(), id):
+            return self.http_forbidden()
+
+        at_str = self.request.get('at', None)
+        if at_str:
+            try:
+                at = ResponseHistory.parse_time(at_str)
+            except ValueError:
+                return self.http_bad_request(
+                    "Invalid `at`, expected an iso datetime: {}"
+                    .format(at_str))
+        else:
+            at = datetime.datetime.now()
+
+        state = ResponseHistory.get_as_of(id, at)
+        if state is None:
+            return self.http_not_found()
+
+        self.write({
+            'uid': id,
+            'at': ResponseHistory.format_time(at),
+            'modified': ResponseHistory.format_time(state['modified']),
+            'progress': state['progress'],
+            'page': state['page'],
+            'body': state['body'],
+        })
+
 
 class TeamsResponses(RestHandler):
     model = Response
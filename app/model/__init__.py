@@ -16,6 +16,11 @@ from gae_models import (DatastoreModel as Model, Email, format_to_addresses,
                         JSON_TEXT_MAX)
 
 from .error_checker import ErrorChecker
+from .identity_map import IdentityMapped
+from .cached_properties import HasCachedProperties, PrefetchesCachedProperties
+from .membership import (NetworkClosure, ParticipantClassroom,
+                         TeamOrganization, UserNetwork, UserOrganization,
+                         UserTeam)
 from .classroom import Classroom
 from .cycle import Cycle
 from .digest import Digest
@@ -26,9 +31,12 @@ from .participant import Participant
 from .program import Program
 from .notification import Notification
 from .report import Report
+from .roster_import import InvalidRoster, RosterImport
+from .response_body_key import ResponseBodyKey
+from .response_history import ResponseHistory
+from .response_backup import ResponseBackup
 from .response import (Response, ResponseBodyKeyConflict, ResponseIndexConflict,
                        ResponseNotFound)
-from .response_backup import ResponseBackup
 from .survey import Survey
 from .team import Team
 from .user import User, BadPassword, DuplicateUser
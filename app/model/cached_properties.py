@@ -0,0 +1,183 @@
+"""
+Cached Properties
+===========
+
+Memcached counts and names that decorate a model's client dict, e.g. a team's
+number of classrooms or a classroom's contact name.
+
+Serializing a list one entity at a time costs a memcache get per entity and,
+on a miss, a few SQL queries per entity. Handlers that write lists call
+prefetch() on them first instead: one memcache get_multi, one grouped query per
+kind for the misses, and one set_multi to write them back. Handlers with the
+PrefetchesCachedProperties mixin do this for any list they write.
+
+Writes that change these properties, e.g. a user joining a team, call
+mark_dirty() rather than recomputing right away. Ids are buffered in a pull
+queue, and /cron/recompute_cached_properties recomputes each one once per
+run, however many times it was marked. Until then readers get the value
+already cached, or a fresh one if nothing is cached.
+"""
+from google.appengine.api import memcache, taskqueue
+
+import counters
+import util
+
+
+class HasCachedProperties(object):
+    """Mixin for SqlModels, must come before SqlModel in the bases.
+
+    Models define get_cached_properties_from_db_multi(klass, uids), returning
+    a dict of uid to properties for those that exist, in as few queries as
+    possible. Uids left out are treated as deleted, see recompute_dirty().
+    """
+
+    default_cached_properties = {}
+
+    # Pull queue of ids to recompute, tagged by kind. See mark_dirty().
+    dirty_queue_name = 'cached-properties'
+    # Most tasks App Engine allows in one add().
+    dirty_add_size = 100
+    dirty_batch_size = 1000
+    dirty_lease_seconds = 60
+    max_dirty_batches = 20
+    counter_prefix = 'cached_properties'
+
+    @classmethod
+    def get_cached_properties_from_db(klass, uid):
+        return klass.get_cached_properties_from_db_multi([uid]).get(uid, {})
+
+    @classmethod
+    def update_cached_properties(klass, uid):
+        """If we find the entity in the db, query for properties and cache."""
+        return klass.update_cached_properties_multi([uid]).get(uid, {})
+
+    @classmethod
+    def update_cached_properties_multi(klass, uids):
+        if not uids:
+            return {}
+        from_db = klass.get_cached_properties_from_db_multi(uids)
+        if from_db:
+            memcache.set_multi({util.cached_properties_key(uid): props
+                                for uid, props in from_db.items()})
+        return from_db
+
+    @classmethod
+    def mark_dirty(klass, uids):
+        """Recompute properties of these entities soon, rather than now.
+
+        See recompute_dirty().
+        """
+        uids = set(uid for uid in uids if uid)
+        tasks = [taskqueue.Task(payload=uid, method='PULL',
+                                tag=klass.__name__)
+                 for uid in uids]
+        queue = taskqueue.Queue(klass.dirty_queue_name)
+        for i in range(0, len(tasks), klass.dirty_add_size):
+            queue.add(tasks[i:i + klass.dirty_add_size])
+        counters.increment(klass.counter_prefix, {'marked': len(tasks)})
+
+    @classmethod
+    def recompute_dirty(klass, max_batches=None):
+        """Recompute and cache each entity marked dirty since the last call,
+        once.
+
+        Tasks are deleted only after their entities are cached, so if this
+        fails they're leased again when the lease runs out.
+
+        Returns dict of how many marks were read and how many entities
+        recomputed.
+        """
+        if max_batches is None:
+            max_batches = klass.max_dirty_batches
+
+        queue = taskqueue.Queue(klass.dirty_queue_name)
+        num_marks = 0
+        num_recomputed = 0
+        for x in range(max_batches):
+            tasks = queue.lease_tasks_by_tag(
+                klass.dirty_lease_seconds,
+                klass.dirty_batch_size,
+                tag=klass.__name__,
+            )
+            if not tasks:
+                break
+
+            uids = list(set(t.payload for t in tasks))
+            from_db = klass.update_cached_properties_multi(uids)
+
+            # Deleted entities shouldn't keep their old properties.
+            gone = [uid for uid in uids if uid not in from_db]
+            if gone:
+                memcache.delete_multi(
+                    [util.cached_properties_key(uid) for uid in gone])
+
+            queue.delete_tasks(tasks)
+            num_marks += len(tasks)
+            num_recomputed += len(uids)
+
+        counters.increment(klass.counter_prefix, {
+            'recomputed': num_recomputed,
+        })
+        return {'marks': num_marks, 'recomputed': num_recomputed}
+
+    @classmethod
+    def get_cached_properties_multi(klass, uids):
+        """Read from memcache, falling back to the db for any misses."""
+        uids_by_key = {util.cached_properties_key(uid): uid for uid in uids}
+        cached = memcache.get_multi(uids_by_key.keys())
+        props_by_uid = {uids_by_key[k]: v for k, v in cached.items() if v}
+
+        missing = [uid for uid in uids if uid not in props_by_uid]
+        if missing:
+            props_by_uid.update(klass.update_cached_properties_multi(missing))
+
+        return props_by_uid
+
+    @classmethod
+    def prefetch_cached_properties(klass, entities):
+        """Load properties for many entities at once, ready for serializing."""
+        uids = list(set(e.uid for e in entities))
+        props_by_uid = klass.get_cached_properties_multi(uids) if uids else {}
+        for e in entities:
+            e._prefetched_properties = props_by_uid.get(e.uid, {})
+
+    def get_cached_properties(self):
+        klass = self.__class__
+        if not hasattr(self, '_prefetched_properties'):
+            return klass.get_cached_properties_multi([self.uid]).get(
+                self.uid, {})
+
+        # Only use the prefetched values once; a later call in the same request
+        # should see any changes made in the meantime.
+        props = self._prefetched_properties
+        del self._prefetched_properties
+        return props
+
+    def to_client_dict(self):
+        """Decorate with related counts or names; cached."""
+        d = super(HasCachedProperties, self).to_client_dict()
+        d.update(self.default_cached_properties)
+        d.update(self.get_cached_properties())
+        return d
+
+
+def prefetch(entities):
+    """Load cached properties for a list about to be serialized, one batch
+    per kind. Entities of other models are ignored."""
+    by_class = {}
+    for e in entities:
+        if isinstance(e, HasCachedProperties):
+            by_class.setdefault(e.__class__, []).append(e)
+    for klass, klass_entities in by_class.items():
+        klass.prefetch_cached_properties(klass_entities)
+
+
+class PrefetchesCachedProperties(object):
+    """Mixin for handlers, must come before RestHandler or ApiHandler in the
+    bases. Prefetches any list of entities written, see prefetch()."""
+
+    def write(self, obj, *args, **kwargs):
+        if isinstance(obj, list):
+            prefetch(obj)
+        return super(PrefetchesCachedProperties, self).write(
+            obj, *args, **kwargs)
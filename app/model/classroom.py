@@ -5,15 +5,21 @@ Classroom
 Classrooms of students taught by teachers on a team.
 """
 from google.appengine.api import memcache
+import datetime
 import logging
 
-from model import SqlModel, SqlField as Field
+from model import (HasCachedProperties, IdentityMapped, ParticipantClassroom,
+                   SqlModel, SqlField as Field)
+from .cycle import Cycle
+from .identity_map import evict
+from .program import Program
 from .team import Team
+from . import code_context
+import counters
 import mysql_connection
-import util
 
 
-class Classroom(SqlModel):
+class Classroom(HasCachedProperties, IdentityMapped, SqlModel):
     table = 'classroom'
 
     py_table_definition = {
@@ -32,7 +38,21 @@ class Classroom(SqlModel):
             Field('grade_level',   'varchar', 50,     None,     True,  SqlModel.sql_null,    None),
         ],
         'primary_key': ['uid'],
-        'indices': [],
+        'indices': [
+            {
+                'name': 'team',
+                'fields': ['team_id'],
+            },
+            {
+                'name': 'contact',
+                'fields': ['contact_id'],
+            },
+            # CheckRoster looks up classrooms by code on every student sign in.
+            {
+                'name': 'code',
+                'fields': ['code'],
+            },
+        ],
         'engine': 'InnoDB',
         'charset': 'utf8',
     }
@@ -123,54 +143,215 @@ class Classroom(SqlModel):
         return [klass.row_dict_to_obj(r) for r in row_dicts]
 
     @classmethod
-    def get_cached_properties_from_db(self, classroom_id):
-        """What's the name of the main contact?"""
+    def get_cached_properties_from_db_multi(klass, classroom_ids):
+        """What's the name of the main contact of each classroom?"""
         query = '''
             SELECT
+                c.`uid` as uid,
                 u.`name` as name,
                 u.`email` as email
             FROM `classroom` c
             JOIN `user` u
               ON c.`contact_id` = u.`uid`
-            WHERE c.`uid` = %s
-        '''
-        params = (classroom_id,)
+            WHERE c.`uid` IN ({interps})
+        '''.format(interps=', '.join(['%s'] * len(classroom_ids)))
+        params = tuple(classroom_ids)
 
         with mysql_connection.connect() as sql:
             rows = sql.select_query(query, params)
 
-        if len(rows) == 1:
-            return {
-                'contact_name': rows[0]['name'],
-                'contact_email': rows[0]['email'],
+        return {
+            r['uid']: {
+                'contact_name': r['name'],
+                'contact_email': r['email'],
             }
-        return {}
+            for r in rows
+        }
 
     @classmethod
-    def update_cached_properties(klass, classroom_id):
-        from_db = Classroom.get_cached_properties_from_db(classroom_id)
-        if from_db:
-            memcache.set(util.cached_properties_key(classroom_id), from_db)
-        return from_db
+    def add_num_students(klass, deltas):
+        """Change num_students in place, without recounting. See
+        Participant.update_num_students().
+
+        Args:
+            deltas: dict of classroom uid to how many students joined, or
+                left if negative.
+        """
+        uids_by_delta = {}
+        for uid, delta in deltas.items():
+            if delta:
+                uids_by_delta.setdefault(delta, []).append(uid)
+
+        # Signed, so subtracting from a count that has drifted to zero stays
+        # at zero rather than raising.
+        query = '''
+            UPDATE `{table}`
+            SET `num_students` = GREATEST(
+              CAST(`num_students` AS SIGNED) + %s,
+              0
+            )
+            WHERE `uid` IN ({interps})
+        '''
+        with mysql_connection.connect() as sql:
+            for delta, uids in uids_by_delta.items():
+                sql.query(
+                    query.format(
+                        table=klass.table,
+                        interps=', '.join(['%s'] * len(uids)),
+                    ),
+                    (delta,) + tuple(uids),
+                )
+
+        # Classrooms fetched earlier in this request are now out of date.
+        changed = [uid for uids in uids_by_delta.values() for uid in uids]
+        evict(klass.__name__,
+              changed + [klass.convert_uid(uid) for uid in changed])
+
+    @classmethod
+    def reconcile_num_students(klass):
+        """Recount num_students where it differs from the roster.
+
+        Counts should only drift if a write fails partway, or a stale
+        classroom is put over a newer count.
+
+        Returns dict of how many classrooms drifted, and by how much, by uid.
+        """
+        query = '''
+            SELECT
+              c.`uid`,
+              c.`team_id`,
+              c.`num_students`,
+              COUNT(m.`participant_id`) AS `actual`
+            FROM `{table}` c
+            LEFT JOIN `{membership_table}` m
+              ON m.`classroom_id` = c.`uid`
+            GROUP BY c.`uid`
+            HAVING c.`num_students` != `actual`
+        '''.format(
+            table=klass.table,
+            membership_table=ParticipantClassroom.table,
+        )
+
+        with mysql_connection.connect() as sql:
+            drifted = sql.select_query(query, tuple())
+
+        drift = {r['uid']: r['actual'] - r['num_students'] for r in drifted}
+
+        if drifted:
+            logging.warning("num_students drifted for {} classrooms: {}"
+                            .format(len(drift), drift))
+
+            # Recount in the update itself, so writes since the query above
+            # aren't lost.
+            update_query = '''
+                UPDATE `{table}` c
+                SET c.`num_students` = (
+                  SELECT COUNT(m.`participant_id`)
+                  FROM `{membership_table}` m
+                  WHERE m.`classroom_id` = c.`uid`
+                )
+                WHERE c.`uid` IN ({interps})
+            '''.format(
+                table=klass.table,
+                membership_table=ParticipantClassroom.table,
+                interps=', '.join(['%s'] * len(drift)),
+            )
+            with mysql_connection.connect() as sql:
+                sql.query(update_query, tuple(drift.keys()))
+
+            Team.mark_dirty(set(r['team_id'] for r in drifted))
+
+        counters.record('num_students', {'drifted': len(drift)})
+        return {'drifted': len(drift), 'drift': drift}
 
     @classmethod
     def get_by_code(klass, code):
         classrooms = Classroom.get(code=code)
         return classrooms[0] if classrooms else None
 
+    @classmethod
+    def get_code_context(klass, code):
+        """Everything CheckRoster needs to know about a code, cached.
+
+        Returns None if no classroom has the code, otherwise a dict with
+        classroom_id, team_id, use_classrooms (from the program), and cycles,
+        a list of dicts. See get_current_cycle_from_context().
+        """
+        key = code_context.key(code)
+        context = memcache.get(key)
+        if context is None:
+            context = klass.get_code_context_from_db(code)
+            # Unknown codes are stored as an empty dict.
+            memcache.set(key, context, time=(
+                code_context.TTL if context else code_context.UNKNOWN_CODE_TTL
+            ))
+        return context or None
+
+    @classmethod
+    def get_code_context_from_db(klass, code):
+        classroom = klass.get_by_code(code)
+        if not classroom:
+            return {}
+
+        team = Team.get_by_id(classroom.team_id)
+        if not team:
+            # Left behind by a deleted team.
+            return {}
+        program = Program.get_by_id(team.program_id)
+        cycles = Cycle.get(team_id=team.uid, order='ordinal')
+
+        return {
+            'classroom_id': classroom.uid,
+            'team_id': team.uid,
+            'use_classrooms': program.use_classrooms,
+            'cycles': [
+                {
+                    'start_date': c.start_date,
+                    'end_date': c.end_date,
+                    'extended_end_date': c.extended_end_date,
+                    'client_dict': c.to_client_dict(),
+                }
+                for c in cycles
+            ],
+        }
+
+    @classmethod
+    def get_current_cycle_from_context(klass, context, today=None):
+        """Client dict of the current cycle, or None.
+
+        Same rules as Cycle.get_current_for_team(), but doesn't need the db.
+        """
+        if today is None:
+            today = datetime.date.today()
+
+        for c in context['cycles']:
+            if c['start_date'] and c['start_date'] <= today and (
+                (c['end_date'] and c['end_date'] >= today) or
+                (c['extended_end_date'] and c['extended_end_date'] >= today)
+            ):
+                return c['client_dict']
+        return None
+
+    @classmethod
+    def delete_multi(klass, entities):
+        super(Classroom, klass).delete_multi(entities)
+        code_context.invalidate([e.code for e in entities])
+
     def after_put(self, init_kwargs):
         """Update cached properties in response to classrooms changing.
 
-        * Team's number of classrooms
-        * Classroom's contact name and email
+        * Team's number of classrooms, recomputed later
+        * Classroom's contact name and email, recomputed later
+        * Code contexts of the old and new code
         """
         original_contact_id = init_kwargs['contact_id']
         if self.contact_id != original_contact_id:
-            Classroom.update_cached_properties(self.uid)
-        Team.update_cached_properties(self.team_id)
+            Classroom.mark_dirty([self.uid])
+        Team.mark_dirty([self.team_id])
+        code_context.invalidate([self.code, init_kwargs.get('code')])
 
     def to_client_dict(self):
-        """Decorate the team with counts of related objects; cached."""
+        """Decorate the classroom with contact details; cached."""
         d = super(Classroom, self).to_client_dict()
 
         # If the team name is available (returned by some custom queries),
@@ -178,12 +359,4 @@ class Classroom(SqlModel):
         if hasattr(self, 'team_name'):
             d['team_name'] = self.team_name
 
-        d.update(self.default_cached_properties)
-
-        cached = memcache.get(util.cached_properties_key(self.uid))
-        if cached:
-            d.update(cached)
-        else:
-            d.update(Classroom.update_cached_properties(self.uid))
-
         return d
@@ -0,0 +1,68 @@
+"""
+Code Context
+===========
+
+Memcached summary of a classroom code: everything CheckRoster needs to know
+besides the roster itself, i.e. the classroom, its team, the program's flags,
+and the team's cycles. See Classroom.get_code_context().
+
+Every student starting a survey hits CheckRoster, so this saves several
+queries per sign in. Puts and deletes of classrooms, teams, cycles, and
+programs delete the affected contexts, when they change what's cached; the TTL
+is only a backstop.
+"""
+from google.appengine.api import memcache
+
+import mysql_connection
+
+
+# Seconds.
+TTL = 60 * 60
+
+# Unknown codes are cached too, b/c a whole class tends to retry a mistyped
+# code. Creating a classroom clears its code, so this can't hide a new one.
+UNKNOWN_CODE_TTL = 5 * 60
+
+
+def key(code):
+    # Codes are matched case-insensitively by MySQL, so the cache should too.
+    return 'code_context:{}'.format(code.lower())
+
+
+def invalidate(codes):
+    keys = [key(c) for c in codes if c]
+    if keys:
+        memcache.delete_multi(keys)
+
+
+def invalidate_for_teams(team_ids):
+    if not team_ids:
+        return
+
+    query = '''
+        SELECT `code`
+        FROM `classroom`
+        WHERE `team_id` IN ({interps})
+    '''.format(interps=', '.join(['%s'] * len(team_ids)))
+    params = tuple(team_ids)
+
+    with mysql_connection.connect() as sql:
+        rows = sql.select_query(query, params)
+
+    invalidate([r['code'] for r in rows])
+
+
+def invalidate_for_program(program_id):
+    query = '''
+        SELECT c.`code`
+        FROM `classroom` c
+        JOIN `team` t
+          ON c.`team_id` = t.`uid`
+        WHERE t.`program_id` = %s
+    '''
+    params = (program_id,)
+
+    with mysql_connection.connect() as sql:
+        rows = sql.select_query(query, params)
+
+    invalidate([r['code'] for r in rows])
@@ -21,13 +21,14 @@ import datetime
 import logging
 import util
 
-from model import SqlModel, SqlField as Field
+from model import IdentityMapped, SqlModel, SqlField as Field
 from .program import Program
+from . import code_context
 import config
 import mysql_connection
 
 
-class Cycle(SqlModel):
+class Cycle(IdentityMapped, SqlModel):
     table = 'cycle'
 
     py_table_definition = {
@@ -138,6 +139,15 @@ class Cycle(SqlModel):
     @classmethod
     def get_current_for_team(klass, team_id, today=None):
         """Returns current cycle or None."""
+        return klass.get_current_for_teams([team_id], today).get(team_id)
+
+    @classmethod
+    def get_current_for_teams(klass, team_ids, today=None):
+        """Returns dict of team id to current cycle, omitting teams without
+        one."""
+        if len(team_ids) == 0:
+            return {}
+
         if today is None:
             today = datetime.date.today()
         today_str = today.strftime(config.sql_datetime_format)
@@ -145,20 +155,27 @@ class Cycle(SqlModel):
         query = '''
             SELECT *
             FROM `{table}`
-            WHERE `team_id` = %s
+            WHERE `team_id` IN ({interps})
               AND `start_date` <= %s
               AND (
                 `end_date` >= %s OR
                 `extended_end_date` >= %s
               )
-            LIMIT 1
-        '''.format(table=klass.table)
-        params = (team_id, today_str, today_str, today_str)
+            ORDER BY `ordinal`
+        '''.format(
+            table=klass.table,
+            interps=', '.join(['%s'] * len(team_ids)),
+        )
+        params = tuple(team_ids) + (today_str, today_str, today_str)
 
         with mysql_connection.connect() as sql:
             row_dicts = sql.select_query(query, params)
 
-        return klass.row_dict_to_obj(row_dicts[0]) if row_dicts else None
+        cycles_by_team = {}
+        for d in row_dicts:
+            # Dates shouldn't overlap, but if they do take the earliest.
+            cycles_by_team.setdefault(d['team_id'], klass.row_dict_to_obj(d))
+        return cycles_by_team
 
     @classmethod
     def query_by_teams(klass, team_ids):
@@ -251,3 +268,12 @@ class Cycle(SqlModel):
                 cycle.extended_end_date = program_end_date
 
         return team_cycles
+
+    @classmethod
+    def delete_multi(klass, entities):
+        super(Cycle, klass).delete_multi(entities)
+        code_context.invalidate_for_teams(
+            list(set(e.team_id for e in entities)))
+
+    def after_put(self, init_kwargs, *args, **kwargs):
+        code_context.invalidate_for_teams([self.team_id])
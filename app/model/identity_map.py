@@ -0,0 +1,180 @@
+"""
+Identity Map
+===========
+
+Request-scoped cache in front of SqlModel.get_by_id().
+
+A single request often loads the same rows several times, e.g. permission
+checks look up the same Team for a classroom, a survey, and a cycle. Models
+that mix in IdentityMapped remember what they fetched by id for the rest of
+the request, so repeated lookups don't go back to the db. Any put or delete
+through the model evicts the affected ids.
+
+The map is only active inside request_scope(), which wsgi.py opens around
+every request. Outside of it (e.g. unit tests calling models directly)
+get_by_id() behaves exactly as before.
+"""
+import contextlib
+import logging
+import threading
+
+
+_local = threading.local()
+
+
+def is_active():
+    return getattr(_local, 'entities', None) is not None
+
+
+def start_request():
+    _local.entities = {}
+    _local.hits = 0
+    _local.misses = 0
+
+
+def end_request():
+    _local.entities = None
+
+
+def stats():
+    """Lookup counts for the current request, as a dict."""
+    return {
+        'hits': getattr(_local, 'hits', 0),
+        'misses': getattr(_local, 'misses', 0),
+    }
+
+
+@contextlib.contextmanager
+def request_scope():
+    start_request()
+    try:
+        yield
+    finally:
+        counts = stats()
+        if counts['hits'] or counts['misses']:
+            logging.info("Identity map: {hits} hits, {misses} misses."
+                         .format(**counts))
+        end_request()
+
+
+class RequestScopeMiddleware(object):
+    """Wraps a wsgi application so each request gets a fresh map."""
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        with request_scope():
+            return self.app(environ, start_response)
+
+
+def _kind_map(kind):
+    return _local.entities.setdefault(kind, {})
+
+
+def evict(kind, ids):
+    if not is_active():
+        return
+    kind_map = _kind_map(kind)
+    for id in ids:
+        kind_map.pop(id, None)
+
+
+class IdentityMapped(object):
+    """Mixin for SqlModels, must come before SqlModel in the bases."""
+
+    @classmethod
+    def get_by_id(klass, id_or_ids):
+        if not is_active() or not id_or_ids:
+            return super(IdentityMapped, klass).get_by_id(id_or_ids)
+
+        kind_map = _kind_map(klass.__name__)
+
+        if isinstance(id_or_ids, basestring):
+            if id_or_ids in kind_map:
+                _local.hits += 1
+                return kind_map[id_or_ids]
+            _local.misses += 1
+            entity = super(IdentityMapped, klass).get_by_id(id_or_ids)
+            # Misses are remembered too, as None, b/c permission checks
+            # often look up the same missing id more than once.
+            kind_map[id_or_ids] = entity
+            if entity:
+                klass._remember(entity)
+            return entity
+
+        ids = list(id_or_ids)
+        known = [id for id in ids if id in kind_map]
+        unknown = [id for id in ids if id not in kind_map]
+        _local.hits += len(known)
+        _local.misses += len(unknown)
+
+        fetched = []
+        if unknown:
+            fetched = super(IdentityMapped, klass).get_by_id(unknown)
+            for id in unknown:
+                kind_map[id] = None
+            for entity in fetched:
+                klass._remember(entity)
+
+        # In the order asked for, so callers can pair ids with results. Ids
+        # may repeat, or be both long and short versions of the same uid, but
+        # each entity is returned once.
+        entities = []
+        seen = set()
+        for entity in [kind_map[id] for id in ids] + fetched:
+            if entity is not None and entity.uid not in seen:
+                seen.add(entity.uid)
+                entities.append(entity)
+        return entities
+
+    @classmethod
+    def _remember(klass, entity):
+        kind_map = _kind_map(klass.__name__)
+        for id in klass._ids_for(entity):
+            kind_map[id] = entity
+
+    @classmethod
+    def _ids_for(klass, entity):
+        # Not every table stores a short_uid, but handlers may pass either.
+        short_uid = getattr(entity, 'short_uid', None) or (
+            klass.convert_uid(entity.uid) if entity.uid else None)
+        return [id for id in (entity.uid, short_uid) if id]
+
+    @classmethod
+    def evict(klass, entities):
+        evict(klass.__name__,
+              [id for e in entities for id in klass._ids_for(e)])
+
+    def put(self, *args, **kwargs):
+        # Evict on both sides of the write so after_put() hooks that look up
+        # this entity see the new version.
+        self.evict([self])
+        result = super(IdentityMapped, self).put(*args, **kwargs)
+        self.evict([self])
+        return result
+
+    @classmethod
+    def put_multi(klass, entities, *args, **kwargs):
+        entities = list(entities)
+        klass.evict(entities)
+        result = super(IdentityMapped, klass).put_multi(
+            entities, *args, **kwargs)
+        klass.evict(entities)
+        return result
+
+    @classmethod
+    def put_for_index(klass, entity, *args, **kwargs):
+        klass.evict([entity])
+        result = super(IdentityMapped, klass).put_for_index(
+            entity, *args, **kwargs)
+        # The index may have matched an existing row with a different uid.
+        klass.evict([entity, result] if result else [entity])
+        return result
+
+    @classmethod
+    def delete_multi(klass, entities, *args, **kwargs):
+        entities = list(entities)
+        result = super(IdentityMapped, klass).delete_multi(
+            entities, *args, **kwargs)
+        klass.evict(entities)
+        return result
@@ -0,0 +1,248 @@
+"""
+Keyset
+===========
+
+Paging through a SqlModel's table by where the last page left off, rather than
+by offset or by loading every row.
+
+Pages are ordered by one column and then uid, so the order is stable even when
+the column has duplicates, and each page starts with a seek to the row after
+the last one seen:
+
+    WHERE `user_id` = %s AND (`created`, `uid`) > (%s, %s)
+    ORDER BY `created`, `uid`
+    LIMIT 101
+
+Ordering by uid alone needs no extra index, because InnoDB secondary indices
+end with the primary key, e.g. `user` on digests is effectively (`user_id`,
+`uid`); otherwise index the filtered and ordered columns together. Either way
+every page costs the same however deep it is. Rows added or changed between
+pages are neither skipped nor repeated unless they move past the cursor.
+
+Handlers hand out the position as an opaque cursor, see get_page() and
+RelatedQuery. Queries get_page() can't build, e.g. with joins, can page the
+same way with seek_clause() and trim_page(). Code that needs every row, e.g.
+crons, can use pages() or walk() to read a whole table a page at a time
+instead of all at once.
+"""
+import base64
+import datetime
+import json
+
+import mysql_connection
+
+
+# Rows per page, if not specified.
+page_size = 100
+
+# By column type, what NULLs are paged as, compared as strings. Nullable
+# columns of other types can't be paged.
+null_values = {
+    'varchar': '',
+    'char': '',
+    'text': '',
+    'date': '1000-01-01',
+    'datetime': '1000-01-01 00:00:00',
+}
+
+# Cursors store datetimes and dates as strings MySQL compares to datetime and
+# date columns.
+sql_datetime_format = '%Y-%m-%d %H:%M:%S'
+sql_date_format = '%Y-%m-%d'
+
+
+class InvalidCursor(Exception):
+    """A cursor that wasn't made by encode_cursor(), or for another order."""
+    pass
+
+
+def encode_cursor(values):
+    """Opaque, url-safe string for a position, e.g. [name, uid]."""
+    def encode_value(v):
+        # Check datetime first, it's a subclass of date.
+        if isinstance(v, datetime.datetime):
+            return v.strftime(sql_datetime_format)
+        if isinstance(v, datetime.date):
+            return v.strftime(sql_date_format)
+        return v
+
+    values = [encode_value(v) for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values)).rstrip('=')
+
+
+def decode_cursor(cursor, num_values):
+    """Position list from encode_cursor(). Raises InvalidCursor."""
+    try:
+        padded = str(cursor) + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != num_values:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def parse_order(klass, order):
+    """Columns and direction to order by, ending with uid.
+
+    Args:
+        klass: SqlModel class.
+        order: str, optional field name, with a leading '-' for descending,
+            e.g. 'name' or '-created'. Default uid.
+
+    Returns tuple of (list of column names, 'ASC' or 'DESC').
+    """
+    if not order:
+        return ['uid'], 'ASC'
+
+    direction = 'DESC' if order.startswith('-') else 'ASC'
+    column = order.lstrip('-')
+    fields = {f.name: f for f in klass.py_table_definition['fields']}
+    if column not in fields:
+        raise ValueError("Can't order {} by {}.".format(klass.__name__, order))
+    # NULLs don't compare, so rows with them would be skipped. Some types
+    # can sort them as a value instead, see order_expression().
+    if fields[column].null and fields[column].type not in null_values:
+        raise ValueError("Can't page {} by {}, which may be NULL."
+                         .format(klass.__name__, column))
+
+    return ([column, 'uid'] if column != 'uid' else ['uid']), direction
+
+
+def null_value(klass, column):
+    """What a column's NULLs are paged as, or None if it can't be NULL."""
+    field = next(f for f in klass.py_table_definition['fields']
+                 if f.name == column)
+    return null_values[field.type] if field.null else None
+
+
+def order_expression(klass, column):
+    """Sql for a column to order and seek by."""
+    null = null_value(klass, column)
+    if null is not None:
+        # Can't use an index to order, but sorts NULL as a value.
+        return "COALESCE(`{}`, '{}')".format(column, null)
+    return '`{}`'.format(column)
+
+
+def get_page(klass, where=None, order=None, cursor=None, n=page_size):
+    """One page of entities, and a cursor for the next.
+
+    Args:
+        klass: SqlModel class.
+        where: dict of column name to value, or to a list of values to match
+            any of.
+        order: str, see parse_order().
+        cursor: str, from a previous call with the same where and order,
+            default the first page.
+        n: int, maximum entities in the page.
+
+    Returns tuple of (list of entities, cursor str or None if this is the last
+    page).
+
+    Raises InvalidCursor, or ValueError for unknown columns.
+    """
+    columns, direction = parse_order(klass, order)
+    field_names = [f.name for f in klass.py_table_definition['fields']]
+
+    clauses = []
+    params = tuple()
+    for k, v in sorted((where or {}).items()):
+        if k not in field_names:
+            raise ValueError("{} has no column {}.".format(klass.__name__, k))
+        if isinstance(v, (list, tuple, set)):
+            if not v:
+                return [], None
+            clauses.append('`{}` IN ({})'.format(
+                k, ', '.join(['%s'] * len(v))))
+            params += tuple(v)
+        else:
+            clauses.append('`{}` = %s'.format(k))
+            params += (v,)
+
+    expressions = [order_expression(klass, c) for c in columns]
+    if cursor:
+        clause, seek_params = seek_clause(expressions, direction, cursor)
+        clauses.append(clause)
+        params += seek_params
+
+    # One extra row says whether there's another page.
+    query = '''
+        SELECT *
+        FROM `{table}`
+        {where}
+        ORDER BY {order}
+        LIMIT %s
+    '''.format(
+        table=klass.table,
+        where='WHERE ' + ' AND '.join(clauses) if clauses else '',
+        order=', '.join('{} {}'.format(e, direction) for e in expressions),
+    )
+    params += (n + 1,)
+
+    with mysql_connection.connect() as sql:
+        row_dicts = sql.select_query(query, params)
+
+    row_dicts, next_cursor = trim_page(
+        row_dicts, columns, n, [null_value(klass, c) for c in columns])
+    return [klass.row_dict_to_obj(d) for d in row_dicts], next_cursor
+
+
+def seek_clause(expressions, direction, cursor):
+    """Sql and params for rows after a cursor, for queries with their own
+    WHERE, e.g. joins. Raises InvalidCursor.
+
+    Args:
+        expressions: list of sql the query orders by, ending with uid.
+        direction: 'ASC' or 'DESC'.
+        cursor: str, from trim_page().
+
+    Returns tuple of (sql, params).
+    """
+    clause = '({}) {} ({})'.format(
+        ', '.join(expressions),
+        '<' if direction == 'DESC' else '>',
+        ', '.join(['%s'] * len(expressions)),
+    )
+    return clause, tuple(decode_cursor(cursor, len(expressions)))
+
+
+def trim_page(row_dicts, columns, n, nulls=None):
+    """Drop the extra row selected to see if there's another page.
+
+    Args:
+        row_dicts: list, from a query with LIMIT n + 1.
+        columns: list of the column names ordered by, ending with uid.
+        n: int, rows per page.
+        nulls: list, optional, for each column what NULLs are paged as, see
+            null_value(). Default empty strings.
+
+    Returns tuple of (list of at most n row dicts, cursor str or None if this
+    is the last page).
+    """
+    if len(row_dicts) <= n:
+        return row_dicts, None
+    row_dicts = row_dicts[:n]
+    last = row_dicts[-1]
+    nulls = nulls or [''] * len(columns)
+    return row_dicts, encode_cursor(
+        [last[c] if last[c] is not None else null
+         for c, null in zip(columns, nulls)])
+
+
+def pages(klass, where=None, order=None, n=page_size):
+    """Generate every page of entities, as lists, see get_page()."""
+    cursor = None
+    while True:
+        entities, cursor = get_page(klass, where, order, cursor, n)
+        if entities:
+            yield entities
+        if not cursor:
+            break
+
+
+def walk(klass, where=None, order=None, n=page_size):
+    """Generate every entity matching where, reading n at a time."""
+    for page in pages(klass, where, order, n):
+        for entity in page:
+            yield entity
@@ -0,0 +1,217 @@
+"""
+Membership
+===========
+
+Normalized copies of the relationships we store as json lists of ids, e.g.
+`User.owned_teams` or `Participant.classroom_ids`.
+
+The json lists remain the source of truth (and are what the client sees), but
+they can only be searched with `LIKE BINARY '%uid%'`, which is a full table
+scan. Each list is mirrored into a two-column table with an index in both
+directions so "who is a member of X" becomes an indexed join. Rows are kept in
+sync by the owning model's after_put() and delete_multi().
+
+NetworkClosure is the exception: rather than mirroring a list it stores
+everything a network can reach through its associations, at any depth.
+
+Backfilled by migrations/20200615000001-membership.js.
+"""
+import logging
+
+from model import SqlModel, SqlField as Field
+import mysql_connection
+
+
+def membership_table_definition(table, entity_field, related_field):
+    return {
+        'table_name': table,
+        'fields': [
+            #     name,          type,      length, unsigned, null,  default, on_update
+            Field(entity_field,  'varchar', 50,     None,     False, None,    None),
+            Field(related_field, 'varchar', 50,     None,     False, None,    None),
+        ],
+        # Covers lookups by entity, e.g. all the teams of a user.
+        'primary_key': [entity_field, related_field],
+        'indices': [
+            # Covers lookups by related id, e.g. all the users on a team.
+            {
+                'name': 'related-entity',
+                'fields': [related_field, entity_field],
+            },
+        ],
+        'engine': 'InnoDB',
+        'charset': 'utf8',
+    }
+
+
+class Membership(SqlModel):
+    """Abstract. Subclasses define a table and which json property they
+    mirror; rows are never instantiated as entities."""
+    table = None
+    entity_field = None
+    related_field = None
+
+    @classmethod
+    def set_related_ids(klass, entity_id, related_ids):
+        """Make the table match the given list for a single entity."""
+        klass.set_related_ids_multi({entity_id: related_ids})
+
+    @classmethod
+    def set_related_ids_multi(klass, related_ids_by_entity):
+        """Make the table match the given lists, as a batch.
+
+        Args:
+            related_ids_by_entity: dict, entity uid to list of related uids.
+        """
+        if len(related_ids_by_entity) == 0:
+            return
+
+        entity_ids = related_ids_by_entity.keys()
+        rows = [(e_id, r_id)
+                for e_id, r_ids in related_ids_by_entity.items()
+                for r_id in set(r_ids)]
+
+        # Remove any rows that aren't in the current lists. With no rows to
+        # keep this is simply everything for these entities.
+        delete_query = '''
+            DELETE FROM `{table}`
+            WHERE `{entity_field}` IN ({entity_interps})
+            {keep_clause}
+        '''.format(
+            table=klass.table,
+            entity_field=klass.entity_field,
+            entity_interps=','.join(['%s'] * len(entity_ids)),
+            keep_clause=(
+                'AND (`{}`, `{}`) NOT IN ({})'.format(
+                    klass.entity_field,
+                    klass.related_field,
+                    ','.join(['(%s, %s)'] * len(rows)),
+                )
+                if rows else ''
+            ),
+        )
+        delete_params = tuple(entity_ids) + tuple(v for r in rows for v in r)
+
+        # Add any that are new; existing pairs are left alone by IGNORE.
+        insert_query = '''
+            INSERT IGNORE INTO `{table}` (`{entity_field}`, `{related_field}`)
+            VALUES {values}
+        '''.format(
+            table=klass.table,
+            entity_field=klass.entity_field,
+            related_field=klass.related_field,
+            values=','.join(['(%s, %s)'] * len(rows)),
+        )
+        insert_params = tuple(v for r in rows for v in r)
+
+        with mysql_connection.connect() as sql:
+            sql.query(delete_query, delete_params)
+            if rows:
+                sql.query(insert_query, insert_params)
+
+    @classmethod
+    def delete_for_entities(klass, entity_ids):
+        klass.set_related_ids_multi({uid: [] for uid in entity_ids})
+
+    @classmethod
+    def get_related_ids_multi(klass, entity_ids):
+        """Returns dict of entity uid to set of related uids."""
+        related_ids_by_entity = {uid: set() for uid in entity_ids}
+        if len(entity_ids) == 0:
+            return related_ids_by_entity
+
+        query = '''
+            SELECT `{entity_field}`, `{related_field}`
+            FROM `{table}`
+            WHERE `{entity_field}` IN ({interps})
+        '''.format(
+            table=klass.table,
+            entity_field=klass.entity_field,
+            related_field=klass.related_field,
+            interps=','.join(['%s'] * len(entity_ids)),
+        )
+
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query(query, tuple(entity_ids))
+
+        for row in rows:
+            related_ids_by_entity[row[klass.entity_field]].add(
+                row[klass.related_field])
+
+        return related_ids_by_entity
+
+    @classmethod
+    def get_entity_ids(klass, related_id):
+        """Which entities are related to this one, e.g. the users on a team."""
+        query = '''
+            SELECT `{entity_field}`
+            FROM `{table}`
+            WHERE `{related_field}` = %s
+        '''.format(
+            table=klass.table,
+            entity_field=klass.entity_field,
+            related_field=klass.related_field,
+        )
+
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query(query, (related_id,))
+
+        return [row[klass.entity_field] for row in rows]
+
+
+class UserTeam(Membership):
+    """Mirrors User.owned_teams."""
+    table = 'user_team'
+    entity_field = 'user_id'
+    related_field = 'team_id'
+    py_table_definition = membership_table_definition(
+        table, entity_field, related_field)
+
+
+class UserOrganization(Membership):
+    """Mirrors User.owned_organizations."""
+    table = 'user_organization'
+    entity_field = 'user_id'
+    related_field = 'organization_id'
+    py_table_definition = membership_table_definition(
+        table, entity_field, related_field)
+
+
+class UserNetwork(Membership):
+    """Mirrors User.owned_networks."""
+    table = 'user_network'
+    entity_field = 'user_id'
+    related_field = 'network_id'
+    py_table_definition = membership_table_definition(
+        table, entity_field, related_field)
+
+
+class TeamOrganization(Membership):
+    """Mirrors Team.organization_ids."""
+    table = 'team_organization'
+    entity_field = 'team_id'
+    related_field = 'organization_id'
+    py_table_definition = membership_table_definition(
+        table, entity_field, related_field)
+
+
+class ParticipantClassroom(Membership):
+    """Mirrors Participant.classroom_ids."""
+    table = 'participant_classroom'
+    entity_field = 'participant_id'
+    related_field = 'classroom_id'
+    py_table_definition = membership_table_definition(
+        table, entity_field, related_field)
+
+
+class NetworkClosure(Membership):
+    """Everything reachable from a network through Network.association_ids,
+    i.e. its transitive closure: organizations and networks, at any depth.
+
+    Not a mirror of a single list like the others; maintained by Network.
+    """
+    table = 'network_closure'
+    entity_field = 'network_id'
+    related_field = 'descendant_id'
+    py_table_definition = membership_table_definition(
+        table, entity_field, related_field)
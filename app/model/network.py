@@ -8,7 +8,7 @@ comprised of growth conditions.
 import logging
 import string
 
-from model import SqlModel, SqlField as Field
+from model import IdentityMapped, NetworkClosure, SqlModel, SqlField as Field
 import mysql_connection
 import os_random
 
@@ -18,7 +18,7 @@ class InvalidNetworkAssociation(Exception):
     pass
 
 
-class Network(SqlModel):
+class Network(IdentityMapped, SqlModel):
     table = 'network'
 
     py_table_definition = {
@@ -96,61 +96,163 @@ class Network(SqlModel):
     def before_put(self, init_kwargs, *args, **kwargs):
         # Allow this to raise an exception to prevent bad associations from
         # being saved.
-        self.associated_organization_ids(pending_network=self)
+        self.get_descendant_ids()
 
-        if self.uid in self.association_ids:
-            raise InvalidNetworkAssociation(
-                "Networks can't reference themselves: {}".format(self.uid)
-            )
+    def after_put(self, init_kwargs, *args, **kwargs):
+        # Computed again rather than saved from before_put() because when
+        # several networks are put together, their children may have been
+        # saved in the meantime.
+        descendant_ids = self.get_descendant_ids()
+        NetworkClosure.set_related_ids(self.uid, descendant_ids)
+        Network.update_ancestor_closures({self.uid: descendant_ids})
 
-    def associated_organization_ids(self, depth=0, pending_network=None):
-        """Traverse all network-to-network relationships to associated orgs.
+    @classmethod
+    def delete_multi(klass, entities):
+        super(Network, klass).delete_multi(entities)
 
-        Returns a flat and unique list of org ids.
+        # Ancestors of deleted networks can no longer reach through them.
+        for network in entities:
+            NetworkClosure.delete_for_entities([network.uid])
+            Network.update_ancestor_closures({network.uid: set()})
+
+    def get_descendant_ids(self):
+        """Everything reachable through association_ids, at any depth.
+
+        Child networks' descendants come from the closure table, so this is a
+        single query no matter how deep the associations go. This is often
+        run as a before_put check, so `self` may be unsaved; a cycle exists if
+        any child network can already reach this one.
+
+        Returns a set of network and org ids.
         """
-        # While we support network-to-network, this recursive function could
-        # generate many inefficient db calls if we get carried away.
-        if depth >= 4:
+        if self.uid in self.association_ids:
             raise InvalidNetworkAssociation(
-                "Too much depth in network associations: {}"
-                .format(self.uid)
+                "Networks can't reference themselves: {}".format(self.uid)
             )
 
-        org_ids = set()
+        child_ids = []
         for assc_id in self.association_ids:
             kind = SqlModel.get_kind(assc_id)
             if kind == 'Network':
-
-                # Note! This function is often run as a before_put check that
-                # the associations are valid. This means we have to consider
-                # the as-of-yet-unsaved "root" network (the `pending_network`)
-                # and not any version of it we might fetch from the db in order
-                # to catch the introduction of circular references.
-
-                if pending_network and assc_id == pending_network.uid:
-                    child_network = pending_network
-                else:
-                    child_network = Network.get_by_id(assc_id)
-
-                if child_network:
-                    child_org_ids = child_network.associated_organization_ids(
-                        depth=depth + 1,
-                        pending_network=pending_network,
-                    )
-                    org_ids.update(child_org_ids)
-                else:
-                    # No exception here because we don't want Networks to
-                    # become unusable if an associated thing gets deleted.
-                    # @todo: consider having this actually remove the
-                    # association ids from the list.
-                    logging.warning(
-                        "Bad reference in {}: association {} doesn't exist."
-                        .format(self.uid, assc_id)
-                    )
-            elif kind == 'Organization':
-                org_ids.add(assc_id)
-            else:
+                child_ids.append(assc_id)
+            elif kind != 'Organization':
                 raise InvalidNetworkAssociation(
                     "Invalid association kind: {}".format(kind))
 
-        return org_ids
+        closures = Network.get_closures(child_ids)
+        for assc_id in set(child_ids).difference(closures):
+            # No exception here because we don't want Networks to
+            # become unusable if an associated thing gets deleted.
+            # @todo: consider having this actually remove the
+            # association ids from the list.
+            logging.warning(
+                "Bad reference in {}: association {} doesn't exist."
+                .format(self.uid, assc_id)
+            )
+
+        descendant_ids = set(self.association_ids)
+        for child_id, child_descendant_ids in closures.items():
+            if self.uid in child_descendant_ids:
+                raise InvalidNetworkAssociation(
+                    "Circular network association: {} and {}"
+                    .format(self.uid, child_id)
+                )
+            descendant_ids.update(child_descendant_ids)
+
+        return descendant_ids
+
+    @classmethod
+    def get_closures(klass, network_ids):
+        """Everything each network reaches, from the closure table.
+
+        Returns dict of network uid to set of descendant ids, omitting
+        networks that don't exist.
+        """
+        if not network_ids:
+            return {}
+
+        # Joined from the network table, so networks that reach nothing are
+        # told apart from ones that don't exist.
+        query = '''
+            SELECT n.`uid`, c.`{related_field}` as descendant_id
+            FROM `{table}` n
+            LEFT JOIN `{closure_table}` c
+              ON c.`{entity_field}` = n.`uid`
+            WHERE n.`uid` IN ({interps})
+        '''.format(
+            table=klass.table,
+            closure_table=NetworkClosure.table,
+            entity_field=NetworkClosure.entity_field,
+            related_field=NetworkClosure.related_field,
+            interps=', '.join(['%s'] * len(network_ids)),
+        )
+
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query(query, tuple(network_ids))
+
+        closures = {}
+        for row in rows:
+            descendant_ids = closures.setdefault(row['uid'], set())
+            if row['descendant_id']:
+                descendant_ids.add(row['descendant_id'])
+        return closures
+
+    @classmethod
+    def update_ancestor_closures(klass, changed_closures):
+        """Recompute the closures of all networks that reach changed ones.
+
+        Args:
+            changed_closures: dict, network uid to its new set of descendant
+                ids, already saved.
+        """
+        ancestor_ids = set()
+        for uid in changed_closures:
+            ancestor_ids.update(NetworkClosure.get_entity_ids(uid))
+        ancestor_ids.difference_update(changed_closures.keys())
+        if not ancestor_ids:
+            return
+
+        ancestors = {n.uid: n for n in Network.get_by_id(list(ancestor_ids))}
+
+        # Children of ancestors that aren't affected keep their closures.
+        other_child_ids = set(
+            assc_id
+            for n in ancestors.values()
+            for assc_id in n.association_ids
+            if SqlModel.get_kind(assc_id) == 'Network'
+        ).difference(ancestors.keys()).difference(changed_closures.keys())
+        closures = NetworkClosure.get_related_ids_multi(list(other_child_ids))
+        closures.update(changed_closures)
+
+        def closure_of(uid):
+            if uid not in closures:
+                # Store the set before recursing so that, even if a cycle
+                # somehow made it into the db, this terminates.
+                descendant_ids = closures[uid] = set(
+                    ancestors[uid].association_ids)
+                for assc_id in ancestors[uid].association_ids:
+                    if assc_id in ancestors or assc_id in closures:
+                        descendant_ids.update(closure_of(assc_id))
+            return closures[uid]
+
+        NetworkClosure.set_related_ids_multi(
+            {uid: closure_of(uid) for uid in ancestors})
+
+    @classmethod
+    def get_associated_organization_ids(klass, network_ids):
+        """Flat and unique set of org ids associated with any of the networks,
+        directly or through other networks."""
+        closures = NetworkClosure.get_related_ids_multi(list(network_ids))
+        return set(
+            uid
+            for descendant_ids in closures.values()
+            for uid in descendant_ids
+            if SqlModel.get_kind(uid) == 'Organization'
+        )
+
+    def associated_organization_ids(self):
+        """Traverse all network-to-network relationships to associated orgs.
+
+        Returns a flat and unique set of org ids.
+        """
+        return Network.get_associated_organization_ids([self.uid])
@@ -4,18 +4,17 @@ Organization
 
 Collection of teams, where members of the org act as captain for those teams.
 """
-from google.appengine.api import memcache
 import logging
 import string
 
 from .program import Program
-from model import SqlModel, SqlField as Field
+from model import (HasCachedProperties, IdentityMapped, SqlModel,
+                   SqlField as Field, TeamOrganization, UserOrganization)
 import mysql_connection
 import os_random
-import util
 
 
-class Organization(SqlModel):
+class Organization(HasCachedProperties, IdentityMapped, SqlModel):
     table = 'organization'
 
     py_table_definition = {
@@ -124,11 +123,11 @@ class Organization(SqlModel):
         query = '''
             SELECT o.*
             FROM `organization` o
-            JOIN `team` t
-              ON t.`organization_ids` LIKE BINARY CONCAT('%%', o.`uid`, '%%')
-            WHERE t.`uid` = %s
+            JOIN `{membership_table}` m
+              ON m.`organization_id` = o.`uid`
+            WHERE m.`team_id` = %s
             ORDER BY o.`name`
-        '''
+        '''.format(membership_table=TeamOrganization.table)
         params = (team_id,)
 
         with mysql_connection.connect() as sql:
@@ -137,54 +136,45 @@ class Organization(SqlModel):
         return [klass.row_dict_to_obj(d) for d in row_dicts]
 
     @classmethod
-    def get_cached_properties_from_db(self, org_id):
+    def get_cached_properties_from_db_multi(klass, org_ids):
         """Count how many related users and teams there are."""
+        interps = ', '.join(['%s'] * len(org_ids))
         query = '''
-            SELECT COUNT(DISTINCT(t.`uid`)) as num_teams
-            ,      COUNT(DISTINCT(u.`uid`)) as num_users
+            SELECT
+                o.`uid` as uid,
+                IFNULL(t.`num_teams`, 0) as num_teams,
+                IFNULL(u.`num_users`, 0) as num_users
             FROM `organization` o
-            LEFT OUTER JOIN `user` u
-              ON  u.`owned_organizations` LIKE BINARY %s
-            LEFT OUTER JOIN `team` t
-              ON  t.`organization_ids` LIKE BINARY %s
-            WHERE o.`uid` = %s
-        '''
-        params = (
-            '%{}%'.format(org_id),
-            '%{}%'.format(org_id),
-            org_id,
+            LEFT JOIN (
+                SELECT `organization_id`, COUNT(`team_id`) as num_teams
+                FROM `{team_membership_table}`
+                WHERE `organization_id` IN ({interps})
+                GROUP BY `organization_id`
+            ) t
+              ON t.`organization_id` = o.`uid`
+            LEFT JOIN (
+                SELECT `organization_id`, COUNT(`user_id`) as num_users
+                FROM `{user_membership_table}`
+                WHERE `organization_id` IN ({interps})
+                GROUP BY `organization_id`
+            ) u
+              ON u.`organization_id` = o.`uid`
+            WHERE o.`uid` IN ({interps})
+        '''.format(
+            team_membership_table=TeamOrganization.table,
+            user_membership_table=UserOrganization.table,
+            interps=interps,
         )
+        params = tuple(org_ids) * 3
 
         with mysql_connection.connect() as sql:
             row_dicts = sql.select_query(query, params)
 
-        if len(row_dicts) == 0:
-            return {}
-        elif len(row_dicts) == 1:
-            # {'num_users': int, 'num_teams': int}
-            return {k: int(v) for k, v in row_dicts[0].items()}
-        else:
-            raise Exception(
-                "Multiple results for organization cached properties.")
-
-    @classmethod
-    def update_cached_properties(klass, org_id):
-        """If we find the org in the db, query for rel counts and cache."""
-        from_db = Organization.get_cached_properties_from_db(org_id)
-        if from_db:
-            memcache.set(util.cached_properties_key(org_id), from_db)
-        return from_db
-
-    def to_client_dict(self):
-        """Decorate the org with counts of related objects; cached."""
-        d = super(Organization, self).to_client_dict()
-
-        # Decorate the team with counts of related objects; cached.
-        d.update(self.default_cached_properties)
-        cached = memcache.get(util.cached_properties_key(self.uid))
-        if cached:
-            d.update(cached)
-        else:
-            d.update(Organization.update_cached_properties(self.uid))
-
-        return d
+        # {uid: {'num_users': int, 'num_teams': int}}
+        return {
+            r['uid']: {
+                'num_teams': int(r['num_teams']),
+                'num_users': int(r['num_users']),
+            }
+            for r in row_dicts
+        }
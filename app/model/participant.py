@@ -3,15 +3,29 @@ Participant
 ===========
 
 Complement to a Neptune participant, scoped to a classroom.
+
+Each write adds or subtracts the participant from `num_students` of the
+classrooms they joined or left, rather than recounting the classrooms.
+put_multi() does this once for the whole batch.
 """
+import collections
 import logging
 import re
+import threading
 import unicodedata
 
-from model import SqlModel, SqlField as Field
+from model import SqlModel, SqlField as Field, ParticipantClassroom
+from .classroom import Classroom
+from .team import Team
+from . import keyset
+import export
 import mysql_connection
 
 
+# Uids being saved by put_multi(), whose after_put() leaves the syncing to it.
+_local = threading.local()
+
+
 class Participant(SqlModel):
     table = 'participant'
 
@@ -109,43 +123,188 @@ class Participant(SqlModel):
 
         stripped_ids = [klass.strip_token(id) for id in student_ids]
 
-        student_id_clause = 'AND `stripped_student_id` IN({})'.format(
+        student_id_clause = 'AND p.`stripped_student_id` IN({})'.format(
             ','.join(['%s'] * len(stripped_ids))
         )
         query = '''
-            SELECT *
-            FROM   `{table}`
+            SELECT p.*
+            FROM   `{table}` p
+            JOIN   `{membership_table}` m
+              ON   m.`participant_id` = p.`uid`
             WHERE
               # While the query would run without the team id (b/c classroom
               # would constrain it), including it is useful because when a
               # student id is included, the engine can then use the table's
               # team-student_id index. Try this query with EXPLAIN to see more.
-              `team_id` = %s AND
-              `classroom_ids` LIKE BINARY %s
+              p.`team_id` = %s AND
+              m.`classroom_id` = %s
               {student_id_clause}
         '''.format(
             table=klass.table,
+            membership_table=ParticipantClassroom.table,
             student_id_clause=student_id_clause if stripped_ids else '',
         )
-        params = [team_id, '%{}%'.format(classroom_id)]
-
-        if stripped_ids:
-            params.append(stripped_ids)
+        params = [team_id, classroom_id] + stripped_ids
 
         with mysql_connection.connect() as sql:
             row_dicts = sql.select_query(query, tuple(params))
         return [klass.row_dict_to_obj(d) for d in row_dicts]
 
+    @classmethod
+    def export(klass, parent_kind, parent_id, modified_since=None,
+               cursor=None, n=export.page_size):
+        """One page of the participants of a team, classroom, or program, in
+        order of when they were last modified.
+
+        Args:
+            parent_kind: str, 'Team', 'Classroom', or 'Program'.
+            parent_id: str, uid of the parent.
+            modified_since: datetime, optional, only participants modified at
+                or after this time, for incremental exports.
+            cursor: str, optional, from the previous page with the same
+                arguments, see keyset.
+            n: int, maximum participants in the page.
+
+        Returns tuple of (list of participants, cursor str or None if this is
+        the last page). Raises keyset.InvalidCursor.
+        """
+        parent_clauses = {
+            'Team': '`team_id` = %s',
+            'Classroom': '''`uid` IN (
+                SELECT `participant_id`
+                FROM `{membership_table}`
+                WHERE `classroom_id` = %s
+            )'''.format(membership_table=ParticipantClassroom.table),
+            'Program': '''`team_id` IN (
+                SELECT `uid` FROM `{team_table}` WHERE `program_id` = %s
+            )'''.format(team_table=Team.table),
+        }
+        if parent_kind not in parent_clauses:
+            raise ValueError("Can't export participants of a {}."
+                             .format(parent_kind))
+
+        clauses = [parent_clauses[parent_kind]]
+        params = (parent_id,)
+        if modified_since:
+            clauses.append('`modified` >= %s')
+            params += (modified_since,)
+        if cursor:
+            seek, seek_params = keyset.seek_clause(
+                ['`modified`', '`uid`'], 'ASC', cursor)
+            clauses.append(seek)
+            params += seek_params
+
+        query = '''
+            SELECT *
+            FROM `{table}`
+            WHERE {where}
+            ORDER BY `modified`, `uid`
+            LIMIT %s
+        '''.format(
+            table=klass.table,
+            where=' AND '.join(clauses),
+        )
+        params += (n + 1,)
+
+        with mysql_connection.connect() as sql:
+            row_dicts = sql.select_query(query, params)
+
+        row_dicts, next_cursor = keyset.trim_page(
+            row_dicts, ['modified', 'uid'], n)
+        return [klass.row_dict_to_obj(d) for d in row_dicts], next_cursor
+
     @classmethod
     def count_for_classroom(klass, classroom_id):
         query = '''
-            SELECT COUNT(`uid`)
-            FROM   `{table}`
-            WHERE  `classroom_ids` LIKE BINARY %s
-        '''.format(table=klass.table)
-        params = ['%{}%'.format(classroom_id)]
+            SELECT COUNT(`participant_id`)
+            FROM   `{membership_table}`
+            WHERE  `classroom_id` = %s
+        '''.format(membership_table=ParticipantClassroom.table)
+        params = [classroom_id]
 
         with mysql_connection.connect() as sql:
             num_students = sql.select_single_value(query, tuple(params))
 
         return num_students
+
+    @classmethod
+    def update_num_students(klass, team_ids, old_ids_by_ppt, new_ids_by_ppt):
+        """Count participants joining and leaving classrooms.
+
+        Args:
+            team_ids: list of teams of the participants, whose cached
+                participation_base changes with their classrooms.
+            old_ids_by_ppt: dict of participant uid to set of classroom ids
+                before the write.
+            new_ids_by_ppt: same, after the write.
+        """
+        deltas = collections.Counter()
+        for ppt_id, old_ids in old_ids_by_ppt.items():
+            new_ids = new_ids_by_ppt.get(ppt_id, set())
+            for classroom_id in new_ids - old_ids:
+                deltas[classroom_id] += 1
+            for classroom_id in old_ids - new_ids:
+                deltas[classroom_id] -= 1
+
+        if any(deltas.values()):
+            Classroom.add_num_students(deltas)
+            Team.mark_dirty(team_ids)
+
+    @classmethod
+    def delete_multi(klass, entities):
+        entities = list(entities)
+        uids = [e.uid for e in entities]
+        old_ids_by_ppt = ParticipantClassroom.get_related_ids_multi(uids)
+
+        super(Participant, klass).delete_multi(entities)
+        ParticipantClassroom.delete_for_entities(uids)
+
+        klass.update_num_students(
+            list(set(e.team_id for e in entities)), old_ids_by_ppt, {})
+
+    @classmethod
+    def put_multi(klass, entities, *args, **kwargs):
+        """Save participants, then sync their classroom memberships and
+        counts once for the whole batch, rather than per participant in
+        after_put()."""
+        entities = list(entities)
+        uids = [e.uid for e in entities]
+        old_ids_by_ppt = ParticipantClassroom.get_related_ids_multi(uids)
+
+        _local.batched = set(uids)
+        try:
+            result = super(Participant, klass).put_multi(
+                entities, *args, **kwargs)
+        finally:
+            _local.batched = set()
+
+        new_ids_by_ppt = {e.uid: set(e.classroom_ids or []) for e in entities}
+        ParticipantClassroom.set_related_ids_multi(
+            {uid: list(ids) for uid, ids in new_ids_by_ppt.items()})
+        klass.update_num_students(
+            list(set(e.team_id for e in entities)),
+            old_ids_by_ppt,
+            new_ids_by_ppt,
+        )
+
+        return result
+
+    def after_put(self, init_kwargs, *args, **kwargs):
+        if self.uid in getattr(_local, 'batched', ()):
+            # See put_multi().
+            return
+
+        # The indexed copy, before it's synced, has the classrooms this
+        # participant was in before the write, even if this is a new
+        # participant or init_kwargs is out of date.
+        old_ids = ParticipantClassroom.get_related_ids_multi(
+            [self.uid])[self.uid]
+
+        # Keep the indexed copy of classroom_ids in sync.
+        ParticipantClassroom.set_related_ids(self.uid, self.classroom_ids or [])
+
+        self.update_num_students(
+            [self.team_id],
+            {self.uid: old_ids},
+            {self.uid: set(self.classroom_ids or [])},
+        )
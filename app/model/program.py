@@ -7,11 +7,12 @@ users are tasked with during cycles.
 """
 import logging
 
-from model import SqlModel, SqlField as Field
+from model import IdentityMapped, SqlModel, SqlField as Field
+from . import code_context
 import mysql_connection
 
 
-class Program(SqlModel):
+class Program(IdentityMapped, SqlModel):
     table = 'program'
 
     py_table_definition = {
@@ -100,3 +101,8 @@ class Program(SqlModel):
     def get_by_label(klass, label):
         programs = Program.get(label=label)
         return programs[0] if len(programs) > 0 else None
+
+    def after_put(self, init_kwargs, *args, **kwargs):
+        # Flags like use_classrooms are cached for every classroom code.
+        if init_kwargs.get('use_classrooms', None) != self.use_classrooms:
+            code_context.invalidate_for_program(self.uid)
@@ -9,6 +9,7 @@ import datetime
 import logging
 
 from model import SqlModel, SqlField as Field
+from . import keyset
 import config
 import mysql_connection
 
@@ -95,12 +96,55 @@ class Report(SqlModel):
         return super(klass, klass).create(**kwargs)
 
     @classmethod
-    def get_previews(klass, week):
-        return klass.get(
-            filename='{}.html'.format(week),
-            preview=True,
-            n=float('inf'),
+    def put_multi_for_parent_file(klass, reports):
+        """Insert or update many reports in one query, matching existing ones
+        on the parent-file index, as put_for_index(report, 'parent-file') does
+        for one.
+
+        If reports share a parent and filename, the last one is saved.
+
+        Returns list of saved reports, in the same order.
+        """
+        if not reports:
+            return []
+
+        latest = {(r.parent_id, r.filename): r for r in reports}
+        parent_ids = list({k[0] for k in latest})
+        filenames = list({k[1] for k in latest})
+
+        query = '''
+            SELECT `uid`, `short_uid`, `created`, `parent_id`, `filename`
+            FROM `{table}`
+            WHERE `parent_id` IN ({parent_interps})
+              AND `filename` IN ({filename_interps})
+        '''.format(
+            table=klass.table,
+            parent_interps=', '.join(['%s'] * len(parent_ids)),
+            filename_interps=', '.join(['%s'] * len(filenames)),
         )
+        params = tuple(parent_ids + filenames)
+
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query(query, params)
+
+        # Take over the identity of any existing report, so the insert
+        # updates it rather than colliding with it.
+        for row in rows:
+            report = latest.get((row['parent_id'], row['filename']), None)
+            if report:
+                report.uid = row['uid']
+                report.short_uid = row['short_uid']
+                report.created = row['created']
+
+        klass.put_multi(latest.values())
+
+        return [latest[(r.parent_id, r.filename)] for r in reports]
+
+    @classmethod
+    def get_previews(klass, week):
+        """Every preview report of a week, read a page at a time."""
+        where = {'filename': '{}.html'.format(week), 'preview': True}
+        return list(keyset.walk(klass, where, n=1000))
 
     @classmethod
     def release_previews(klass, week):
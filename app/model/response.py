@@ -4,9 +4,12 @@ Response
 
 Responses of users running a single survey together with their students.
 
+Bodies are stored a row per key in ResponseBodyKey, so saving an answer only
+writes that answer. The `body` column is only read for responses that have no
+key rows, i.e. ones written before keys were stored separately.
+
 Note: schema must be kept in sync with the ResponseBackup.
 """
-from google.appengine.api import taskqueue
 import copy
 import datetime
 import json
@@ -16,7 +19,11 @@ import MySQLdb
 from model import (SqlModel, SqlField as Field, JsonTextValueLengthError,
                    JsonTextDictLengthError, JsonTextLengthError,
                    JSON_TEXT_VALUE_MAX, JSON_TEXT_DICT_MAX,
-                   JSON_TEXT_MAX)
+                   JSON_TEXT_MAX, ResponseBackup, ResponseBodyKey,
+                   ResponseHistory)
+from . import keyset
+import config
+import export
 import mysql_connection
 import util
 
@@ -66,6 +73,7 @@ class Response(SqlModel):
             # values within 0 to 100.
             Field('progress',      'tinyint', 4,      True,     False, 0,       None),
             Field('page',          'tinyint', 4,      True,     True,  SqlModel.sql_null, None),
+            # Superseded by ResponseBodyKey, see module docstring.
             Field('body',          'text',    None,   None,     True,  None,    None),
         ],
         'primary_key': ['uid'],
@@ -117,14 +125,56 @@ class Response(SqlModel):
 
         return super(klass, klass).create(**kwargs)
 
+    @classmethod
+    def get(klass, *args, **kwargs):
+        return klass.load_bodies(super(Response, klass).get(*args, **kwargs))
+
+    @classmethod
+    def get_by_id(klass, id_or_ids):
+        result = super(Response, klass).get_by_id(id_or_ids)
+        if isinstance(result, list):
+            return klass.load_bodies(result)
+        elif result:
+            klass.load_bodies([result])
+        return result
+
+    @classmethod
+    def load_bodies(klass, responses):
+        """Set the body of each response from its key rows, in one query.
+
+        Returns the same list of responses.
+        """
+        bodies = ResponseBodyKey.get_bodies([r.uid for r in responses])
+        for r in responses:
+            if r.uid in bodies:
+                r.body = bodies[r.uid]
+        return responses
+
+    def put(self, *args, **kwargs):
+        result = super(Response, self).put(*args, **kwargs)
+        ResponseBodyKey.set_bodies({self.uid: self.body})
+        return result
+
+    @classmethod
+    def put_multi(klass, entities, *args, **kwargs):
+        entities = list(entities)
+        result = super(Response, klass).put_multi(entities, *args, **kwargs)
+        ResponseBodyKey.set_bodies({r.uid: r.body for r in entities})
+        return result
+
+    @classmethod
+    def delete_multi(klass, entities):
+        super(Response, klass).delete_multi(entities)
+        ResponseBodyKey.delete_for_responses([r.uid for r in entities])
+
     @classmethod
     def insert_or_conflict(klass, params):
         """Put a new entity to the db, or raise if it exists.
 
         Returns the inserted response.
 
-        Raises ResponseIndexConflict, JsonTextValueLengthError, or
-        JsonTextDictLengthError.
+        Raises ResponseIndexConflict, JsonTextValueLengthError,
+        JsonTextDictLengthError, or JsonTextLengthError.
         """
         # The tactic is to skip the normal insert-or-update check and do a
         # blind insert, then catch any duplicate index errors.
@@ -139,17 +189,30 @@ class Response(SqlModel):
         # In this case, before_put has sanity checks.
         response.before_put(response._init_kwargs)
 
+        # Set timestamps here rather than letting the db do it, so the
+        # inserted row is known without reading it back. Datetime columns
+        # don't store microseconds.
+        now = datetime.datetime.now().replace(microsecond=0)
+        response.created = now
+        response.modified = now
+
         row_to_insert = klass.coerce_row_dict(response.to_dict())  # py -> sql
+        if response.body:
+            # Stored as key rows instead.
+            row_to_insert['body'] = None
         try:
             with mysql_connection.connect() as sql:
                 sql.insert_row_dicts(klass.table, [row_to_insert])
-                row = sql.select_star_where(klass.table, uid=response.uid)[0]
+                if response.body:
+                    ResponseBodyKey.upsert(sql, response.uid, response.body)
         except MySQLdb.IntegrityError as e:
             # Expected when there's already a respond matching these params in
             # the type-user-team-parent-module index.
             raise ResponseIndexConflict()
 
-        inserted_response = klass.row_dict_to_obj(row)  # sql -> py
+        # Round trip through sql values, as if read from the db.
+        inserted_response = klass.row_dict_to_obj(row_to_insert)  # sql -> py
+        inserted_response.body = response.body
 
         # Responses are backed up to other tables with this hook.
         inserted_response.after_put(response._init_kwargs)
@@ -171,7 +234,8 @@ class Response(SqlModel):
         Returns the updated response.
 
         Raises ResponseNotFound, ResponseBodyKeyConflict,
-        JsonTextValueLengthError, or JsonTextDictLengthError.
+        JsonTextValueLengthError, JsonTextDictLengthError, or
+        JsonTextLengthError.
 
         MySQLdb uses transactions by default, and waits for you to commit or
         or roll back. That means to transactionalize this operation, we just
@@ -180,9 +244,19 @@ class Response(SqlModel):
         1. Use a SELECT... FOR UPDATE query, which locks the row.
         2. Pack all of the transactions' queries into the same with: block.
 
+        Only the body keys in params are compared, in sql, and only those
+        that aren't stale are locked and written; see lock_body_keys().
+
         http://mysql-python.sourceforge.net/MySQLdb.html
         https://riptutorial.com/mysql/example/24166/row-level-locking
         """
+        new_body = params.pop('body', None) or {}
+        if not isinstance(new_body, dict):
+            raise Exception(
+                u"Expected dictionary for response body, got {}: {}"
+                .format(type(new_body), new_body)
+            )
+
         # Avoid retries, which close and re-open the connection, which might
         # interrupt our transaction.
         with mysql_connection.connect(retry_on_error=False) as sql:
@@ -194,30 +268,245 @@ class Response(SqlModel):
 
             row = klass.coerce_row_dict(rows[0])  # sql -> python
 
+            if row['body']:
+                klass.move_body_to_keys(sql, response_id, row['body'])
+                params['body'] = None
+
             # Update any new values in the body. Assume any other parameters
             # have been approved by the api handler.
-            params['body'] = Response.mix_body(
-                row['body'], params['body'], force)
-
-            # Run the checks in before_put(). Don't just do entity.put()
-            # since that would commit the transaction. Instead mock just enough
-            # of an entity to run the sanity checks.
-            temp_entity = klass(**params)
-            temp_entity.before_put(temp_entity._init_kwargs)
-
+            fresh, old_entries = klass.lock_body_keys(
+                sql, response_id, new_body, {}, force)
+            mixed = Response.mix_body(old_entries, fresh, force)
+            # Timestamps as they'll be stored and read, rather than datetimes.
+            changed = json.loads(json.dumps(
+                {k: v for k, v in mixed.items()
+                 if old_entries.get(k, None) != v},
+                default=util.json_dumps_default,
+            ))
+
+            # Raises before writing anything, as does upsert().
+            klass.check_body_length(sql, response_id, changed)
+
+            # The whole body is returned, so read the keys that weren't
+            # locked now, rather than reading everything back after writing.
+            body = ResponseBodyKey.get_bodies(
+                [response_id], sql, exclude_keys=fresh.keys(),
+            ).get(response_id, {})
+            body.update(old_entries)
+            body.update(changed)
+
+            ResponseBodyKey.upsert(sql, response_id, changed)
+
+            # Set the modified time here rather than letting the db do it, so
+            # the updated row is known without reading it back. Also, saving
+            # only body keys leaves the row itself unchanged, which wouldn't
+            # update the modified time on its own.
+            now = datetime.datetime.now()
+            params['modified'] = now.replace(microsecond=0)
             new_row = klass.coerce_row_dict(params)  # python -> sql
 
             sql.update_row(klass.table, 'uid', response_id, **new_row)
 
-            # w/ updated modified time
-            row = sql.select_star_where(klass.table, uid=response_id)[0]
+        # The locked row plus what was just written to it.
+        updated_response = klass.row_dict_to_obj(
+            dict(rows[0], **new_row))  # sql -> py
+        if body:
+            updated_response.body = body
+
+        # Record only what changed, see ResponseHistory.
+        ResponseBackup.queue([{
+            'uid': response_id,
+            'modified': ResponseHistory.format_time(now),
+            'kind': ResponseHistory.DELTA,
+            'progress': updated_response.progress,
+            'page': updated_response.page,
+            'body': changed,
+        }])
 
-        updated_response = klass.row_dict_to_obj(row)  # sql -> py
+        return updated_response
 
-        # Responses are backed up to other tables with this hook.
-        updated_response.after_put(temp_entity._init_kwargs)
+    @classmethod
+    def patch_body(klass, response_id, ops, force=False):
+        """Apply key operations to a response body in one short transaction.
 
-        return updated_response
+        Unlike update_or_conflict(), only the named keys are read, and the
+        rest of the body and the response itself are never loaded.
+
+        Args:
+            response_id: str, uid of the response to update
+            ops: list of dicts, each either
+                {'op': 'set', 'key': str, 'value': ..., 'modified': str}
+                {'op': 'remove', 'key': str, 'modified': str}
+                where modified is the timestamp of the key as the client last
+                saw it, or None for a key the client thinks is new.
+            force: bool, see Response.mix_body()
+
+        Returns dict of the response's uid and new modified time, and `body`,
+        a dict of each changed key to its new modified time, or None if it
+        was removed. Keys set to their current value aren't changed.
+
+        Raises ResponseNotFound, ResponseBodyKeyConflict,
+        JsonTextValueLengthError, JsonTextDictLengthError, or
+        JsonTextLengthError.
+        """
+        to_set = {op['key']: {'value': op.get('value', None),
+                              'modified': op.get('modified', None)}
+                  for op in ops if op['op'] == 'set'}
+        to_remove = {op['key']: op.get('modified', None)
+                     for op in ops if op['op'] == 'remove'}
+
+        with mysql_connection.connect(retry_on_error=False) as sql:
+            # Lock the response row, so this is serialized with any other
+            # write, but only read the legacy body column.
+            query = '''
+                SELECT `body`
+                FROM `{table}`
+                WHERE `uid` = %s
+                FOR UPDATE
+            '''.format(table=klass.table)
+            rows = sql.select_query(query, (response_id,))
+
+            if not rows:
+                raise ResponseNotFound()
+
+            if rows[0]['body']:
+                klass.move_body_to_keys(
+                    sql, response_id, json.loads(rows[0]['body']))
+                sql.update_row(klass.table, 'uid', response_id, body=None)
+
+            # Removing a key follows the same rules as changing its value.
+            fresh, old_entries = klass.lock_body_keys(
+                sql, response_id, to_set, to_remove, force)
+            for k, mod in to_remove.items():
+                if (not force and k in old_entries and
+                        mod > old_entries[k]['modified']):
+                    raise Exception(
+                        "Got modified time newer than db: {}: {}"
+                        .format(k, mod))
+
+            mixed = klass.mix_body(old_entries, fresh, force)
+
+            # Timestamps as they'll be stored and read, rather than datetimes.
+            changed = json.loads(json.dumps(
+                {k: v for k, v in mixed.items()
+                 if old_entries.get(k, None) != v},
+                default=util.json_dumps_default,
+            ))
+            removed = [k for k in to_remove if k in old_entries]
+
+            klass.check_body_length(sql, response_id, changed, removed)
+            ResponseBodyKey.upsert(sql, response_id, changed)
+            ResponseBodyKey.delete_keys(sql, response_id, removed)
+
+            now = datetime.datetime.now()
+            sql.update_row(klass.table, 'uid', response_id,
+                           modified=now.replace(microsecond=0))
+
+        # Record only what changed, see ResponseHistory. Progress and page
+        # are unchanged.
+        delta = dict(changed, **{k: None for k in removed})
+        ResponseBackup.queue([{
+            'uid': response_id,
+            'modified': ResponseHistory.format_time(now),
+            'kind': ResponseHistory.DELTA,
+            'progress': None,
+            'page': None,
+            'body': delta,
+        }])
+
+        return {
+            'uid': response_id,
+            'modified': now.strftime(config.iso_datetime_format),
+            'body': {k: v['modified'] if v else None
+                     for k, v in delta.items()},
+        }
+
+    @classmethod
+    def lock_body_keys(klass, sql, response_id, to_set, to_remove, force):
+        """Lock and read the body keys about to be written, once sql has
+        checked that the client saw their latest values.
+
+        Stale keys aren't locked. Setting one to the value it already has
+        isn't a conflict, as in mix_body(), and it's left out of the keys to
+        set.
+
+        Args:
+            sql: open connection, in a transaction that has locked the
+                response row.
+            response_id: str
+            to_set: dict of key to body entry, with `value` and `modified`
+                as the client sent them.
+            to_remove: dict of key to modified, as the client last saw it.
+            force: bool, see mix_body().
+
+        Returns tuple of (dict of the entries in to_set still to be mixed,
+        dict of each locked key that exists to its current entry).
+
+        Raises ResponseBodyKeyConflict.
+        """
+        stale = {}
+        if not force:
+            modifieds = {k: e.get('modified', None)
+                         for k, e in to_set.items()}
+            modifieds.update(to_remove)
+            stale = ResponseBodyKey.get_stale(sql, response_id, modifieds)
+
+        conflicted_keys = [
+            k for k, entry in stale.items()
+            if k in to_remove or
+            entry['value'] != to_set[k].get('value', None)
+        ]
+        if conflicted_keys:
+            # Don't commit any of the incoming changes.
+            raise ResponseBodyKeyConflict(conflicted_keys)
+
+        fresh = {k: e for k, e in to_set.items() if k not in stale}
+        keys = [k for k in set(to_set) | set(to_remove) if k not in stale]
+        return fresh, ResponseBodyKey.get_for_update(sql, response_id, keys)
+
+    @classmethod
+    def move_body_to_keys(klass, sql, response_id, body):
+        """Copy a body from the body column to key rows, if it isn't there.
+
+        The column is only set for responses saved before bodies were stored
+        as key rows, or with put(), which writes both.
+        """
+        if ResponseBodyKey.count(sql, response_id) == 0:
+            ResponseBodyKey.upsert(sql, response_id, body)
+
+    @classmethod
+    def check_body_length(klass, sql, response_id, changed, removed=tuple()):
+        """Raises JsonTextDictLengthError or JsonTextLengthError if writing
+        the changed keys would make the whole body too long.
+
+        Bodies are stored a row per key, but are still copied whole into text
+        columns, e.g. by put(), ResponseHistory, and ResponseBackup, so they
+        get the same limits as before_put().
+
+        Args:
+            sql: open connection, so this can join a transaction.
+            response_id: str
+            changed: dict of key to the body entry it will have.
+            removed: list of keys that will be deleted.
+        """
+        if not changed:
+            return
+        num_keys, length = ResponseBodyKey.measure(
+            sql, response_id, list(changed) + list(removed))
+
+        num_keys += len(changed)
+        if num_keys >= JSON_TEXT_DICT_MAX:
+            raise JsonTextDictLengthError()
+
+        length += sum(
+            len(json.dumps(k)) - 2 +
+            len(json.dumps(v, default=util.json_dumps_default))
+            for k, v in changed.items()
+        )
+        # json.dumps() of the body also quotes each key and separates it with
+        # ': ' and ', ', inside braces.
+        if length + 6 * num_keys >= JSON_TEXT_MAX:
+            raise JsonTextLengthError()
 
     @classmethod
     def get_for_teams_unsafe(klass, team_ids, parent_id=None):
@@ -243,12 +532,147 @@ class Response(SqlModel):
             row_dicts = sql.select_query(query, params)
 
         unsafe_responses = [klass.row_dict_to_obj(d) for d in row_dicts]
-        return unsafe_responses
+        return klass.load_bodies(unsafe_responses)
 
     @classmethod
     def get_for_teams(klass, user, team_ids, parent_id=None):
-        unsafe = klass.get_for_teams_unsafe(team_ids, parent_id)
-        return klass.redact_private_responses(unsafe, user)
+        """Responses on teams, with bodies only where the user may see them.
+
+        Redacts in the query rather than after, so private bodies are never
+        read from the db. Rules are the same as redact_private_responses().
+        """
+        if user.super_admin:
+            return klass.get_for_teams_unsafe(team_ids, parent_id)
+
+        if parent_id:
+            where = 'AND `parent_id` = %s'
+            where_params = tuple(team_ids) + (parent_id,)
+        else:
+            where = ''
+            where_params = tuple(team_ids)
+
+        columns, column_params = klass.redacted_columns(user)
+        query = '''
+            SELECT {columns}
+            FROM `{table}`
+            WHERE `team_id` IN({interps})
+            {where}
+        '''.format(
+            columns=columns,
+            table=klass.table,
+            interps=', '.join(['%s'] * len(team_ids)),
+            where=where,
+        )
+
+        with mysql_connection.connect() as sql:
+            row_dicts = sql.select_query(query, column_params + where_params)
+
+        return klass.redacted_rows_to_objs(row_dicts)
+
+    @classmethod
+    def redacted_columns(klass, user):
+        """Sql to select every column, with the body NULL where the user
+        may not see it, and whether they may as `visible`.
+
+        Returns tuple of (sql, params).
+        """
+        if user.super_admin:
+            visible = 'TRUE'
+            visible_params = tuple()
+        else:
+            visible = '(NOT `private` OR (`type` = %s AND `user_id` = %s))'
+            visible_params = (klass.USER_LEVEL_SYMBOL, user.uid)
+
+        columns = '''
+              {columns},
+              IF({visible}, `body`, NULL) AS `body`,
+              {visible} AS `visible`
+        '''.format(
+            columns=', '.join(
+                '`{}`'.format(f.name)
+                for f in klass.py_table_definition['fields']
+                if f.name != 'body'
+            ),
+            visible=visible,
+        )
+        return columns, visible_params * 2
+
+    @classmethod
+    def redacted_rows_to_objs(klass, row_dicts):
+        """Responses from rows selected with redacted_columns(), with bodies
+        loaded where visible, and empty otherwise."""
+        visible_ids = set(d['uid'] for d in row_dicts if d.pop('visible'))
+        responses = [klass.row_dict_to_obj(d) for d in row_dicts]
+
+        # Only visible responses' key rows are read.
+        klass.load_bodies([r for r in responses if r.uid in visible_ids])
+        for r in responses:
+            if r.uid not in visible_ids:
+                r.body = {}
+
+        return responses
+
+    @classmethod
+    def export(klass, user, parent_kind, parent_id, modified_since=None,
+               cursor=None, n=export.page_size):
+        """One page of the responses of a team, cycle, or program, redacted
+        as by get_for_teams(), in order of when they were last modified.
+
+        Args:
+            user: User, who the responses are redacted for.
+            parent_kind: str, 'Team', 'Cycle', or 'Program'.
+            parent_id: str, uid of the parent.
+            modified_since: datetime, optional, only responses modified at or
+                after this time, for incremental exports.
+            cursor: str, optional, from the previous page with the same
+                arguments, see keyset.
+            n: int, maximum responses in the page.
+
+        Returns tuple of (list of responses, cursor str or None if this is the
+        last page). Raises keyset.InvalidCursor.
+        """
+        parent_clauses = {
+            'Team': '`team_id` = %s',
+            'Cycle': '`parent_id` = %s',
+            'Program': '''`team_id` IN (
+                SELECT `uid` FROM `team` WHERE `program_id` = %s
+            )''',
+        }
+        if parent_kind not in parent_clauses:
+            raise ValueError("Can't export responses of a {}."
+                             .format(parent_kind))
+
+        columns, params = klass.redacted_columns(user)
+        clauses = [parent_clauses[parent_kind]]
+        params += (parent_id,)
+        if modified_since:
+            clauses.append('`modified` >= %s')
+            params += (modified_since,)
+        if cursor:
+            seek, seek_params = keyset.seek_clause(
+                ['`modified`', '`uid`'], 'ASC', cursor)
+            clauses.append(seek)
+            params += seek_params
+
+        query = '''
+            SELECT {columns}
+            FROM `{table}`
+            WHERE {where}
+            ORDER BY `modified`, `uid`
+            LIMIT %s
+        '''.format(
+            columns=columns,
+            table=klass.table,
+            where=' AND '.join(clauses),
+        )
+        params += (n + 1,)
+
+        with mysql_connection.connect() as sql:
+            row_dicts = sql.select_query(query, params)
+
+        row_dicts, next_cursor = keyset.trim_page(
+            row_dicts, ['modified', 'uid'], n)
+        return klass.redacted_rows_to_objs(row_dicts), next_cursor
 
     @classmethod
     def redact_private_responses(klass, unsafe_responses, user):
@@ -351,14 +775,6 @@ class Response(SqlModel):
             raise JsonTextLengthError()
 
     def after_put(self, *args, **kwargs):
-        """Save a copy of this response to the backup table.
-
-        Taskqueue docs:
-        https://cloud.google.com/appengine/docs/standard/python/refdocs/google.appengine.api.taskqueue#google.appengine.api.taskqueue.add
-        """
-        taskqueue.add(
-            url='/task/backup_response',
-            payload=json.dumps(self.to_dict(), default=util.json_dumps_default),
-            headers={'Content-Type': 'application/json'},
-            # default retry_options makes 5 attempts
-        )
+        """Save a copy of this response to the backup table, eventually. See
+        ResponseBackup.drain()."""
+        ResponseBackup.queue([self.to_dict()])
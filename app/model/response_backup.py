@@ -10,7 +10,13 @@ Note: schema must be kept in sync with the response table
 
 While entries in `response` mutate as people answer more questions or return to
 their response and change it, entries in `response_backup` are immutable. A new
-one is written with every change. So it gives us a history.
+one was written with every change. So it gives us a history.
+
+New history is written to ResponseHistory as deltas instead, so this table
+only holds history from before that. This class still runs the pipeline that
+writes it: each save queues a pull task, and /cron/backup_responses drains the
+queue with multi-row inserts. See drain() for delivery guarantees, and stats()
+for how far behind it is.
 """
 from google.appengine.api import taskqueue
 import copy
@@ -18,7 +24,8 @@ import datetime
 import json
 import logging
 
-from model import SqlModel
+from model import ResponseHistory, SqlModel
+import counters
 import mysql_connection
 import util
 
@@ -32,6 +39,23 @@ class ResponseBackup(SqlModel):
 
     json_props = ['body']
 
+    # Columns copied from the response table.
+    backup_columns = ['uid', 'short_uid', 'created', 'modified', 'type',
+                      'private', 'user_id', 'team_id', 'parent_id',
+                      'module_label', 'progress', 'page', 'body']
+
+    # Pull queue, see queue.yaml.
+    queue_name = 'response-backup'
+    # Most tasks lease_tasks() will return at once.
+    batch_size = 1000
+    # Long enough to insert a batch; if exceeded the batch is written again.
+    lease_seconds = 120
+    # Stay well inside the cron request deadline.
+    max_batches_per_drain = 50
+
+    counter_prefix = 'response_backup'
+    metric_names = ('queued', 'batches', 'written', 'lag_seconds')
+
     @classmethod
     def get_table_definition(klass):
         """We don't need to introspect fields/params, so just hard-code."""
@@ -56,3 +80,106 @@ class ResponseBackup(SqlModel):
             )
             ENGINE=InnoDB DEFAULT CHARSET=utf8;
         '''
+
+    @classmethod
+    def queue(klass, payloads):
+        """Buffer history to be written in batches by drain().
+
+        Args:
+            payloads: list of dicts, see ResponseHistory.payload_to_row().
+        """
+        tasks = [
+            taskqueue.Task(
+                payload=json.dumps(p, default=util.json_dumps_default),
+                method='PULL',
+            )
+            for p in payloads
+        ]
+        taskqueue.Queue(klass.queue_name).add(tasks)
+        counters.increment(klass.counter_prefix, {'queued': len(tasks)})
+
+    @classmethod
+    def drain(klass, max_batches=None):
+        """Write queued history in multi-row inserts, until the queue is empty
+        or after max_batches.
+
+        Tasks are deleted only after their batch is committed, so a failure
+        leaves them to be leased again when the lease runs out. That means a
+        row may be written more than once, but never lost.
+
+        Returns dict summarizing what was written.
+        """
+        if max_batches is None:
+            max_batches = klass.max_batches_per_drain
+
+        queue = taskqueue.Queue(klass.queue_name)
+        num_batches = 0
+        num_rows = 0
+        lag = None
+        while num_batches < max_batches:
+            tasks = queue.lease_tasks(klass.lease_seconds, klass.batch_size)
+            if not tasks:
+                break
+
+            # Checked one at a time, so one bad payload can't hold up the
+            # rest of its batch on every lease.
+            rows = []
+            for task in tasks:
+                try:
+                    rows.append(ResponseHistory.payload_to_row(
+                        json.loads(task.payload)))
+                except ValueError:
+                    # Retrying won't help, so let it be deleted.
+                    logging.error(u"Invalid response backup payload: {}"
+                                  .format(task.payload))
+
+            num_rows += ResponseHistory.insert_rows(rows)
+            queue.delete_tasks(tasks)
+            num_batches += 1
+
+            # Oldest write in the first batch, i.e. how far behind we were.
+            if lag is None and rows:
+                oldest = min(row['modified'] for row in rows)
+                lag = int((datetime.datetime.now() - oldest).total_seconds())
+
+        counters.increment(klass.counter_prefix, {
+            'batches': num_batches,
+            'written': num_rows,
+        })
+        if lag is not None:
+            counters.record(klass.counter_prefix, {'lag_seconds': lag})
+
+        logging.info("Wrote {} response backups in {} batches, lag {}s."
+                     .format(num_rows, num_batches, lag))
+        return {
+            'batches': num_batches,
+            'written': num_rows,
+            'lag_seconds': lag,
+        }
+
+    @classmethod
+    def insert_payloads(klass, payloads):
+        """Insert full copies of responses, from Response.to_dict().
+
+        Only used for push tasks queued before backups were written as
+        history, see task_handlers.BackupResponse.
+
+        Returns number of rows inserted.
+        """
+        rows = []
+        for p in payloads:
+            # Python-friendly values to MySQL-friendly ones. Times come from
+            # Response.to_dict() as iso strings, which need converting.
+            row = klass.coerce_row_dict(p)
+            for key in ('created', 'modified'):
+                row[key] = util.iso_datetime_to_sql(row[key])
+            rows.append({c: row[c] for c in klass.backup_columns})
+
+        with mysql_connection.connect() as sql:
+            sql.insert_row_dicts(klass.table, rows)
+
+        return len(rows)
+
+    @classmethod
+    def stats(klass):
+        return counters.get(klass.counter_prefix, klass.metric_names)
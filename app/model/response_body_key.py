@@ -0,0 +1,300 @@
+"""
+ResponseBodyKey
+===========
+
+Response bodies stored one row per key, e.g. one row per survey question.
+
+Surveys autosave every few seconds, usually changing one or two answers, and
+long surveys have dozens of keys. Storing the body as a single json text
+column meant every save locked, parsed, re-serialized and rewrote all of them.
+With a row per key a save locks and writes only the keys it changes.
+
+Each row holds the json of a body entry exactly as the client sent it, usually
+`{"value": ..., "modified": "2019-01-01T00:00:00Z"}`, so Response can
+reassemble the same body dict. The entry's modified time is copied into its own
+column so stale writes can be found in sql, see get_stale().
+
+These rows are the source of truth for `Response.body`; see Response for how
+they're read and written. Backfilled by
+migrations/20200618000001-response-body-key.js.
+"""
+import datetime
+import json
+
+from model import (SqlModel, SqlField as Field, JsonTextValueLengthError,
+                   JSON_TEXT_VALUE_MAX)
+import config
+import mysql_connection
+import util
+
+
+class ResponseBodyKey(SqlModel):
+    """Rows are never instantiated as entities."""
+    table = 'response_body_key'
+
+    py_table_definition = {
+        'table_name': table,
+        'fields': [
+            #     name,          type,      length, unsigned, null,  default, on_update
+            Field('response_id', 'varchar', 50,     None,     False, None,    None),
+            Field('key',         'varchar', 200,    None,     False, None,    None),
+            # Copied from the entry, NULL if it has none.
+            Field('modified',    'datetime',None,   None,     True,  SqlModel.sql_null, None),
+            # Json of the whole body entry.
+            Field('data',        'text',    None,   None,     False, None,    None),
+        ],
+        # Covers loading a whole body and locking individual keys.
+        'primary_key': ['response_id', 'key'],
+        'indices': [],
+        'engine': 'InnoDB',
+        'charset': 'utf8',
+    }
+
+    @classmethod
+    def parse_modified(klass, modified):
+        """Datetime of an entry's modified time, or None if it has none."""
+        if isinstance(modified, basestring):
+            try:
+                return datetime.datetime.strptime(
+                    modified, config.iso_datetime_format)
+            except ValueError:
+                return None
+        elif isinstance(modified, datetime.datetime):
+            return modified
+        return None
+
+    @classmethod
+    def to_row(klass, response_id, key, entry):
+        """Sql params for one body entry, in column order."""
+        modified = None
+        if isinstance(entry, dict):
+            modified = entry.get('modified', None)
+
+        return (
+            response_id,
+            key,
+            klass.parse_modified(modified),
+            json.dumps(entry, default=util.json_dumps_default),
+        )
+
+    @classmethod
+    def get_bodies(klass, response_ids, sql=None, exclude_keys=tuple()):
+        """Returns dict of response uid to body, for responses with any keys.
+
+        Pass an open connection to read within its transaction. The given
+        keys are left out, e.g. ones already locked and read.
+        """
+        if len(response_ids) == 0:
+            return {}
+
+        if exclude_keys:
+            exclude = 'AND `key` NOT IN ({})'.format(
+                ', '.join(['%s'] * len(exclude_keys)))
+        else:
+            exclude = ''
+        query = '''
+            SELECT `response_id`, `key`, `data`
+            FROM `{table}`
+            WHERE `response_id` IN ({interps})
+            {exclude}
+        '''.format(
+            table=klass.table,
+            interps=', '.join(['%s'] * len(response_ids)),
+            exclude=exclude,
+        )
+        params = tuple(response_ids) + tuple(exclude_keys)
+
+        if sql:
+            rows = sql.select_query(query, params)
+        else:
+            with mysql_connection.connect() as sql:
+                rows = sql.select_query(query, params)
+
+        bodies = {}
+        for row in rows:
+            body = bodies.setdefault(row['response_id'], {})
+            body[row['key']] = json.loads(row['data'])
+        return bodies
+
+    @classmethod
+    def get_stale(klass, sql, response_id, modifieds):
+        """Keys of one body changed since the client last saw them.
+
+        Args:
+            sql: open connection, so this can join a transaction.
+            response_id: str
+            modifieds: dict of key to its modified time as the client last
+                saw it, or None for a key the client thinks is new.
+
+        Returns dict of each stale key to its current body entry.
+        """
+        if len(modifieds) == 0:
+            return {}
+
+        clauses = []
+        params = (response_id,)
+        for k, mod in modifieds.items():
+            mod = klass.parse_modified(mod)
+            if mod is None:
+                # Any existing entry is newer than none at all.
+                clauses.append('`key` = %s')
+                params += (k,)
+            else:
+                clauses.append('(`key` = %s AND `modified` > %s)')
+                params += (k, mod)
+
+        query = '''
+            SELECT `key`, `data`
+            FROM `{table}`
+            WHERE `response_id` = %s
+              AND ({clauses})
+        '''.format(table=klass.table, clauses=' OR '.join(clauses))
+
+        rows = sql.select_query(query, params)
+        return {row['key']: json.loads(row['data']) for row in rows}
+
+    @classmethod
+    def get_for_update(klass, sql, response_id, keys):
+        """Lock and return the given keys of one body, as a dict.
+
+        Keys that don't exist yet are absent from the result.
+        """
+        if len(keys) == 0:
+            return {}
+
+        query = '''
+            SELECT `key`, `data`
+            FROM `{table}`
+            WHERE `response_id` = %s
+              AND `key` IN ({interps})
+            FOR UPDATE
+        '''.format(
+            table=klass.table,
+            interps=', '.join(['%s'] * len(keys)),
+        )
+        params = (response_id,) + tuple(keys)
+
+        rows = sql.select_query(query, params)
+        return {row['key']: json.loads(row['data']) for row in rows}
+
+    @classmethod
+    def count(klass, sql, response_id):
+        query = '''
+            SELECT COUNT(*) AS `num_keys`
+            FROM `{table}`
+            WHERE `response_id` = %s
+        '''.format(table=klass.table)
+        rows = sql.select_query(query, (response_id,))
+        return int(rows[0]['num_keys'])
+
+    @classmethod
+    def measure(klass, sql, response_id, exclude_keys=tuple()):
+        """Number of keys in a body and their combined length, in bytes of
+        key and json. Doesn't count the given keys, e.g. ones about to be
+        rewritten.
+
+        Returns tuple of (num_keys, length).
+        """
+        if exclude_keys:
+            exclude = 'AND `key` NOT IN ({})'.format(
+                ', '.join(['%s'] * len(exclude_keys)))
+        else:
+            exclude = ''
+        query = '''
+            SELECT
+              COUNT(*) AS `num_keys`,
+              COALESCE(SUM(LENGTH(`key`) + LENGTH(`data`)), 0)
+                AS `length`
+            FROM `{table}`
+            WHERE `response_id` = %s
+            {exclude}
+        '''.format(table=klass.table, exclude=exclude)
+        params = (response_id,) + tuple(exclude_keys)
+
+        rows = sql.select_query(query, params)
+        return int(rows[0]['num_keys']), int(rows[0]['length'])
+
+    @classmethod
+    def upsert(klass, sql, response_id, entries):
+        """Write the given body entries, leaving other keys alone.
+
+        Args:
+            sql: open connection, so this can join a transaction.
+            response_id: str
+            entries: dict of key to body entry.
+
+        Raises JsonTextValueLengthError, before writing anything.
+        """
+        if len(entries) == 0:
+            return
+
+        rows = [klass.to_row(response_id, k, entry)
+                for k, entry in entries.items()]
+        if any(len(row[3]) >= JSON_TEXT_VALUE_MAX for row in rows):
+            raise JsonTextValueLengthError()
+
+        query = '''
+            INSERT INTO `{table}` (`response_id`, `key`, `modified`, `data`)
+            VALUES {values}
+            ON DUPLICATE KEY UPDATE
+              `modified` = VALUES(`modified`),
+              `data` = VALUES(`data`)
+        '''.format(
+            table=klass.table,
+            values=', '.join(['(%s, %s, %s, %s)'] * len(entries)),
+        )
+        params = tuple(v for row in rows for v in row)
+        sql.query(query, params)
+
+    @classmethod
+    def delete_keys(klass, sql, response_id, keys):
+        if len(keys) == 0:
+            return
+
+        query = '''
+            DELETE FROM `{table}`
+            WHERE `response_id` = %s
+              AND `key` IN ({interps})
+        '''.format(
+            table=klass.table,
+            interps=', '.join(['%s'] * len(keys)),
+        )
+        sql.query(query, (response_id,) + tuple(keys))
+
+    @classmethod
+    def set_bodies(klass, bodies):
+        """Make the table match whole bodies, e.g. after Response.put().
+
+        Args:
+            bodies: dict of response uid to body dict, or None for no body.
+        """
+        if len(bodies) == 0:
+            return
+
+        # Remove keys that aren't in the current bodies.
+        keep = [(r_id, k) for r_id, body in bodies.items()
+                for k in (body or {})]
+        delete_query = '''
+            DELETE FROM `{table}`
+            WHERE `response_id` IN ({response_interps})
+            {keep_clause}
+        '''.format(
+            table=klass.table,
+            response_interps=', '.join(['%s'] * len(bodies)),
+            keep_clause=(
+                'AND (`response_id`, `key`) NOT IN ({})'.format(
+                    ', '.join(['(%s, %s)'] * len(keep)))
+                if keep else ''
+            ),
+        )
+        delete_params = (
+            tuple(bodies.keys()) + tuple(v for pair in keep for v in pair))
+
+        with mysql_connection.connect() as sql:
+            sql.query(delete_query, delete_params)
+            for response_id, body in bodies.items():
+                klass.upsert(sql, response_id, body or {})
+
+    @classmethod
+    def delete_for_responses(klass, response_ids):
+        klass.set_bodies({uid: None for uid in response_ids})
@@ -0,0 +1,314 @@
+"""
+ResponseHistory
+===========
+
+Every version of every response body, stored as changes.
+
+Times are stored to the microsecond, so saves within the same second stay in
+order, and a row written twice (see ResponseBackup.drain()) sorts next to its
+copy, where replaying it again changes nothing.
+
+Each row is either a delta, the body keys changed by one save, with removed
+keys as null, or a snapshot, a whole body. A body as of any time is the latest
+snapshot before then plus the deltas after it. Rows also record progress and
+page, NULL in deltas that didn't change them.
+
+Saves only know what they changed, so they write deltas; see
+Response.update_or_conflict() and Response.patch_body(). New responses and
+Response.put() write snapshots. Rows are written in batches by
+ResponseBackup.drain(). compact() folds old deltas into a snapshot per day so
+restoring stays fast as history grows.
+
+This replaces full copies in `response_backup`, which still holds history from
+before it existed. The migration that created this table snapshotted every
+response so history is complete from then on.
+"""
+import datetime
+import json
+import logging
+
+from model import SqlModel
+import config
+import mysql_connection
+import util
+
+
+class ResponseHistory(SqlModel):
+    """Rows are never instantiated as entities."""
+    table = 'response_history'
+
+    # Translating a py def here doesn't allow AUTO_INCREMENT. See
+    # get_table_definition().
+    py_table_definition = {'fields': []}
+
+    SNAPSHOT = 'snapshot'
+    DELTA = 'delta'
+
+    # Deltas older than this are folded into snapshots by compact().
+    compact_after_days = 30
+    # Responses compacted per transaction.
+    compact_batch_size = 100
+    # Responses compacted per cron run, so each run fits in a request.
+    max_responses_per_compact = 1000
+
+    @classmethod
+    def get_table_definition(klass):
+        """We don't need to introspect fields/params, so just hard-code."""
+        return '''
+            CREATE TABLE `response_history` (
+              `history_id` int unsigned NOT NULL AUTO_INCREMENT,
+              `response_id` varchar(50) NOT NULL,
+              `modified` datetime(6) NOT NULL,
+              `kind` varchar(10) NOT NULL,
+              `progress` tinyint(4) unsigned DEFAULT NULL,
+              `page` tinyint(4) unsigned DEFAULT NULL,
+              `body` text NOT NULL,
+              PRIMARY KEY (`history_id`),
+              INDEX `response-modified` (`response_id`, `modified`),
+              INDEX `kind-modified` (`kind`, `modified`)
+            )
+            ENGINE=InnoDB DEFAULT CHARSET=utf8;
+        '''
+
+    @classmethod
+    def payload_to_row(klass, payload):
+        """Convert a payload queued by ResponseBackup.queue() to sql values.
+
+        Payloads without a kind are whole responses, from Response.to_dict(),
+        so they're snapshots.
+
+        Raises ValueError if the payload can't be a row.
+        """
+        try:
+            row = {
+                'response_id': payload['uid'],
+                'modified': klass.parse_time(payload['modified']),
+                'kind': payload.get('kind', klass.SNAPSHOT),
+                'progress': payload.get('progress', None),
+                'page': payload.get('page', None),
+                'body': json.dumps(payload['body'] or {},
+                                   default=util.json_dumps_default),
+            }
+        except (AttributeError, KeyError, TypeError) as e:
+            raise ValueError("Invalid history payload, {}: {}"
+                             .format(repr(e), payload))
+
+        if (
+            not isinstance(row['response_id'], basestring) or
+            row['kind'] not in (klass.SNAPSHOT, klass.DELTA)
+        ):
+            raise ValueError("Invalid history payload: {}".format(payload))
+
+        return row
+
+    @classmethod
+    def format_time(klass, dt):
+        """Iso string with microseconds, to order saves within a second."""
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    @classmethod
+    def parse_time(klass, time_str):
+        """Datetime from an iso string, with or without microseconds."""
+        time_str = time_str.rstrip('Z')
+        time_format = config.iso_datetime_format.rstrip('Z')
+        if '.' in time_str:
+            time_format += '.%f'
+        return datetime.datetime.strptime(time_str, time_format)
+
+    @classmethod
+    def insert_payloads(klass, payloads):
+        """Insert history rows, see ResponseBackup.queue().
+
+        Returns number of rows inserted.
+        """
+        return klass.insert_rows([klass.payload_to_row(p) for p in payloads])
+
+    @classmethod
+    def insert_rows(klass, rows):
+        """Insert rows from payload_to_row(), returns how many."""
+        if rows:
+            with mysql_connection.connect() as sql:
+                sql.insert_row_dicts(klass.table, rows)
+        return len(rows)
+
+    @classmethod
+    def replay(klass, rows, state=None):
+        """Apply history rows, in order, to a state.
+
+        Returns dict with `body`, `progress`, `page`, and `modified`.
+        """
+        if state is None:
+            state = {'body': {}, 'progress': None, 'page': None,
+                     'modified': None}
+
+        for row in rows:
+            data = json.loads(row['body'])
+            if row['kind'] == klass.SNAPSHOT:
+                state['body'] = data
+            else:
+                for k, entry in data.items():
+                    if entry is None:
+                        state['body'].pop(k, None)
+                    else:
+                        state['body'][k] = entry
+            for field in ('progress', 'page'):
+                if row[field] is not None:
+                    state[field] = row[field]
+            state['modified'] = row['modified']
+
+        return state
+
+    @classmethod
+    def get_as_of(klass, response_id, at):
+        """Rebuild a response as it was at a given time.
+
+        Args:
+            response_id: str
+            at: datetime
+
+        Returns dict, see replay(), or None if there's no history by then.
+        """
+        snapshot_query = '''
+            SELECT *
+            FROM `{table}`
+            WHERE `response_id` = %s
+              AND `kind` = %s
+              AND `modified` <= %s
+            ORDER BY `modified` DESC, `history_id` DESC
+            LIMIT 1
+        '''.format(table=klass.table)
+
+        # Copies of the same row are ordered by when they were inserted.
+        delta_query = '''
+            SELECT *
+            FROM `{table}`
+            WHERE `response_id` = %s
+              AND `modified` <= %s
+              AND (`modified`, `history_id`) > (%s, %s)
+            ORDER BY `modified`, `history_id`
+        '''.format(table=klass.table)
+
+        with mysql_connection.connect() as sql:
+            snapshots = sql.select_query(
+                snapshot_query, (response_id, klass.SNAPSHOT, at))
+            if snapshots:
+                start = (snapshots[0]['modified'],
+                         snapshots[0]['history_id'])
+            else:
+                start = (datetime.datetime.min, 0)
+            deltas = sql.select_query(
+                delta_query, (response_id, at) + start)
+
+        if not snapshots and not deltas:
+            return None
+
+        return klass.replay(snapshots + deltas)
+
+    @classmethod
+    def compact(klass, before=None, max_responses=None):
+        """Fold deltas older than a cutoff into one snapshot per day.
+
+        A body as of any time before the cutoff then comes back as it was at
+        the end of the last day with changes, rather than to the second.
+
+        Args:
+            before: datetime, cutoff, default compact_after_days ago.
+            max_responses: int, how many responses to compact in this call,
+                default all of them.
+
+        Returns dict of how many responses were compacted, and how many rows
+        were replaced by how many snapshots.
+        """
+        if before is None:
+            before = (datetime.datetime.now() -
+                      datetime.timedelta(days=klass.compact_after_days))
+
+        # Only responses with deltas need compacting; old snapshots are left
+        # as they are.
+        query = '''
+            SELECT DISTINCT `response_id`
+            FROM `{table}`
+            WHERE `kind` = %s
+              AND `modified` < %s
+        '''.format(table=klass.table)
+        params = (klass.DELTA, before)
+        if max_responses is not None:
+            query += 'LIMIT %s'
+            params += (max_responses,)
+
+        with mysql_connection.connect() as sql:
+            response_ids = [r['response_id']
+                            for r in sql.select_query(query, params)]
+
+        summary = {'responses': 0, 'rows_removed': 0, 'snapshots': 0}
+        for i in range(0, len(response_ids), klass.compact_batch_size):
+            batch = response_ids[i:i + klass.compact_batch_size]
+            removed, added = klass.compact_responses(batch, before)
+            summary['responses'] += len(batch)
+            summary['rows_removed'] += removed
+            summary['snapshots'] += added
+
+        logging.info("Compacted response history: {}".format(summary))
+        return summary
+
+    @classmethod
+    def compact_responses(klass, response_ids, before):
+        """Replace history before a cutoff with daily snapshots, in one
+        transaction.
+
+        Returns tuple of (number of rows removed, number of snapshots added).
+        """
+        query = '''
+            SELECT *
+            FROM `{table}`
+            WHERE `response_id` IN ({interps})
+              AND `modified` < %s
+            ORDER BY `response_id`, `modified`, `history_id`
+            FOR UPDATE
+        '''.format(
+            table=klass.table,
+            interps=', '.join(['%s'] * len(response_ids)),
+        )
+
+        with mysql_connection.connect(retry_on_error=False) as sql:
+            rows = sql.select_query(query, tuple(response_ids) + (before,))
+
+            rows_by_response = {}
+            for row in rows:
+                rows_by_response.setdefault(row['response_id'], []).append(row)
+
+            snapshots = []
+            for response_id, response_rows in rows_by_response.items():
+                rows_by_day = []
+                for row in response_rows:
+                    day = row['modified'].date()
+                    if rows_by_day and rows_by_day[-1][0] == day:
+                        rows_by_day[-1][1].append(row)
+                    else:
+                        rows_by_day.append((day, [row]))
+
+                state = None
+                for day, day_rows in rows_by_day:
+                    state = klass.replay(day_rows, state)
+                    snapshots.append({
+                        'response_id': response_id,
+                        'modified': state['modified'],
+                        'kind': klass.SNAPSHOT,
+                        'progress': state['progress'],
+                        'page': state['page'],
+                        'body': json.dumps(state['body']),
+                    })
+
+            if rows:
+                delete_query = '''
+                    DELETE FROM `{table}`
+                    WHERE `history_id` IN ({interps})
+                '''.format(
+                    table=klass.table,
+                    interps=', '.join(['%s'] * len(rows)),
+                )
+                sql.query(delete_query,
+                          tuple(r['history_id'] for r in rows))
+                sql.insert_row_dicts(klass.table, snapshots)
+
+        return len(rows), len(snapshots)
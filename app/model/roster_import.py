@@ -0,0 +1,204 @@
+"""
+RosterImport
+===========
+
+Progress of a CSV roster upload to a classroom, see RosterImport.process().
+
+Rows are parsed from the upload and saved a chunk at a time, each chunk its own
+set of writes followed by saving progress here. The upload itself is already
+in memory, since the python27 runtime buffers whole request bodies, so this
+bounds the participants held and written at once, not the size of the file.
+
+If an upload fails partway, sending the same file again with this import's id
+picks up after the last chunk saved. Re-processing a chunk that was saved but
+not recorded is harmless: its students are found as existing and left alone.
+"""
+import csv
+import logging
+
+from model import SqlModel, SqlField as Field
+from .participant import Participant
+
+
+class InvalidRoster(Exception):
+    """The upload can't be read as a roster."""
+    pass
+
+
+class RosterImport(SqlModel):
+    table = 'roster_import'
+
+    IN_PROGRESS = 'in_progress'
+    COMPLETE = 'complete'
+
+    py_table_definition = {
+        'table_name': table,
+        'fields': [
+            #     name,            type,      length, unsigned, null,  default, on_update
+            Field('uid',           'varchar', 50,     None,     False, None,    None),
+            Field('short_uid',     'varchar', 50,     None,     False, None,    None),
+            Field('created',       'datetime',None,   None,     False, SqlModel.sql_current_timestamp, None),
+            Field('modified',      'datetime',None,   None,     False, SqlModel.sql_current_timestamp, SqlModel.sql_current_timestamp),
+            Field('classroom_id',  'varchar', 50,     None,     False, None,    None),
+            Field('team_id',       'varchar', 50,     None,     False, None,    None),
+            # Who uploaded it; only they may resume it.
+            Field('user_id',       'varchar', 50,     None,     False, None,    None),
+            # 'in_progress' or 'complete'
+            Field('status',        'varchar', 20,     None,     False, 'in_progress', None),
+            # Data rows of the file saved so far, not counting the header.
+            Field('rows_processed','int',     None,   True,     False, 0,       None),
+            # New participants.
+            Field('num_added',     'int',     None,   True,     False, 0,       None),
+            # Existing participants added to this classroom, or with changed
+            # fields.
+            Field('num_updated',   'int',     None,   True,     False, 0,       None),
+            # Existing participants already on this classroom as listed.
+            Field('num_unchanged', 'int',     None,   True,     False, 0,       None),
+        ],
+        'primary_key': ['uid'],
+        'indices': [
+            {
+                'name': 'classroom',
+                'fields': ['classroom_id'],
+            },
+        ],
+        'engine': 'InnoDB',
+        'charset': 'utf8',
+    }
+
+    # Students saved per chunk. Each chunk is one indexed lookup of existing
+    # students and one put_multi().
+    chunk_size = 500
+
+    # Columns read from the file, other than student_id, and how to read them.
+    optional_columns = {
+        'in_target_group': lambda v: v.strip().lower() in ('1', 'true', 'yes'),
+    }
+
+    @classmethod
+    def read_rows(klass, lines):
+        """Read the header of a csv roster, and return a generator of its
+        rows as dicts of participant params, or None for blank rows, so row
+        counts match the file.
+
+        Args:
+            lines: iterable of lines of csv, e.g. a file. The first names the
+                columns; only student_id is required.
+
+        Raises InvalidRoster, on reading the header, or later from the
+        generator.
+        """
+        reader = csv.reader(lines)
+        try:
+            header = next(reader)
+            # Spreadsheet programs often start utf-8 files with a byte order
+            # mark.
+            columns = [c.decode('utf-8-sig').strip().lower() for c in header]
+        except StopIteration:
+            raise InvalidRoster("Roster is empty.")
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise InvalidRoster(str(e))
+
+        if 'student_id' not in columns:
+            raise InvalidRoster("Roster must have a student_id column.")
+
+        def generate_rows():
+            try:
+                for row in reader:
+                    values = dict(zip(columns,
+                                      (v.decode('utf-8') for v in row)))
+                    student_id = values.get('student_id', '').strip()
+                    if not student_id:
+                        yield None
+                        continue
+                    params = {'student_id': student_id}
+                    for column, convert in klass.optional_columns.items():
+                        if column in values:
+                            params[column] = convert(values[column])
+                    yield params
+            except (csv.Error, UnicodeDecodeError) as e:
+                raise InvalidRoster(str(e))
+
+        return generate_rows()
+
+    def process(self, rows):
+        """Save participants from rows of the roster, a chunk at a time.
+
+        Args:
+            rows: iterable of dicts from read_rows(), the whole file, even if
+                resuming. Rows already processed are skipped.
+
+        Returns this import, saved, with its counts.
+        """
+        to_skip = self.rows_processed
+        chunk = []
+        for row in rows:
+            if to_skip:
+                to_skip -= 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self.process_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            self.process_chunk(chunk)
+
+        self.status = self.COMPLETE
+        self.put()
+        logging.info(
+            "Roster import {} complete: {} rows, {} added, {} updated, {} "
+            "unchanged.".format(self.uid, self.rows_processed, self.num_added,
+                                self.num_updated, self.num_unchanged)
+        )
+        return self
+
+    def process_chunk(self, rows):
+        """Add, update, or leave alone each student of a chunk, then save
+        progress."""
+        # Later rows for the same student win.
+        params_by_stripped = {}
+        for params in rows:
+            if params:
+                stripped = Participant.strip_token(params['student_id'])
+                params_by_stripped[stripped] = params
+
+        existing = Participant.get_for_team(
+            self.team_id,
+            student_ids=[p['student_id'] for p in params_by_stripped.values()],
+        ) if params_by_stripped else []
+        existing_by_stripped = {p.stripped_student_id: p for p in existing}
+
+        to_put = []
+        for stripped, params in params_by_stripped.items():
+            ppt = existing_by_stripped.get(stripped, None)
+            if ppt is None:
+                to_put.append(Participant.create(
+                    team_id=self.team_id,
+                    classroom_ids=[self.classroom_id],
+                    **params
+                ))
+                self.num_added += 1
+                continue
+
+            changed = False
+            if self.classroom_id not in ppt.classroom_ids:
+                ppt.classroom_ids.append(self.classroom_id)
+                changed = True
+            for k in self.optional_columns:
+                if k in params and getattr(ppt, k) != params[k]:
+                    setattr(ppt, k, params[k])
+                    changed = True
+
+            if changed:
+                to_put.append(ppt)
+                self.num_updated += 1
+            else:
+                self.num_unchanged += 1
+
+        # Also counts new students on the classroom, see
+        # Participant.put_multi().
+        Participant.put_multi(to_put)
+
+        self.rows_processed += len(rows)
+        self.put()
@@ -8,7 +8,7 @@ comprised of metrics a.k.a. growth conditions.
 import datetime
 import logging
 
-from model import SqlModel, SqlField as Field, Email
+from model import IdentityMapped, SqlModel, SqlField as Field, Email
 from .classroom import Classroom
 from .cycle import Cycle
 from .metric import Metric
@@ -22,7 +22,7 @@ def date_to_dt(date):
     return datetime.datetime.combine(date, datetime.datetime.min.time())
 
 
-class Survey(SqlModel):
+class Survey(IdentityMapped, SqlModel):
     table = 'survey'
 
     py_table_definition = {
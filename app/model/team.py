@@ -4,21 +4,21 @@ Team
 
 Teams of users running a single survey together with their students.
 """
-from google.appengine.api import memcache
 import json
 import logging
 
-from model import (SqlModel, SqlField as Field, JsonTextValueLengthError,
+from model import (HasCachedProperties, IdentityMapped, SqlModel,
+                   SqlField as Field, JsonTextValueLengthError,
                    JsonTextDictLengthError, JsonTextLengthError,
-                   JSON_TEXT_VALUE_MAX, JSON_TEXT_DICT_MAX,
-                   JSON_TEXT_MAX)
+                   JSON_TEXT_VALUE_MAX, JSON_TEXT_DICT_MAX, JSON_TEXT_MAX,
+                   TeamOrganization, UserTeam)
 from .organization import Organization
 from .program import Program
+from . import code_context
 import mysql_connection
-import util
 
 
-class Team(SqlModel):
+class Team(HasCachedProperties, IdentityMapped, SqlModel):
     table = 'team'
 
     py_table_definition = {
@@ -49,7 +49,16 @@ class Team(SqlModel):
             Field('task_data',         'text',     None,   None,     False, None,    None),
         ],
         'primary_key': ['uid'],
-        'indices': [],
+        'indices': [
+            {
+                'name': 'program',
+                'fields': ['program_id'],
+            },
+            {
+                'name': 'captain',
+                'fields': ['captain_id'],
+            },
+        ],
         'engine': 'InnoDB',
         'charset': 'utf8',
     }
@@ -117,12 +126,14 @@ class Team(SqlModel):
     @classmethod
     def query_by_organization(klass, org_id):
         query = '''
-            SELECT *
-            FROM `{table}`
-            WHERE `organization_ids` LIKE BINARY %s
-            ORDER BY `name`
-        '''.format(table=klass.table)
-        params = ('%{}%'.format(org_id),)
+            SELECT t.*
+            FROM `{table}` t
+            JOIN `{membership_table}` m
+              ON m.`team_id` = t.`uid`
+            WHERE m.`organization_id` = %s
+            ORDER BY t.`name`
+        '''.format(table=klass.table, membership_table=TeamOrganization.table)
+        params = (org_id,)
 
         with mysql_connection.connect() as sql:
             row_dicts = sql.select_query(query, params)
@@ -130,7 +141,7 @@ class Team(SqlModel):
         return [klass.row_dict_to_obj(d) for d in row_dicts]
 
     @classmethod
-    def get_cached_properties_from_db(self, team_id):
+    def get_cached_properties_from_db_multi(klass, team_ids):
         """Count how many related users and classrooms there are.
 
         N.B. participation_base is not the number of unique students on the
@@ -138,43 +149,48 @@ class Team(SqlModel):
         by students to reach 100% participation. Students who are in multiple
         classrooms are expected to complete the survey multiple times.
         """
-        classroom_query = '''
-            SELECT COUNT(`uid`) as num_classrooms
-            ,      IFNULL(SUM(`num_students`), 0) as participation_base
-            FROM   `classroom`
-            WHERE  `team_id` = %s;
-        '''
-        classroom_params = (team_id,)
-
-        user_query = '''
-            SELECT COUNT(`uid`) as num_users
-            FROM   `user`
-            WHERE  `owned_teams` LIKE BINARY %s;
-        '''
-        user_params = ('%{}%'.format(team_id),)
+        interps = ', '.join(['%s'] * len(team_ids))
+        query = '''
+            SELECT
+                t.`uid` as uid,
+                IFNULL(c.`num_classrooms`, 0) as num_classrooms,
+                IFNULL(c.`participation_base`, 0) as participation_base,
+                IFNULL(u.`num_users`, 0) as num_users
+            FROM `team` t
+            LEFT JOIN (
+                SELECT
+                    `team_id`,
+                    COUNT(`uid`) as num_classrooms,
+                    IFNULL(SUM(`num_students`), 0) as participation_base
+                FROM `classroom`
+                WHERE `team_id` IN ({interps})
+                GROUP BY `team_id`
+            ) c
+              ON c.`team_id` = t.`uid`
+            LEFT JOIN (
+                SELECT `team_id`, COUNT(`user_id`) as num_users
+                FROM `{membership_table}`
+                WHERE `team_id` IN ({interps})
+                GROUP BY `team_id`
+            ) u
+              ON u.`team_id` = t.`uid`
+            WHERE t.`uid` IN ({interps})
+        '''.format(membership_table=UserTeam.table, interps=interps)
+        params = tuple(team_ids) * 3
 
         with mysql_connection.connect() as sql:
-            classroom_rows = sql.select_query(classroom_query, classroom_params)
-            user_rows = sql.select_query(user_query, user_params)
-
-        if len(classroom_rows) > 1 or len(user_rows) > 1:
-            raise Exception("Multiple results for team cached properties.")
+            row_dicts = sql.select_query(query, params)
 
+        # Deleted teams are left out, so their cached properties are too.
         return {
-            'num_classrooms': int(classroom_rows[0]['num_classrooms']),
-            'participation_base': int(classroom_rows[0]['participation_base']),
-            'num_users': int(user_rows[0]['num_users']),
+            r['uid']: {
+                'num_classrooms': int(r['num_classrooms']),
+                'num_users': int(r['num_users']),
+                'participation_base': int(r['participation_base']),
+            }
+            for r in row_dicts
         }
 
-
-    @classmethod
-    def update_cached_properties(klass, team_id):
-        """If we find the team in the db, query for rel counts and cache."""
-        from_db = Team.get_cached_properties_from_db(team_id)
-        if from_db:
-            memcache.set(util.cached_properties_key(team_id), from_db)
-        return from_db
-
     def before_put(self, init_kwargs):
         if len(self.task_data) >= JSON_TEXT_DICT_MAX:
             raise JsonTextDictLengthError()
@@ -186,31 +202,31 @@ class Team(SqlModel):
         if len(json.dumps(self.task_data)) >= JSON_TEXT_MAX:
             raise JsonTextLengthError()
 
+    @classmethod
+    def delete_multi(klass, entities):
+        super(Team, klass).delete_multi(entities)
+        TeamOrganization.delete_for_entities([e.uid for e in entities])
+        # Codes of any classrooms left behind shouldn't still find the team.
+        code_context.invalidate_for_teams([e.uid for e in entities])
+
     def after_put(self, init_kwargs):
-        """Reset memcache for related objects
+        """Mark related objects' cached properties to be recomputed.
 
         Include _all_ those the team is joining (e.g. on creation) as well as
         any the team is leaving.
         """
+        # Keep the indexed copy of organization_ids in sync.
+        TeamOrganization.set_related_ids(self.uid, self.organization_ids)
+
+        # Classroom codes cache the team's program flags, so only a new
+        # program changes them.
+        if init_kwargs.get('program_id', None) != self.program_id:
+            code_context.invalidate_for_teams([self.uid])
+
         rels = ((Organization, 'organization_ids'),)
         for model, attr in rels:
             original_ids = set(init_kwargs[attr])
             new_ids = set(getattr(self, attr))
             leaving_ids = original_ids.difference(new_ids)
 
-            for uid in set(new_ids).union(leaving_ids):
-                model.update_cached_properties(uid)
-
-    def to_client_dict(self):
-        d = super(Team, self).to_client_dict()
-
-        # Decorate the team with counts of related objects; cached.
-        d.update(self.default_cached_properties)
-
-        cached = memcache.get(util.cached_properties_key(self.uid))
-        if cached:
-            d.update(cached)
-        else:
-            d.update(Team.update_cached_properties(self.uid))
-
-        return d
+            model.mark_dirty(new_ids.union(leaving_ids))
@@ -9,11 +9,15 @@ import logging
 
 from model import (
     Classroom,
+    IdentityMapped,
     Network,
     Organization,
     SqlField as Field,
     SqlModel,
     Team,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
 )
 import mysql_connection
 import util
@@ -29,14 +33,12 @@ class BadPassword(Exception):
     pass
 
 
-class User(SqlModel):
+class User(IdentityMapped, SqlModel):
     """Triton users.
 
-    To search among related ids, like `owned teams`, this is of interest:
-
-    SELECT * FROM `user` WHERE `owned_teams` LIKE BINARY '%Team_abcXYZ%'
-
-    https://stackoverflow.com/questions/2602252/mysql-query-string-contains
+    To search among related ids, like `owned teams`, don't search the json
+    text. Each list is mirrored in an indexed table (see model.membership),
+    e.g. `SELECT user_id FROM user_team WHERE team_id = 'Team_abcXYZ'`.
     """
     table = 'user'
 
@@ -86,6 +88,13 @@ class User(SqlModel):
 
     json_props = ['owned_teams', 'owned_organizations', 'owned_networks']
 
+    # Json list properties mirrored in indexed tables, see model.membership.
+    memberships = {
+        'owned_teams': UserTeam,
+        'owned_organizations': UserOrganization,
+        'owned_networks': UserNetwork,
+    }
+
     @classmethod
     def create(klass, **kwargs):
         # Check lengths
@@ -132,52 +141,46 @@ class User(SqlModel):
 
     @classmethod
     def query_by_team(klass, team_id_or_ids):
-        """Warning: using many team ids is very inefficient. See
-        https://www.brentozar.com/archive/2010/06/sargable-why-string-is-slow/
-        """
-        if type(team_id_or_ids) in (tuple, list):
-            team_ids = team_id_or_ids
+        """Users who own any of the given teams, via the user_team table."""
+        if type(team_id_or_ids) in (tuple, list, set):
+            team_ids = list(team_id_or_ids)
         else:
             team_ids = [team_id_or_ids]
 
-
-        like_clause = ' OR '.join(
-            '`owned_teams` LIKE BINARY %s' for id in team_ids
-        )
-        query = '''
-            SELECT *
-            FROM `{table}`
-            WHERE {like_clause}
-        '''.format(table=klass.table, like_clause=like_clause)
-        params = tuple('%{}%'.format(id) for id in team_ids)
-
-        with mysql_connection.connect() as sql:
-            row_dicts = sql.select_query(query, params)
-
-        return [klass.row_dict_to_obj(d) for d in row_dicts]
+        return klass.query_by_membership(UserTeam, team_ids)
 
     @classmethod
     def query_by_organization(klass, org_id):
-        query = '''
-            SELECT *
-            FROM `{table}`
-            WHERE `owned_organizations` LIKE BINARY %s
-        '''.format(table=klass.table)
-        params = ('%{}%'.format(org_id),)
-
-        with mysql_connection.connect() as sql:
-            row_dicts = sql.select_query(query, params)
-
-        return [klass.row_dict_to_obj(d) for d in row_dicts]
+        return klass.query_by_membership(UserOrganization, [org_id])
 
     @classmethod
     def query_by_network(klass, network_id):
+        return klass.query_by_membership(UserNetwork, [network_id])
+
+    @classmethod
+    def query_by_membership(klass, membership, related_ids):
+        """Indexed lookup of users by a normalized relationship table."""
+        if len(related_ids) == 0:
+            return []
+
+        # Written as a subquery rather than a plain JOIN so users who own
+        # several of the related ids still appear once.
         query = '''
             SELECT *
             FROM `{table}`
-            WHERE `owned_networks` LIKE BINARY %s
-        '''.format(table=klass.table)
-        params = ('%{}%'.format(network_id),)
+            WHERE `uid` IN (
+                SELECT `{entity_field}`
+                FROM `{membership_table}`
+                WHERE `{related_field}` IN ({interps})
+            )
+        '''.format(
+            table=klass.table,
+            entity_field=membership.entity_field,
+            membership_table=membership.table,
+            related_field=membership.related_field,
+            interps=','.join(['%s'] * len(related_ids)),
+        )
+        params = tuple(related_ids)
 
         with mysql_connection.connect() as sql:
             row_dicts = sql.select_query(query, params)
@@ -206,9 +209,18 @@ class User(SqlModel):
         params = {'uid': new_id, 'short_uid': SqlModel.convert_uid(new_id)}
         with mysql_connection.connect() as sql:
             sql.update_row(klass.table, 'uid', user.uid, **params)
+        # Bypasses put(), so drop the old id from the identity map manually.
+        klass.evict([user])
+
+        # The membership tables are keyed by uid too.
+        for attr, membership in klass.memberships.items():
+            membership.delete_for_entities([user.uid])
+            membership.set_related_ids(new_id, getattr(user, attr))
 
         for k, v in params.items():
             setattr(user, k, v)
+        # The new id may have been looked up, and missed, earlier.
+        klass.evict([user])
 
         return user
 
@@ -280,9 +292,9 @@ class User(SqlModel):
         return getattr(self, owner_props[kind])if kind in owner_props else None
 
     def get_networked_organization_ids(self):
-        networked_org_ids = set()
-        for network in Network.get_by_id(self.owned_networks):
-            networked_org_ids.update(network.associated_organization_ids())
+        # One query against the closure table, however deeply nested.
+        networked_org_ids = Network.get_associated_organization_ids(
+            self.owned_networks)
 
         if len(networked_org_ids) >= 100:
             logging.error(
@@ -292,21 +304,32 @@ class User(SqlModel):
 
         return networked_org_ids
 
+    @classmethod
+    def delete_multi(klass, entities):
+        super(User, klass).delete_multi(entities)
+
+        user_ids = [e.uid for e in entities]
+        for membership in klass.memberships.values():
+            membership.delete_for_entities(user_ids)
+
     def after_put(self, init_kwargs, *args, **kwargs):
-        """Reset memcache for related objects
+        """Mark related objects' cached properties to be recomputed.
 
+        * Sync the indexed membership tables with the json lists.
         * Include _all_ those the user is joining (e.g. on creation) as well as
           any the user is leaving.
         * Include name changes stored elsewhere
         """
+        for attr, membership in self.memberships.items():
+            membership.set_related_ids(self.uid, getattr(self, attr))
+
         rels = ((Team, 'owned_teams'), (Organization, 'owned_organizations'))
         for model, attr in rels:
             original_ids = set(init_kwargs[attr])
             new_ids = set(getattr(self, attr))
             leaving_ids = original_ids.difference(new_ids)
 
-            for uid in set(new_ids).union(leaving_ids):
-                model.update_cached_properties(uid)
+            model.mark_dirty(new_ids.union(leaving_ids))
 
         # If this user is the contact for any classrooms, and their name has
         # changed, update the name of the classroom.
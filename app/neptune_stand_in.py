@@ -0,0 +1,88 @@
+"""Fakes the parts of Neptune's api that Triton calls, for tests and local
+development without a Neptune server.
+
+Use it in place of urlfetch.fetch, e.g.
+
+    neptune = NeptuneStandIn({'trout-viper': 3})
+    with patch.object(urlfetch, 'fetch', side_effect=neptune.fetch):
+        ...
+    neptune.requests  # urls of every call made
+    neptune.tokens  # authorization header of every authorized call
+
+or, for async calls, in place of urlfetch.create_rpc and
+urlfetch.make_fetch_call.
+"""
+
+import datetime
+import json
+import urlparse
+
+import config
+
+
+class FetchResult(object):
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class Rpc(object):
+    """Like urlfetch's rpc, but the result is ready as soon as it's made."""
+    def __init__(self):
+        self.result = None
+
+    def get_result(self):
+        return self.result
+
+
+class NeptuneStandIn(object):
+
+    def __init__(self, completed_by_code=None, completed_at_by_code=None):
+        """Args:
+            completed_by_code - dict of classroom url code (e.g. 'trout-viper')
+                to number of students who have completed the survey.
+            completed_at_by_code - dict of classroom url code to list of
+                datetimes students completed the survey, counted only if
+                within the requested start and end.
+        """
+        self.completed_by_code = completed_by_code or {}
+        self.completed_at_by_code = completed_at_by_code or {}
+        self.requests = []
+        self.tokens = []
+
+    def fetch(self, url, method=None, headers=None, **kwargs):
+        self.requests.append(url)
+
+        parsed = urlparse.urlparse(url)
+        if parsed.path != '/api/project_cohorts/participation':
+            return FetchResult(404, json.dumps("Not found."))
+
+        if 'Authorization' not in (headers or {}):
+            return FetchResult(401, json.dumps("Unauthorized."))
+        self.tokens.append(headers['Authorization'])
+
+        # Same shape as Neptune: for each code, counts of students by
+        # progress value. Only completions matter to Triton.
+        query = urlparse.parse_qs(parsed.query)
+        codes = query.get('uid', [])
+        start, end = [
+            datetime.datetime.strptime(query[k][0], config.iso_datetime_format)
+            if k in query else None
+            for k in ('start', 'end')
+        ]
+
+        def num_completed(code):
+            dated = [t for t in self.completed_at_by_code.get(code, [])
+                     if (not start or t >= start) and (not end or t <= end)]
+            return self.completed_by_code.get(code, 0) + len(dated)
+
+        return FetchResult(200, json.dumps({
+            code: [{'value': '100', 'n': num_completed(code)}]
+            for code in codes
+        }))
+
+    def create_rpc(self, *args, **kwargs):
+        return Rpc()
+
+    def make_fetch_call(self, rpc, url, method=None, headers=None, **kwargs):
+        rpc.result = self.fetch(url, method=method, headers=headers)
@@ -0,0 +1,238 @@
+"""
+Participation
+===========
+
+Client for Neptune's participation api, i.e. how many students have made it
+how far through the survey, by classroom, within the dates of a cycle.
+
+Results are memcached by classroom url codes and cycle dates, so the cycle
+email task, the participation cron, and the completion certificate share them.
+
+* Fresh results (younger than FRESH_TTL) are used as is.
+* Stale results are refreshed by one caller while everyone else keeps using
+  them. If the refresh fails, the stale result is used anyway.
+* When there's no result at all, every caller fetches it, rather than
+  holding up its request waiting for another caller's fetch.
+
+Counts of cache hits and Neptune latency are kept as counters, see stats().
+"""
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+import hashlib
+import json
+import datetime
+import logging
+import os
+import time
+
+from gae_handlers import BaseHandler
+from model import User
+import config
+import counters
+import jwt_helper
+import util
+
+
+# Seconds.
+FRESH_TTL = 10 * 60
+STALE_TTL = 6 * 60 * 60
+LOCK_TTL = 30
+
+METRIC_NAMES = ('hit', 'stale', 'miss', 'fetch', 'fetch_error', 'fetch_ms')
+
+
+def query_url(cycle, classrooms):
+    if util.is_localhost():
+        protocol = 'http'
+        neptune_domain = 'localhost:8080'
+    else:
+        protocol = 'https'
+        neptune_domain = os.environ['NEPTUNE_DOMAIN']
+
+    url = '{protocol}://{domain}/api/project_cohorts/participation'.format(
+        protocol=protocol,
+        domain=neptune_domain,
+    )
+    # Cycles include all of their last day.
+    start = datetime.datetime.combine(cycle.start_date, datetime.time.min)
+    end = datetime.datetime.combine(cycle.end_date, datetime.time.max)
+    return util.set_query_parameters(
+        url,
+        uid=[c.url_code for c in classrooms],
+        start=start.strftime(config.iso_datetime_format),
+        end=end.strftime(config.iso_datetime_format),
+    )
+
+
+def jwt(classrooms):
+    """Token allowing Triton to read participation of these classrooms. It
+    doesn't depend on dates, so one can serve requests for many cycles."""
+    user = User.create(id='triton', email='')
+
+    payload = jwt_helper.get_payload(user)
+    payload['allowed_endpoints'] = [
+        BaseHandler().get_endpoint_str(
+            'GET',
+            'neptune',
+            '/api/project_cohorts/{}/participation'.format(c.url_code)
+        )
+        for c in classrooms
+    ]
+    return jwt_helper.encode(payload)
+
+
+def key(cycle, classrooms):
+    # Any combination of classrooms is possible, so hash them to keep the key
+    # under memcache's length limit.
+    codes = ','.join(sorted(set(c.url_code for c in classrooms)))
+    return 'participation:{}:{}:{}'.format(
+        hashlib.md5(codes).hexdigest(),
+        cycle.start_date.isoformat(),
+        cycle.end_date.isoformat(),
+    )
+
+
+def lock_key(k):
+    return k + ':lock'
+
+
+def get(cycle, classrooms):
+    """Participation as {url code: [{'value': x, 'n': y}, ...], ...}.
+
+    Args:
+        cycle - with start and end dates.
+        classrooms - list of Classrooms.
+    """
+    return get_multi([(cycle, classrooms)])[0]
+
+
+def get_multi(requests):
+    """Participation for many cycles and/or sets of classrooms, with any calls
+    to Neptune made concurrently.
+
+    Args:
+        requests - list of (cycle, classrooms) tuples.
+
+    Returns list of participation dicts, in the same order, see get().
+    """
+    request_by_key = {}
+    keys = []
+    for cycle, classrooms in requests:
+        k = key(cycle, classrooms)
+        request_by_key[k] = (cycle, classrooms)
+        keys.append(k)
+
+    counts = {n: 0 for n in METRIC_NAMES}
+    now = time.time()
+    cached = memcache.get_multi(request_by_key.keys())
+
+    results = {}
+    stale = {}
+    to_fetch = []
+    locked = []
+    for k in request_by_key:
+        entry = cached.get(k)
+        if entry and now - entry['fetched'] < FRESH_TTL:
+            counts['hit'] += 1
+            results[k] = entry['participation']
+        elif memcache.add(lock_key(k), 1, time=LOCK_TTL):
+            # We're the one to (re)fetch it.
+            counts['stale' if entry else 'miss'] += 1
+            to_fetch.append(k)
+            locked.append(k)
+            if entry:
+                stale[k] = entry['participation']
+        elif entry:
+            # Someone else is refreshing it, use what we have.
+            counts['stale'] += 1
+            results[k] = entry['participation']
+        else:
+            # Someone else is fetching it for the first time. Fetch it too
+            # rather than making this request wait for theirs.
+            counts['miss'] += 1
+            to_fetch.append(k)
+
+    try:
+        results.update(_fetch(
+            [request_by_key[k] + (k,) for k in to_fetch], stale, counts))
+    finally:
+        if locked:
+            memcache.delete_multi([lock_key(k) for k in locked])
+        counters.increment('participation', counts)
+
+    return [results[k] for k in keys]
+
+
+def _fetch(requests, stale, counts):
+    """Call Neptune for each (cycle, classrooms, key), all at once.
+
+    Caches and returns {key: participation}. Falls back to stale results on
+    error, if there are any.
+    """
+    if not requests:
+        return {}
+
+    # Sets of classrooms are usually the same across cycles, so are tokens.
+    jwt_by_codes = {}
+    rpcs = []
+    start = time.time()
+    for cycle, classrooms, k in requests:
+        codes = tuple(sorted(c.url_code for c in classrooms))
+        if codes not in jwt_by_codes:
+            jwt_by_codes[codes] = jwt(classrooms)
+
+        rpc = urlfetch.create_rpc()
+        urlfetch.make_fetch_call(
+            rpc,
+            query_url(cycle, classrooms),
+            method=urlfetch.GET,
+            headers={'Authorization': 'Bearer {}'.format(jwt_by_codes[codes])},
+        )
+        rpcs.append((k, rpc))
+
+    results = {}
+    to_cache = {}
+    for k, rpc in rpcs:
+        try:
+            result = rpc.get_result()
+        except urlfetch.Error as e:
+            result = e
+
+        counts['fetch'] += 1
+        if not result or getattr(result, 'status_code', None) != 200:
+            counts['fetch_error'] += 1
+            if k in stale:
+                logging.warning("Failed to get participation {}, using stale "
+                                "result.".format(result))
+                results[k] = stale[k]
+                continue
+            raise Exception("Failed to get participation {}".format(result))
+
+        results[k] = json.loads(result.content)
+        to_cache[k] = {'fetched': time.time(), 'participation': results[k]}
+
+    # Calls run in parallel, so the time for all of them is the latency of
+    # the slowest.
+    elapsed_ms = int((time.time() - start) * 1000)
+    counts['fetch_ms'] += elapsed_ms * len(rpcs)
+    logging.info("Fetched participation {} times in {} ms."
+                 .format(len(rpcs), elapsed_ms))
+
+    if to_cache:
+        memcache.set_multi(to_cache, time=STALE_TTL)
+
+    return results
+
+
+def stats():
+    """Counts since memcache last dropped them, with a hit rate and the mean
+    latency of calls to Neptune."""
+    counts = counters.get('participation', METRIC_NAMES)
+
+    lookups = counts['hit'] + counts['stale'] + counts['miss']
+    counts['hit_rate'] = (
+        float(counts['hit'] + counts['stale']) / lookups if lookups else None)
+    counts['mean_fetch_ms'] = (
+        float(counts['fetch_ms']) / counts['fetch'] if counts['fetch']
+        else None)
+    return counts
@@ -106,6 +106,139 @@ def owns(user, id_or_entity):
     return owns
 
 
+def owns_many(user, ids_or_entities):
+    """Does this user own each of the objects in question?
+
+    Same decisions as calling owns() on each, but related teams, classrooms,
+    and the user's networked orgs are loaded once for the whole list rather
+    than once per object.
+
+    Ids of entities that don't exist are not owned (owns() would raise for
+    most kinds).
+
+    Returns a list of booleans in the same order as the input.
+    """
+    ids_or_entities = list(ids_or_entities)
+
+    # Supers own everything.
+    if user.super_admin:
+        return [True] * len(ids_or_entities)
+
+    # Standardize id vs. entity, fetching any missing entities kind by kind.
+    entities = [None if isinstance(x, basestring) else x
+                for x in ids_or_entities]
+    uids = [str(x) if isinstance(x, basestring) else x.uid
+            for x in ids_or_entities]
+    kinds = [SqlModel.get_kind(uid) for uid in uids]
+    ids_to_fetch = {}
+    for uid, kind, entity in zip(uids, kinds, entities):
+        if entity is None and kind in _kinds_needing_entity:
+            ids_to_fetch.setdefault(kind, set()).add(uid)
+    fetched = {}
+    for kind, ids in ids_to_fetch.items():
+        klass = SqlModel.kind_to_class(kind)
+        fetched.update({e.uid: e for e in klass.get_by_id(list(ids))})
+    entities = [fetched.get(uid) if entity is None else entity
+                for uid, entity in zip(uids, entities)]
+
+    # Then everything related, in one batch per kind.
+    team_ids = set()
+    classroom_ids = set()
+    for kind, entity in zip(kinds, entities):
+        if entity is None:
+            continue
+        if kind == 'Team':
+            continue
+        if kind == 'Report' and entity.classroom_id:
+            classroom_ids.add(entity.classroom_id)
+        elif kind == 'Participant':
+            classroom_ids.update(entity.classroom_ids)
+            team_ids.add(entity.team_id)
+        elif kind in ('Classroom', 'Cycle', 'Report', 'Response', 'Survey'):
+            team_ids.add(entity.team_id)
+    teams = {t.uid: t for t in Team.get_by_id(list(team_ids))}
+    teams.update({e.uid: e for k, e in zip(kinds, entities)
+                  if k == 'Team' and e})
+    classrooms = {c.uid: c for c in Classroom.get_by_id(list(classroom_ids))}
+
+    # Networked orgs only need to be looked up once, and only if some
+    # decision gets that far.
+    networked_org_ids = []
+
+    def is_supervisor(team):
+        if not team:
+            return False
+        if is_supervisor_via_org(user, team):
+            return True
+        if not networked_org_ids:
+            networked_org_ids.append(user.get_networked_organization_ids())
+        return bool(networked_org_ids[0].intersection(team.organization_ids))
+
+    def decide(uid, kind, entity):
+        if kind == 'Metric':
+            return False  # only supers
+        elif kind == 'Organization':
+            if uid in user.owned_organizations:
+                return True
+            if not networked_org_ids:
+                networked_org_ids.append(
+                    user.get_networked_organization_ids())
+            return uid in networked_org_ids[0]
+        elif kind == 'Network':
+            return uid in user.owned_networks
+        elif kind == 'User':
+            return uid == user.uid
+        elif kind == 'Team':
+            return uid in user.owned_teams or is_supervisor(entity)
+        elif kind not in _kinds_needing_entity:
+            raise Exception("Ownership does not apply to " + uid)
+        elif entity is None:
+            return False
+        elif kind == 'Digest':
+            return user.uid == entity.user_id
+        elif kind in ('Classroom', 'Cycle', 'Survey'):
+            return (entity.team_id in user.owned_teams or
+                    is_supervisor(teams.get(entity.team_id)))
+        elif kind == 'Report':
+            if entity.classroom_id:
+                classroom = classrooms.get(entity.classroom_id)
+                return bool(classroom) and user.uid == classroom.contact_id
+            return (entity.team_id in user.owned_teams or
+                    is_supervisor(teams.get(entity.team_id)))
+        elif kind == 'Response':
+            return (
+                entity.user_id == user.uid or
+                (
+                    entity.type == Response.TEAM_LEVEL_SYMBOL and (
+                        entity.team_id in user.owned_teams or
+                        is_supervisor(teams.get(entity.team_id))
+                    )
+                )
+            )
+        elif kind == 'Participant':
+            team = teams.get(entity.team_id)
+            return (
+                any(user.uid == classrooms[c_id].contact_id
+                    for c_id in entity.classroom_ids if c_id in classrooms) or
+                (bool(team) and
+                 (user.uid == team.captain_id or is_supervisor(team)))
+            )
+
+    return [decide(*args) for args in zip(uids, kinds, entities)]
+
+
+def filter_owned(user, entities):
+    """Only those entities the user owns, see owns_many()."""
+    entities = list(entities)
+    return [e for e, owned in zip(entities, owns_many(user, entities))
+            if owned]
+
+
+# Kinds for which owns() needs more than the id to decide.
+_kinds_needing_entity = ('Classroom', 'Cycle', 'Digest', 'Participant',
+                         'Report', 'Response', 'Survey', 'Team')
+
+
 def is_supervisor_via_org(user, team):
     return len(
         set(user.owned_organizations).intersection(set(team.organization_ids))
@@ -1,6 +1,7 @@
 from gae_handlers import RestHandler
-from model import Classroom
+from model import Classroom, PrefetchesCachedProperties, keyset
 from permission import owns
+import util
 
 
 def RelatedQuery(model, relationship_property):
@@ -8,11 +9,18 @@ def RelatedQuery(model, relationship_property):
 
     allow = 'GET, HEAD'
 
-    class RelatedQueryHandler(RestHandler):
+    class RelatedQueryHandler(PrefetchesCachedProperties, RestHandler):
         """Dynamically generated handler for listing a resource by their
-        relationship to another."""
+        relationship to another, a page at a time."""
         requires_auth = True
 
+        # Entities per page; see keyset. Pages of more than this many are
+        # served as this many. Results continue at the url in the Link
+        # header, if any.
+        page_size = 1000
+        max_page_size = 1000
+        reserved_params = ('cursor', 'n', 'order')
+
         def get(self, parent_type, rel_id):
             # You must be a super admin or own the related object.
             user = self.get_current_user()
@@ -24,21 +32,50 @@ def RelatedQuery(model, relationship_property):
             if not owns(user, rel_id):
                 return self.http_forbidden()
 
-            # Simulate a query string parameter so existing handler code
-            # can run the query.
-            self.request.GET[relationship_property] = rel_id
+            # Filter by the relationship, and by any other properties in the
+            # query string, e.g. /api/users/X/digests?read=false.
+            property_types = model.property_types()
+            where = {
+                k: self.get_param(k, property_types[k])
+                for k in self.request.GET
+                if k in property_types and k not in self.reserved_params
+            }
+            where[relationship_property] = rel_id
 
             # Of all the kinds we can query with RelatedQuery (Classroom,
             # Surveys, Reports) only clasrooms have a name for ordering.
+            # Otherwise order by uid, which is always indexed.
             ordered_types = (Classroom,)
-            if model in ordered_types and 'order' not in self.request.GET:
-                self.request.GET['order'] = 'name'
+            default_order = 'name' if model in ordered_types else None
+            order = self.request.get('order', None) or default_order
+
+            try:
+                n = min(int(self.request.get('n', self.page_size)),
+                        self.max_page_size)
+            except ValueError:
+                n = 0
+            if n < 1:
+                return self.http_bad_request("Invalid `n`.")
 
             # There is no id-based GET for these RelatedQuery endpoints,
             # e.g. we don't support /api/projects/X/users/Y.
-            # Skip right to the inherited query() method.
-            return super(RelatedQueryHandler, self).query(
-                override_permissions=True)
+            try:
+                entities, next_cursor = keyset.get_page(
+                    model, where, order, self.request.get('cursor', None), n)
+            except keyset.InvalidCursor:
+                return self.http_bad_request("Invalid `cursor`.")
+            except ValueError as e:
+                return self.http_bad_request(e.args[0])
+
+            # Same params, picking up after this page.
+            if next_cursor:
+                next_url = util.set_query_parameters(
+                    self.request.url, cursor=next_cursor)
+                self.response.headers['Link'] = '<{}>; rel="next"'.format(
+                    next_url)
+
+            self.write(entities)
+            return entities
 
         def post(self):
             return self.http_method_not_allowed(self.allow)
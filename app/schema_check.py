@@ -0,0 +1,96 @@
+"""
+Schema Check
+===========
+
+Compares the indices each SqlModel declares in its py_table_definition with
+those that actually exist in MySQL.
+
+Declarations only take effect when a table is created (e.g. in unit tests);
+in deployed databases indices come from migrations. If a migration is missing
+or hasn't run, queries silently fall back to full table scans, so a daily cron
+(/cron/check_indices) logs any differences as errors.
+
+Indices are matched by their fields rather than their names, since older
+tables may have the same index under a name from before it was declared.
+"""
+import logging
+
+import model
+import mysql_connection
+
+
+def declared_indices(klass):
+    """Dict of index name to list of fields, as declared by the model."""
+    definition = klass.py_table_definition
+    indices = {'PRIMARY': list(definition['primary_key'])}
+    for index in definition.get('indices', []):
+        indices[index['name']] = list(index['fields'])
+    return indices
+
+
+def get_db_indices(table_names):
+    """Dict of table name to dict of index name to list of fields."""
+    query = '''
+        SELECT `TABLE_NAME`, `INDEX_NAME`, `COLUMN_NAME`
+        FROM `information_schema`.`STATISTICS`
+        WHERE `TABLE_SCHEMA` = DATABASE()
+          AND `TABLE_NAME` IN ({interps})
+        ORDER BY `TABLE_NAME`, `INDEX_NAME`, `SEQ_IN_INDEX`
+    '''.format(interps=', '.join(['%s'] * len(table_names)))
+    params = tuple(table_names)
+
+    with mysql_connection.connect() as sql:
+        rows = sql.select_query(query, params)
+
+    db_indices = {}
+    for row in rows:
+        table_indices = db_indices.setdefault(row['TABLE_NAME'], {})
+        table_indices.setdefault(row['INDEX_NAME'], []).append(
+            row['COLUMN_NAME'])
+    return db_indices
+
+
+def diff_indices(klasses=None):
+    """Describe every declared index that's missing or different in the db.
+
+    Args:
+        klasses: optional list of SqlModel classes, default all of them.
+
+    Returns list of strings, empty if everything matches.
+    """
+    if klasses is None:
+        klasses = model.get_sql_models()
+    klasses = [k for k in klasses
+               if k.table and getattr(k, 'py_table_definition', None)]
+    if not klasses:
+        return []
+
+    db_indices = get_db_indices([k.table for k in klasses])
+
+    problems = []
+    for klass in klasses:
+        if klass.table not in db_indices:
+            problems.append("Table `{}` doesn't exist.".format(klass.table))
+            continue
+
+        table_fields = db_indices[klass.table].values()
+        for name, fields in sorted(declared_indices(klass).items()):
+            if fields not in table_fields:
+                problems.append("Index `{}`.`{}` on {} doesn't exist.".format(
+                    klass.table, name, fields))
+
+    return problems
+
+
+def check_indices(klasses=None):
+    """Log any index problems, and return them. Never raises."""
+    try:
+        problems = diff_indices(klasses)
+    except Exception as e:
+        logging.error("Couldn't check indices: {}".format(e))
+        return []
+
+    for problem in problems:
+        logging.error("Schema mismatch, missing migration? {}".format(problem))
+
+    return problems
@@ -3,69 +3,71 @@
 from datetime import date, datetime, timedelta
 from google.appengine.api import namespace_manager
 from google.appengine.api import taskqueue
-from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
 import json
 import logging
 import os
 import webapp2
 
-from api_handlers import TeamsClassrooms
-from gae_handlers import BaseHandler, Route
+from gae_handlers import Route
 from model import (Digest, Classroom, Cycle, Program, Response, ResponseBackup,
                    Survey, Team, User)
+import cron_rserve
 import cycle_emailers
-import jwt_helper
-import mysql_connection
 import config
-import util
-
-
-def participation_query_url(cycle, classrooms):
-    if util.is_localhost():
-        protocol = 'http'
-        neptune_domain = 'localhost:8080'
-    else:
-        protocol = 'https'
-        neptune_domain = os.environ['NEPTUNE_DOMAIN']
-
-    url = '{protocol}://{domain}/api/project_cohorts/participation'.format(
-        protocol=protocol,
-        domain=neptune_domain,
-    )
-    return util.set_query_parameters(
-        url,
-        uid=[c.url_code for c in classrooms],
-        start=cycle.start_date.strftime(config.iso_datetime_format),
-        end=cycle.end_date.strftime(config.iso_datetime_format),
-    )
-
-
-def get_participation(cycle, classrooms):
-    handler = TeamsClassrooms()
-    user = User.create(id='triton', email='')
-
-    payload = jwt_helper.get_payload(user)
-    payload['allowed_endpoints'] = [
-        BaseHandler().get_endpoint_str(
-            'GET',
-            'neptune',
-            '/api/project_cohorts/{}/participation'.format(c.url_code)
-        )
-        for c in classrooms
-    ]
-    jwt = jwt_helper.encode(payload)
+import participation
+
 
-    result = urlfetch.fetch(
-        url=participation_query_url(cycle, classrooms),
-        method=urlfetch.GET,
-        headers={'Authorization': 'Bearer {}'.format(jwt)}
-    )
+# Neptune takes classroom codes as query string params, so keep urls short.
+MAX_CLASSROOMS_PER_FETCH = 50
 
-    if not result or result.status_code != 200:
-        raise Exception("Failed to get participation {}".format(result))
 
-    return json.loads(result.content)
+def update_participation(cycles, classrooms):
+    """Set students_completed on each cycle from Neptune, and save them.
+
+    Classrooms whose cycles share the same dates are combined into as few
+    participation requests as possible, regardless of team.
+
+    Args:
+        cycles - list of Cycles with start and end dates, one per team.
+        classrooms - list of Classrooms on those teams.
+    """
+    team_by_code = {c.code: c.team_id for c in classrooms}
+    cycle_by_team = {c.team_id: c for c in cycles}
+
+    classrooms_by_window = {}
+    for classroom in classrooms:
+        cycle = cycle_by_team[classroom.team_id]
+        window = (cycle.start_date, cycle.end_date)
+        classrooms_by_window.setdefault(window, []).append(classroom)
+
+    requests = []
+    for window, window_classrooms in classrooms_by_window.items():
+        # Any cycle with these dates can stand for the others.
+        cycle = cycle_by_team[window_classrooms[0].team_id]
+        for i in range(0, len(window_classrooms), MAX_CLASSROOMS_PER_FETCH):
+            chunk = window_classrooms[i:i + MAX_CLASSROOMS_PER_FETCH]
+            requests.append((cycle, chunk))
+
+    num_complete_by_team = {c.team_id: 0 for c in cycles}
+    for ppn in participation.get_multi(requests):
+        for code, counts in ppn.items():
+            # Accept url codes, e.g. 'trout-viper', or plain codes.
+            team_id = team_by_code.get(code, team_by_code.get(
+                code.replace('-', ' ')))
+            if team_id is None:
+                logging.warning(
+                    "Unexpected code in participation: {}".format(code))
+                continue
+            complete_count = next(
+                (c for c in counts if c['value'] == '100'), None)
+            num_complete_by_team[team_id] += (
+                complete_count['n'] if complete_count else 0)
+
+    for cycle in cycles:
+        cycle.students_completed = num_complete_by_team[cycle.team_id]
+
+    Cycle.put_multi(cycles)
 
 
 class TaskWorker(webapp2.RequestHandler):
@@ -156,7 +158,7 @@ class TeamCycleEmails(TaskWorker):
         if len(classrooms) == 0:
             pct_complete_by_id = {}
         else:
-            ppn = get_participation(cycle, classrooms)
+            ppn = participation.get(cycle, classrooms)
             pct_complete_by_id = self.participation_to_pct(ppn, classrooms)
 
         # Get all the responses once to save trips to the db. Redact them later
@@ -225,61 +227,91 @@ class TeamParticipation(TaskWorker):
             )
             return
 
-        team = Team.get_by_id(team_id)
         classrooms = Classroom.get(team_id=team_id)
 
         if len(classrooms) == 0:
             logging.info("No classrooms, setting participation to 0.")
-            cycle.students_completed = 0
+
+        update_participation([cycle], classrooms)
+
+
+class TeamParticipationBatch(TaskWorker):
+    """Same as TeamParticipation, for a shard of teams at once.
+
+    Expects a comma-separated `team_ids` param.
+    """
+
+    def post(self, date_str=None):
+        if date_str:
+            today = datetime.strptime(date_str, config.iso_date_format).date()
         else:
-            ppn = get_participation(cycle, classrooms)
-            num_complete = 0
-            for code, counts in ppn.items():
-                complete_count = next(
-                    (c for c in counts if c['value'] == '100'), None)
-                num_complete += complete_count['n'] if complete_count else 0
-            cycle.students_completed = num_complete
+            today = date.today()
 
-        cycle.put()
+        team_ids = [id for id in self.request.get('team_ids').split(',')
+                    if id]
+
+        # Teams without a current cycle are skipped, as with a single team.
+        cycles = Cycle.get_current_for_teams(team_ids, today).values()
+        if not cycles:
+            logging.info("No current cycles for {} teams. Doing nothing."
+                         .format(len(team_ids)))
+            return
+
+        classrooms = Classroom.query_by_teams([c.team_id for c in cycles])
+
+        update_participation(cycles, classrooms)
+        logging.info("Updated participation for {} of {} teams."
+                     .format(len(cycles), len(team_ids)))
 
 
 class BackupResponse(TaskWorker):
-    """Save a copy of a response to a backup table."""
+    """Save a copy of a response to a backup table.
+
+    Responses are now backed up in batches, see ResponseBackup.drain(). This
+    remains for tasks queued before that.
+    """
     def post(self):
         content_types = self.request.headers.get('Content-Type', [])
         if 'application/json' not in content_types:
             raise Exception("/task/backup_response requires JSON content type")
 
         # This results from a known sane internal call, so we can skip most of
-        # the layers we normally use (get_params(), creating objects). First, a
-        # dictionary of python-friendly values:
+        # the layers we normally use (get_params(), creating objects).
         response_params = json.loads(self.request.body)
 
-        # Then convert values to their MySQL-friendly versions.
-        row_dict = ResponseBackup.coerce_row_dict(response_params)
-
-        # The data provided should come from Response.after_put(), so the
-        # created and modified times should be correct, they'll need converting
-        # to sql format.
-        for key in ('created', 'modified'):
-            row_dict[key] = util.iso_datetime_to_sql(row_dict[key])
-
-        # Then just insert, with no choice to update anything that might look
-        # similar.
-        with mysql_connection.connect() as sql:
-            affected_rows = sql.insert_row_dicts(
-                ResponseBackup.table, [row_dict])
+        num_rows = ResponseBackup.insert_payloads([response_params])
 
         # There's no unique index or primary key on this table, so we should
         # _always_ get a new row.
-        if affected_rows != 1:
+        if num_rows != 1:
             raise Exception("BackupResponses failed to insert a new row.")
 
+
+class RServeReportsBatch(TaskWorker):
+    """Ask RServe for reports on some reporting units.
+
+    Queued by cron_rserve.queue_batches(). The body is a JSON list of
+    reporting units, see cron_rserve.build_reporting_unit().
+    """
+    def post(self, script):
+        reporting_units = json.loads(self.request.body)
+        payload = dict(
+            cron_rserve.get_secrets(self.request),
+            reporting_units=reporting_units,
+        )
+        logging.info("Requesting {} reports from RServe."
+                     .format(len(reporting_units)))
+        cron_rserve.send(script, payload)
+
+
 task_routes = [
     Route('/task/<user_id>/digest_notifications', DigestUserNotifications),
     Route('/task/<team_id>/cycle_emails', TeamCycleEmails),
     Route('/task/<team_id>/cycle_emails/<date_str>', TeamCycleEmails),
     Route('/task/<team_id>/team_participation', TeamParticipation),
     Route('/task/<team_id>/team_participation/<date_str>', TeamParticipation),
+    Route('/task/team_participation_batch', TeamParticipationBatch),
+    Route('/task/team_participation_batch/<date_str>', TeamParticipationBatch),
     Route('/task/backup_response', BackupResponse),
+    Route('/task/rserve_reports/<script>', RServeReportsBatch),
 ]
@@ -1,16 +1,13 @@
 from google.appengine.api import users as app_engine_users
-from google.appengine.api import urlfetch
 
-import datetime
-import json
 import logging
 import os
 
-from api_handlers import TeamsClassrooms
 from gae_handlers import ViewHandler, Route
 from model import (Classroom, Cycle, Response, Team, User)
 from permission import (has_captain_permission, has_contact_permission, owns)
 import jwt_helper
+import participation
 import util
 import random
 
@@ -140,9 +137,11 @@ class CompletionCertificate(ViewHandler):
         # are expected to complete the survey multiple times.
         participation_base = sum(cl.num_students for cl in classrooms)
 
+        ppn_by_cycle = self.get_participation_for_cycles(classrooms, cycles)
+
         cycle_participation = []
         for cycle in cycles:
-            ppn = self.get_participation_for_cycle(classrooms, cycle)
+            ppn = ppn_by_cycle[cycle.uid]
 
             num_complete_in_cycle = 0
             for classroom_counts in ppn.values():
@@ -158,46 +157,15 @@ class CompletionCertificate(ViewHandler):
 
         return cycle_participation
 
-    def get_participation_for_cycle(self, classrooms, cycle):
-        if not cycle.start_date or not cycle.end_date:
-            return {}
-
-        handler = TeamsClassrooms()
-        user = User.create(id='triton', email='')
-        jwt = handler.classroom_participation_jwt(user, classrooms)
-
-        if util.is_localhost():
-            protocol = 'http'
-            neptune_domain = 'localhost:8080'
-        else:
-            protocol = 'https'
-            neptune_domain = os.environ['NEPTUNE_DOMAIN']
-
-        start_datetime = datetime.datetime.combine(
-                cycle.start_date, datetime.datetime.min.time())
-        end_datetime = datetime.datetime.combine(
-                cycle.end_date, datetime.datetime.max.time())
-        url = (
-            '{protocol}://{domain}/api/project_cohorts/participation?{ids}&start={start_date}&end={end_date}'
-            .format(
-                protocol=protocol,
-                domain=neptune_domain,
-                ids='&'.join(['uid={}'.format(c.url_code) for c in classrooms]),
-                start_date=util.datelike_to_iso_string(start_datetime),
-                end_date=util.datelike_to_iso_string(end_datetime),
-            )
-        )
-
-        result = urlfetch.fetch(
-            url=url,
-            method=urlfetch.GET,
-            headers={'Authorization': 'Bearer {}'.format(jwt)}
-        )
-
-        if not result or result.status_code != 200:
-            raise Exception("Failed to get participation {}".format(result))
+    def get_participation_for_cycles(self, classrooms, cycles):
+        """Participation for each cycle, as {cycle uid: {code: counts}}, with
+        any calls to Neptune made concurrently."""
+        dated = [c for c in cycles if c.start_date and c.end_date]
+        ppns = participation.get_multi([(c, classrooms) for c in dated])
 
-        return json.loads(result.content)
+        ppn_by_cycle = {c.uid: {} for c in cycles}
+        ppn_by_cycle.update({c.uid: ppn for c, ppn in zip(dated, ppns)})
+        return ppn_by_cycle
 
     def participation_to_pct(self, participation, classrooms):
         """Participation is {code: [{'value': x, 'n': y}, ...], ...}"""
@@ -36,3 +36,4 @@ gcloud app deploy app.yaml \
   --no-promote \
   --verbosity=info
 gcloud app deploy cron.yaml --project="${PROJECT_ID}"
+gcloud app deploy queue.yaml --project="${PROJECT_ID}"
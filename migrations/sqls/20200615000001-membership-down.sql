@@ -0,0 +1,7 @@
+/* Normalized, indexed copies of json lists of related ids. */
+
+DROP TABLE `user_team`;
+DROP TABLE `user_organization`;
+DROP TABLE `user_network`;
+DROP TABLE `team_organization`;
+DROP TABLE `participant_classroom`;
@@ -0,0 +1,114 @@
+/* Normalized, indexed copies of json lists of related ids. */
+
+# Each table mirrors one json list, e.g. `user`.`owned_teams`, so membership
+# can be queried with an index rather than `LIKE BINARY '%uid%'`. See
+# app/model/membership.py.
+
+CREATE TABLE `user_team` (
+  `user_id` varchar(50) NOT NULL,
+  `team_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`user_id`, `team_id`),
+  INDEX `related-entity` (`team_id`, `user_id`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+CREATE TABLE `user_organization` (
+  `user_id` varchar(50) NOT NULL,
+  `organization_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`user_id`, `organization_id`),
+  INDEX `related-entity` (`organization_id`, `user_id`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+CREATE TABLE `user_network` (
+  `user_id` varchar(50) NOT NULL,
+  `network_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`user_id`, `network_id`),
+  INDEX `related-entity` (`network_id`, `user_id`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+CREATE TABLE `team_organization` (
+  `team_id` varchar(50) NOT NULL,
+  `organization_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`team_id`, `organization_id`),
+  INDEX `related-entity` (`organization_id`, `team_id`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+CREATE TABLE `participant_classroom` (
+  `participant_id` varchar(50) NOT NULL,
+  `classroom_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`participant_id`, `classroom_id`),
+  INDEX `related-entity` (`classroom_id`, `participant_id`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+# Backfill. MySQL 5.7 has no JSON_TABLE, so expand each list by joining to a
+# sequence of array indices. Lists are varchar(3500), so they can't hold
+# anywhere near 1000 ids.
+
+CREATE TEMPORARY TABLE `membership_index` (
+  `i` smallint unsigned NOT NULL,
+  PRIMARY KEY (`i`)
+);
+
+INSERT INTO `membership_index` (`i`)
+SELECT ones.d + 10 * tens.d + 100 * hundreds.d
+FROM
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) ones,
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) tens,
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) hundreds;
+
+INSERT IGNORE INTO `user_team` (`user_id`, `team_id`)
+SELECT
+  s.`uid`,
+  JSON_UNQUOTE(JSON_EXTRACT(s.`owned_teams`, CONCAT('$[', n.`i`, ']')))
+FROM `user` s
+JOIN `membership_index` n
+  ON n.`i` < JSON_LENGTH(s.`owned_teams`);
+
+INSERT IGNORE INTO `user_organization` (`user_id`, `organization_id`)
+SELECT
+  s.`uid`,
+  JSON_UNQUOTE(JSON_EXTRACT(s.`owned_organizations`, CONCAT('$[', n.`i`, ']')))
+FROM `user` s
+JOIN `membership_index` n
+  ON n.`i` < JSON_LENGTH(s.`owned_organizations`);
+
+INSERT IGNORE INTO `user_network` (`user_id`, `network_id`)
+SELECT
+  s.`uid`,
+  JSON_UNQUOTE(JSON_EXTRACT(s.`owned_networks`, CONCAT('$[', n.`i`, ']')))
+FROM `user` s
+JOIN `membership_index` n
+  ON n.`i` < JSON_LENGTH(s.`owned_networks`);
+
+INSERT IGNORE INTO `team_organization` (`team_id`, `organization_id`)
+SELECT
+  s.`uid`,
+  JSON_UNQUOTE(JSON_EXTRACT(s.`organization_ids`, CONCAT('$[', n.`i`, ']')))
+FROM `team` s
+JOIN `membership_index` n
+  ON n.`i` < JSON_LENGTH(s.`organization_ids`);
+
+INSERT IGNORE INTO `participant_classroom` (`participant_id`, `classroom_id`)
+SELECT
+  s.`uid`,
+  JSON_UNQUOTE(JSON_EXTRACT(s.`classroom_ids`, CONCAT('$[', n.`i`, ']')))
+FROM `participant` s
+JOIN `membership_index` n
+  ON n.`i` < JSON_LENGTH(s.`classroom_ids`);
+
+DROP TEMPORARY TABLE `membership_index`;
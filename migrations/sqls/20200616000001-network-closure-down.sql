@@ -0,0 +1,3 @@
+/* Everything each network can reach through its associations. */
+
+DROP TABLE `network_closure`;
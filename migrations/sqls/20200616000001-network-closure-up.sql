@@ -0,0 +1,66 @@
+/* Everything each network can reach through its associations. */
+
+# See NetworkClosure in app/model/membership.py. Rows pair a network with
+# every network or organization reachable from it, at any depth, so reading a
+# network admin's organizations is one indexed query.
+
+CREATE TABLE `network_closure` (
+  `network_id` varchar(50) NOT NULL,
+  `descendant_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`network_id`, `descendant_id`),
+  INDEX `related-entity` (`descendant_id`, `network_id`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+# Backfill direct associations the same way as the membership tables.
+
+CREATE TEMPORARY TABLE `closure_index` (
+  `i` smallint unsigned NOT NULL,
+  PRIMARY KEY (`i`)
+);
+
+INSERT INTO `closure_index` (`i`)
+SELECT ones.d + 10 * tens.d + 100 * hundreds.d
+FROM
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) ones,
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) tens,
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) hundreds;
+
+INSERT IGNORE INTO `network_closure` (`network_id`, `descendant_id`)
+SELECT
+  s.`uid`,
+  JSON_UNQUOTE(JSON_EXTRACT(s.`association_ids`, CONCAT('$[', n.`i`, ']')))
+FROM `network` s
+JOIN `closure_index` n
+  ON n.`i` < JSON_LENGTH(s.`association_ids`);
+
+DROP TEMPORARY TABLE `closure_index`;
+
+# Then extend to indirect associations. Each pass joins paths end to end,
+# doubling the longest path covered. Networks have been limited to a depth of
+# four, so two passes would do; a third is cheap insurance.
+
+INSERT IGNORE INTO `network_closure` (`network_id`, `descendant_id`)
+SELECT a.`network_id`, b.`descendant_id`
+FROM `network_closure` a
+JOIN `network_closure` b
+  ON a.`descendant_id` = b.`network_id`;
+
+INSERT IGNORE INTO `network_closure` (`network_id`, `descendant_id`)
+SELECT a.`network_id`, b.`descendant_id`
+FROM `network_closure` a
+JOIN `network_closure` b
+  ON a.`descendant_id` = b.`network_id`;
+
+INSERT IGNORE INTO `network_closure` (`network_id`, `descendant_id`)
+SELECT a.`network_id`, b.`descendant_id`
+FROM `network_closure` a
+JOIN `network_closure` b
+  ON a.`descendant_id` = b.`network_id`;
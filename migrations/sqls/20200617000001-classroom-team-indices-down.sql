@@ -0,0 +1,10 @@
+/* Secondary indices for classroom and team lookups. */
+
+ALTER TABLE `classroom`
+  DROP INDEX `team`,
+  DROP INDEX `contact`,
+  DROP INDEX `code`;
+
+ALTER TABLE `team`
+  DROP INDEX `program`,
+  DROP INDEX `captain`;
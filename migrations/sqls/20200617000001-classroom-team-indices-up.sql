@@ -0,0 +1,13 @@
+/* Secondary indices for classroom and team lookups. */
+
+# Must match `indices` in the py_table_definition of each model; see
+# app/schema_check.py.
+
+ALTER TABLE `classroom`
+  ADD INDEX `team` (`team_id`),
+  ADD INDEX `contact` (`contact_id`),
+  ADD INDEX `code` (`code`);
+
+ALTER TABLE `team`
+  ADD INDEX `program` (`program_id`),
+  ADD INDEX `captain` (`captain_id`);
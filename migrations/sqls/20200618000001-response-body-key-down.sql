@@ -0,0 +1,21 @@
+/* Bodies saved since the up migration exist only as key rows, so copy them
+back into the body column before dropping the table. */
+
+# Bodies are limited to JSON_TEXT_MAX, but the default here is only 1024.
+SET SESSION group_concat_max_len = 1000000;
+
+UPDATE `response` r
+JOIN (
+  SELECT
+    `response_id`,
+    CONCAT(
+      '{',
+      GROUP_CONCAT(CONCAT(JSON_QUOTE(`key`), ': ', `data`) SEPARATOR ', '),
+      '}'
+    ) AS `body`
+  FROM `response_body_key`
+  GROUP BY `response_id`
+) k ON k.`response_id` = r.`uid`
+SET r.`body` = k.`body`;
+
+DROP TABLE `response_body_key`;
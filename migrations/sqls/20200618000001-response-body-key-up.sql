@@ -0,0 +1,71 @@
+/* Response bodies stored a row per key, see model/response_body_key.py. */
+
+CREATE TABLE `response_body_key` (
+  `response_id` varchar(50) NOT NULL,
+  `key` varchar(200) NOT NULL,
+  `modified` datetime DEFAULT NULL,
+  `data` text NOT NULL,
+  PRIMARY KEY (`response_id`, `key`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+# Backfill. MySQL 5.7 has no JSON_TABLE, so expand each body by joining to a
+# sequence of key indices. Bodies are limited to JSON_TEXT_DICT_MAX keys, well
+# under 1000.
+
+CREATE TEMPORARY TABLE `body_key_index` (
+  `i` smallint unsigned NOT NULL,
+  PRIMARY KEY (`i`)
+);
+
+INSERT INTO `body_key_index` (`i`)
+SELECT ones.d + 10 * tens.d + 100 * hundreds.d
+FROM
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) ones,
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) tens,
+  (SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+   UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+   UNION ALL SELECT 8 UNION ALL SELECT 9) hundreds;
+
+INSERT IGNORE INTO `response_body_key`
+  (`response_id`, `key`, `modified`, `data`)
+SELECT
+  k.`response_id`,
+  k.`key`,
+  CASE
+    WHEN JSON_TYPE(JSON_EXTRACT(k.`entry`, '$.modified')) = 'STRING'
+    THEN STR_TO_DATE(
+      JSON_UNQUOTE(JSON_EXTRACT(k.`entry`, '$.modified')),
+      '%Y-%m-%dT%H:%i:%sZ'
+    )
+    ELSE NULL
+  END,
+  k.`entry`
+FROM (
+  SELECT
+    b.`response_id`,
+    b.`key`,
+    JSON_EXTRACT(b.`body`, CONCAT('$."', b.`key`, '"')) AS `entry`
+  FROM (
+    SELECT
+      r.`uid` AS `response_id`,
+      r.`body`,
+      JSON_UNQUOTE(
+        JSON_EXTRACT(JSON_KEYS(r.`body`), CONCAT('$[', n.`i`, ']'))
+      ) AS `key`
+    FROM `response` r
+    JOIN `body_key_index` n
+      ON n.`i` < JSON_LENGTH(JSON_KEYS(r.`body`))
+    WHERE r.`body` IS NOT NULL
+  ) b
+) k;
+
+# The key rows are now the source of truth. Leave the column as it is so
+# rolling back loses nothing written before this migration.
+
+DROP TEMPORARY TABLE `body_key_index`;
@@ -0,0 +1 @@
+DROP TABLE `response_history`;
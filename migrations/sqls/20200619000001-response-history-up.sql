@@ -0,0 +1,45 @@
+/* Response history as deltas, see model/response_history.py. */
+
+CREATE TABLE `response_history` (
+  `history_id` int unsigned NOT NULL AUTO_INCREMENT,
+  `response_id` varchar(50) NOT NULL,
+  `modified` datetime(6) NOT NULL,
+  `kind` varchar(10) NOT NULL,
+  `progress` tinyint(4) unsigned DEFAULT NULL,
+  `page` tinyint(4) unsigned DEFAULT NULL,
+  `body` text NOT NULL,
+  PRIMARY KEY (`history_id`),
+  INDEX `response-modified` (`response_id`, `modified`),
+  INDEX `kind-modified` (`kind`, `modified`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
+
+# Deltas only make sense on top of a snapshot, so start every response's
+# history with one of it as it is now. Earlier history stays in
+# `response_backup`.
+
+# Bodies are limited to JSON_TEXT_MAX, but the default here is only 1024.
+SET SESSION group_concat_max_len = 1000000;
+
+INSERT INTO `response_history`
+  (`response_id`, `modified`, `kind`, `progress`, `page`, `body`)
+SELECT
+  r.`uid`,
+  r.`modified`,
+  'snapshot',
+  r.`progress`,
+  r.`page`,
+  COALESCE(k.`body`, r.`body`, '{}')
+FROM `response` r
+LEFT JOIN (
+  SELECT
+    `response_id`,
+    CONCAT(
+      '{',
+      GROUP_CONCAT(CONCAT(JSON_QUOTE(`key`), ': ', `data`) SEPARATOR ', '),
+      '}'
+    ) AS `body`
+  FROM `response_body_key`
+  GROUP BY `response_id`
+) k ON k.`response_id` = r.`uid`;
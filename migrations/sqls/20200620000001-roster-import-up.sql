@@ -0,0 +1,21 @@
+/* Progress of csv roster uploads, see model/roster_import.py. */
+
+CREATE TABLE `roster_import` (
+  `uid` varchar(50) NOT NULL,
+  `short_uid` varchar(50) NOT NULL,
+  `created` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ON UPDATE CURRENT_TIMESTAMP,
+  `classroom_id` varchar(50) NOT NULL,
+  `team_id` varchar(50) NOT NULL,
+  `user_id` varchar(50) NOT NULL,
+  `status` varchar(20) NOT NULL DEFAULT 'in_progress',
+  `rows_processed` int unsigned NOT NULL DEFAULT 0,
+  `num_added` int unsigned NOT NULL DEFAULT 0,
+  `num_updated` int unsigned NOT NULL DEFAULT 0,
+  `num_unchanged` int unsigned NOT NULL DEFAULT 0,
+  PRIMARY KEY (`uid`),
+  INDEX classroom (`classroom_id`)
+)
+  ENGINE=InnoDB
+  DEFAULT CHARSET utf8;
@@ -0,0 +1,112 @@
+"""Benchmark response history storage and restore time.
+
+Not collected with the unit tests. Run by name:
+
+> python run_tests.py benchmark_response_history
+"""
+
+import datetime
+import json
+import time
+
+from model import ResponseBackup, ResponseHistory
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+
+
+class BenchmarkResponseHistory(ConsistencyTestCase):
+    num_keys = 50
+    num_saves = 2000
+    # Autosaves every few seconds, across this many days.
+    num_days = 20
+
+    def set_up(self):
+        super(BenchmarkResponseHistory, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'response_backup': ResponseBackup.get_table_definition(),
+                'response_history': ResponseHistory.get_table_definition(),
+            })
+
+    def entry(self, i, t):
+        return {'value': 'answer {}'.format(i), 'modified': t}
+
+    def stored_bytes(self, table):
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query(
+                'SELECT SUM(LENGTH(`body`)) AS `n`, COUNT(*) AS `rows` '
+                'FROM `{}`'.format(table),
+                tuple(),
+            )
+        return int(rows[0]['n'] or 0), rows[0]['rows']
+
+    def time_restore(self, response_id, at, repeat=20):
+        start = time.time()
+        for x in range(repeat):
+            state = ResponseHistory.get_as_of(response_id, at)
+        return state, (time.time() - start) / repeat
+
+    def test_autosaves(self):
+        response_id = 'Response_benchmark'
+        start = datetime.datetime(2019, 1, 1)
+        step = datetime.timedelta(days=self.num_days) / self.num_saves
+        t_str = lambda t: t.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        body = {'question{}'.format(k): self.entry(0, t_str(start))
+                for k in range(self.num_keys)}
+        payloads = [{
+            'uid': response_id,
+            'modified': ResponseHistory.format_time(start),
+            'kind': ResponseHistory.SNAPSHOT,
+            'progress': 0,
+            'page': 1,
+            'body': body,
+        }]
+
+        # Each autosave changes one answer, as a client typing would.
+        full_copy_bytes = len(json.dumps(body))
+        for i in range(1, self.num_saves):
+            t = start + step * i
+            key = 'question{}'.format(i % self.num_keys)
+            body[key] = self.entry(i, t_str(t))
+            full_copy_bytes += len(json.dumps(body))
+            payloads.append({
+                'uid': response_id,
+                'modified': ResponseHistory.format_time(t),
+                'kind': ResponseHistory.DELTA,
+                'progress': None,
+                'page': None,
+                'body': {key: body[key]},
+            })
+
+        for i in range(0, len(payloads), ResponseBackup.batch_size):
+            ResponseHistory.insert_payloads(
+                payloads[i:i + ResponseBackup.batch_size])
+
+        history_bytes, history_rows = self.stored_bytes(
+            ResponseHistory.table)
+        latest = start + datetime.timedelta(days=self.num_days)
+        state, restore_before = self.time_restore(response_id, latest)
+        self.assertEqual(state['body'], body)
+
+        compacted = ResponseHistory.compact(before=latest)
+        compacted_bytes, compacted_rows = self.stored_bytes(
+            ResponseHistory.table)
+        state, restore_after = self.time_restore(response_id, latest)
+        self.assertEqual(state['body'], body)
+
+        print('')
+        print("{} saves of a {}-key body:".format(
+            self.num_saves, self.num_keys))
+        print("  full copies:      {:>10} bytes in {} rows".format(
+            full_copy_bytes, self.num_saves))
+        print("  deltas:           {:>10} bytes in {} rows".format(
+            history_bytes, history_rows))
+        print("  compacted:        {:>10} bytes in {} rows".format(
+            compacted_bytes, compacted_rows))
+        print("  restore latest:   {:>10.4f}s before compacting, {:.4f}s "
+              "after".format(restore_before, restore_after))
+        print("  compact:          {}".format(compacted))
+
+        self.assertLess(history_bytes, full_copy_bytes)
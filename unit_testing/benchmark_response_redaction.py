@@ -0,0 +1,104 @@
+"""Benchmark bytes read from the db by Response.get_for_teams().
+
+Not collected with the unit tests. Run by name:
+
+> python run_tests.py benchmark_response_redaction
+
+Bytes are measured by the server's Bytes_sent counter, so run against a
+database nothing else is using.
+"""
+
+import time
+
+from model import Response, ResponseBodyKey, User
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+
+
+class BenchmarkResponseRedaction(ConsistencyTestCase):
+    num_teams = 20
+    users_per_team = 6
+    num_keys = 50
+
+    def set_up(self):
+        super(BenchmarkResponseRedaction, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'response': Response.get_table_definition(),
+                'response_body_key': ResponseBodyKey.get_table_definition(),
+            })
+
+    def bytes_sent(self):
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query(
+                "SHOW GLOBAL STATUS LIKE 'Bytes_sent'", tuple())
+        return int(rows[0]['Value'])
+
+    def measure(self, f):
+        # Reading the counter sends its own result, which the next reading
+        # includes.
+        first = self.bytes_sent()
+        overhead = self.bytes_sent() - first
+
+        start_bytes = self.bytes_sent()
+        start = time.time()
+        result = f()
+        seconds = time.time() - start
+        num_bytes = self.bytes_sent() - start_bytes - overhead
+        return result, num_bytes, seconds
+
+    def test_org_dashboard(self):
+        body = {
+            'question{}'.format(k): {
+                'value': 'An open response answer. ' * 10,
+                'modified': '2019-01-01T00:00:00Z',
+            }
+            for k in range(self.num_keys)
+        }
+        team_ids = ['Team_{}'.format(t) for t in range(self.num_teams)]
+
+        # Mostly private user-level responses, as on an org dashboard.
+        responses = []
+        for team_id in team_ids:
+            responses.append(Response.create(
+                type=Response.TEAM_LEVEL_SYMBOL,
+                user_id='',
+                team_id=team_id,
+                parent_id='Cycle_foo',
+                module_label='DemoModule',
+                body=body,
+            ))
+            for u in range(self.users_per_team):
+                responses.append(Response.create(
+                    user_id='User_{}-{}'.format(team_id, u),
+                    team_id=team_id,
+                    parent_id='Cycle_foo',
+                    module_label='DemoModule',
+                    body=body,
+                ))
+        Response.put_multi(responses)
+
+        user = User.create(email='foo@bar.com')
+
+        def redact_after():
+            return Response.redact_private_responses(
+                Response.get_for_teams_unsafe(team_ids), user)
+
+        after, after_bytes, after_seconds = self.measure(redact_after)
+        in_sql, sql_bytes, sql_seconds = self.measure(
+            lambda: Response.get_for_teams(user, team_ids))
+
+        to_dicts = lambda rs: sorted(
+            [r.to_dict() for r in rs], key=lambda d: d['uid'])
+        self.assertEqual(to_dicts(in_sql), to_dicts(after))
+
+        print('')
+        print("{} responses on {} teams, {} keys each:".format(
+            len(responses), self.num_teams, self.num_keys))
+        print("  redact after query: {:>10} bytes, {:.4f}s".format(
+            after_bytes, after_seconds))
+        print("  redact in query:    {:>10} bytes, {:.4f}s".format(
+            sql_bytes, sql_seconds))
+
+        self.assertLess(sql_bytes, after_bytes)
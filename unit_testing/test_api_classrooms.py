@@ -9,7 +9,20 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Classroom, Participant, Program, Report, Team, User
+from model import (
+    Classroom,
+    NetworkClosure,
+    Participant,
+    ParticipantClassroom,
+    Program,
+    Report,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import config
 import json
@@ -42,11 +55,17 @@ class TestApiClassrooms(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'participant': Participant.get_table_definition(),
+                'participant_classroom': ParticipantClassroom.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'report': Report.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
@@ -118,6 +137,38 @@ class TestApiClassrooms(ConsistencyTestCase):
             status=403
         )
 
+    def test_get_for_team_pages(self):
+        """Lists follow Link headers a page at a time, in name order."""
+        team = Team.create(name='Team Foo', captain_id='User_cap',
+                           program_id=self.program.uid)
+        team.put()
+        user = User.create(name='User Foo', email='user@foo.com',
+                           owned_teams=[team.uid])
+        user.put()
+        names = ['Bio', 'Art', 'Art', None, 'Chem']
+        Classroom.put_multi([
+            Classroom.create(name=name, team_id=team.uid, code='code',
+                             contact_id=user.uid)
+            for name in names
+        ])
+
+        url = '/api/teams/{}/classrooms?n=2'.format(team.uid)
+        pages = []
+        while url:
+            response = self.testapp.get(url,
+                                        headers=self.login_headers(user))
+            pages.append([c['name'] for c in json.loads(response.body)])
+            link = response.headers.get('Link', None)
+            url = link[1:link.index('>')] if link else None
+
+        self.assertEqual(pages, [[None, 'Art'], ['Art', 'Bio'], ['Chem']])
+
+        self.testapp.get(
+            '/api/teams/{}/classrooms?cursor=foo'.format(team.uid),
+            headers=self.login_headers(user),
+            status=400,
+        )
+
     def test_update_forbidden(self):
         contact, classroom = self.test_create()
 
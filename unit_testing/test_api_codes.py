@@ -1,10 +1,22 @@
 """Tests endpoints for codes."""
 
+from mock import patch
+import datetime
 import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Classroom, Participant, Program, Team
+from model import (
+    Classroom,
+    Cycle,
+    Participant,
+    ParticipantClassroom,
+    Program,
+    Team,
+    TeamOrganization,
+    UserTeam,
+    code_context,
+)
 from unit_test_helper import ConsistencyTestCase
 import config
 import mysql_connection
@@ -32,9 +44,13 @@ class TestApiCodes(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'cycle': Cycle.get_table_definition(),
                 'participant': Participant.get_table_definition(),
+                'participant_classroom': ParticipantClassroom.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
@@ -127,3 +143,103 @@ class TestApiCodes(ConsistencyTestCase):
                 code, Participant.strip_token(student_id)),
             status=200,
         )
+
+    def create_roster(self, code, student_id):
+        team = Team.create(
+            name="Foo Team",
+            captain_id="User_cap",
+            program_id=self.program.uid,
+        )
+        team.put()
+
+        classroom = Classroom.create(
+            code=code,
+            name='Adventuring 101',
+            contact_id='User_LINK',
+            team_id=team.uid,
+        )
+        classroom.put()
+
+        participant = Participant.create(
+            student_id=student_id,
+            team_id=team.uid,
+            classroom_ids=[classroom.uid],
+        )
+        participant.put()
+
+        return team, classroom, participant
+
+    def test_unknown_code_cached_until_created(self):
+        code = 'forest temple'
+        student_id = 'zelda'
+        url = '/api/codes/{}/participants/{}'.format(code, student_id)
+
+        self.testapp.get(url, status=404)
+        self.assertEqual(Classroom.get_code_context(code), None)
+
+        # Creating the classroom clears the cached miss.
+        self.create_roster(code, student_id)
+        self.testapp.get(url, status=200)
+
+    def test_current_cycle_updated_on_put(self):
+        code = 'forest temple'
+        student_id = 'zelda'
+        url = '/api/codes/{}/participants/{}'.format(code, student_id)
+        team, classroom, participant = self.create_roster(code, student_id)
+
+        # No cycle yet, and that's now cached.
+        response = self.testapp.get(url, status=200)
+        self.assertNotIn('cycle', response.json)
+
+        today = datetime.date.today()
+        cycle = Cycle.create(
+            team_id=team.uid,
+            ordinal=1,
+            start_date=today - datetime.timedelta(days=1),
+            end_date=today + datetime.timedelta(days=1),
+        )
+        cycle.put()
+
+        response = self.testapp.get(url, status=200)
+        self.assertEqual(response.json['cycle']['uid'], cycle.uid)
+
+    def test_program_flags_updated_on_put(self):
+        code = 'forest temple'
+        url = '/api/codes/{}/participants/{}'.format(code, 'not-on-roster')
+        self.create_roster(code, 'zelda')
+
+        self.testapp.get(url, status=404)
+
+        # Programs without classrooms accept any student id.
+        self.program.use_classrooms = False
+        self.program.put()
+
+        self.testapp.get(url, status=200)
+
+    def test_program_put_without_flag_change(self):
+        """Only changing a flag looks up the program's codes."""
+        self.create_roster('forest temple', 'zelda')
+
+        with patch.object(code_context, 'invalidate_for_program') as inv:
+            self.program.name = 'Renamed'
+            self.program.put()
+            self.assertEqual(inv.call_count, 0)
+
+            self.program.use_classrooms = not self.program.use_classrooms
+            self.program.put()
+            self.assertEqual(inv.call_count, 1)
+
+    def test_team_deleted(self):
+        code = 'forest temple'
+        url = '/api/codes/{}/participants/{}'.format(code, 'zelda')
+        team, classroom, participant = self.create_roster(code, 'zelda')
+
+        # Cached, then the team goes away, leaving its classroom.
+        self.testapp.get(url, status=200)
+        with patch.object(code_context, 'invalidate_for_teams') as inv:
+            team.name = 'Renamed'
+            team.put()
+            self.assertEqual(inv.call_count, 0)
+        Team.delete_multi([team])
+
+        self.testapp.get(url, status=404)
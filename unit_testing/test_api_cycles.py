@@ -7,7 +7,18 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Cycle, Program, Team, User
+from model import (
+    Classroom,
+    Cycle,
+    NetworkClosure,
+    Program,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase, jwt_headers
 import config
 import mysql_connection
@@ -34,10 +45,16 @@ class TestApiCycles(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def create(self):
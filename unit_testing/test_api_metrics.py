@@ -9,7 +9,14 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Metric, User
+from model import (
+    Metric,
+    NetworkClosure,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import config
 import json
@@ -39,7 +46,11 @@ class TestApiMetrics(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'metric': Metric.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def login_headers(self, user):
@@ -12,7 +12,22 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Cycle, Email, Organization, Program, Response, Team, User
+from model import (
+    Classroom,
+    Cycle,
+    Email,
+    NetworkClosure,
+    Organization,
+    Program,
+    Response,
+    ResponseBodyKey,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import config
 import json
@@ -44,12 +59,19 @@ class TestApiOrganizations(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'response': Response.get_table_definition(),
+                'response_body_key': ResponseBodyKey.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
@@ -1,5 +1,8 @@
 """Tests endpoints for participants."""
 
+from mock import patch
+import StringIO
+import csv
 import datetime
 import json
 import logging
@@ -8,7 +11,21 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Classroom, Cycle, Participant, Program, Team, User
+from model import (
+    Classroom,
+    Cycle,
+    NetworkClosure,
+    Participant,
+    ParticipantClassroom,
+    Program,
+    RosterImport,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase, jwt_headers
 import config
 import mysql_connection
@@ -38,10 +55,17 @@ class TestApiParticipants(ConsistencyTestCase):
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'participant': Participant.get_table_definition(),
+                'participant_classroom': ParticipantClassroom.get_table_definition(),
                 'program': Program.get_table_definition(),
+                'roster_import': RosterImport.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
@@ -664,3 +688,245 @@ class TestApiParticipants(ConsistencyTestCase):
             status=400,
         )
         self.assertEqual(len(Participant.get()), 0)
+
+    def post_roster(self, classroom, user, body, status=200, import_id=None):
+        url = '/api/classrooms/{}/roster_imports'.format(classroom.uid)
+        if import_id:
+            url += '?import_id={}'.format(import_id)
+        return self.testapp.post(
+            url,
+            body,
+            headers=dict(jwt_headers(user), **{'Content-Type': 'text/csv'}),
+            status=status,
+        )
+
+    def test_roster_import(self):
+        (
+            other, teammate, contact, captain, team, classroom, ppnt
+        ) = self.create()
+
+        # On the team, but not this classroom.
+        elsewhere = Participant.create(
+            team_id=team.uid,
+            classroom_ids=['Classroom_other'],
+            student_id='elsewhere',
+        )
+        elsewhere.put()
+
+        body = '\r\n'.join([
+            'Student_ID,in_target_group',
+            # Existing, already on the classroom, matched by stripped id.
+            (u'KL\u0105TW@example.com,false').encode('utf-8'),
+            'Elsewhere,false',
+            'new001,true',
+            ',',
+            'new002,',
+        ])
+
+        for user in (other, teammate):
+            self.post_roster(classroom, user, body, status=403)
+
+        with patch.object(RosterImport, 'chunk_size', 2):
+            result = self.post_roster(classroom, contact, body).json
+
+        self.assertEqual(result['status'], RosterImport.COMPLETE)
+        self.assertEqual(result['rows_processed'], 5)
+        self.assertEqual(result['num_added'], 2)
+        self.assertEqual(result['num_updated'], 1)
+        self.assertEqual(result['num_unchanged'], 1)
+
+        roster = Participant.get_for_classroom(team.uid, classroom.uid)
+        self.assertEqual(
+            sorted(p.stripped_student_id for p in roster),
+            ['elsewhere', 'kltwexamplecom', 'new001', 'new002'],
+        )
+        new001 = next(p for p in roster if p.student_id == 'new001')
+        self.assertTrue(new001.in_target_group)
+        self.assertEqual(Participant.get_by_id(elsewhere.uid).classroom_ids,
+                         ['Classroom_other', classroom.uid])
+        self.assertEqual(Classroom.get_by_id(classroom.uid).num_students,
+                         classroom.num_students + 3)
+
+        # Progress is readable by the uploader.
+        fetched = self.testapp.get(
+            '/api/roster_imports/{}'.format(result['uid']),
+            headers=jwt_headers(contact),
+        ).json
+        self.assertEqual(fetched, result)
+
+    def test_roster_import_resume(self):
+        (
+            other, teammate, contact, captain, team, classroom, ppnt
+        ) = self.create()
+
+        body = '\n'.join(['student_id'] +
+                          ['new{:03d}'.format(x) for x in range(5)] +
+                          ['bad\xff'])
+
+        with patch.object(RosterImport, 'chunk_size', 2):
+            response = self.post_roster(classroom, contact, body, status=400)
+
+        # The first chunks were saved.
+        with mysql_connection.connect() as sql:
+            [row] = sql.select_star_where(RosterImport.table)
+        roster_import = RosterImport.row_dict_to_obj(row)
+        self.assertEqual(roster_import.status, RosterImport.IN_PROGRESS)
+        self.assertEqual(roster_import.rows_processed, 4)
+        self.assertIn(roster_import.uid, response.body)
+
+        # Only the uploader may resume.
+        fixed = body.replace('bad\xff', 'fixed')
+        self.post_roster(classroom, captain, fixed, status=403,
+                         import_id=roster_import.uid)
+
+        with patch.object(RosterImport, 'chunk_size', 2):
+            result = self.post_roster(classroom, contact, fixed,
+                                      import_id=roster_import.uid).json
+
+        self.assertEqual(result['uid'], roster_import.uid)
+        self.assertEqual(result['status'], RosterImport.COMPLETE)
+        self.assertEqual(result['rows_processed'], 6)
+        self.assertEqual(result['num_added'], 6)
+        self.assertEqual(
+            len(Participant.get_for_classroom(team.uid, classroom.uid)), 7)
+
+    def test_roster_import_invalid(self):
+        (
+            other, teammate, contact, captain, team, classroom, ppnt
+        ) = self.create()
+
+        self.post_roster(classroom, contact, 'name,email\nfoo,bar',
+                         status=400)
+        self.post_roster(classroom, contact, '', status=400)
+        # Not utf-8.
+        self.post_roster(classroom, contact, 'student_id,\xffname\nfoo,bar',
+                         status=400)
+
+        # Nothing was started.
+        with mysql_connection.connect() as sql:
+            self.assertEqual(sql.select_star_where(RosterImport.table), [])
+
+    def export(self, parent_id, user, status=200, query=''):
+        return self.testapp.get(
+            '/api/{}s/{}/participants/export{}'.format(
+                Participant.get_kind(parent_id).lower(), parent_id, query),
+            headers=jwt_headers(user),
+            status=status,
+        )
+
+    def test_export(self):
+        (
+            other, teammate, contact, captain, team, classroom, ppnt
+        ) = self.create()
+
+        # On the team, but not this classroom.
+        elsewhere = Participant.create(
+            team_id=team.uid,
+            classroom_ids=['Classroom_other'],
+            student_id='elsewhere',
+        )
+        # On another team in the program.
+        team2 = Team.create(name='bar', program_id=self.program.uid)
+        team2.put()
+        other_team = Participant.create(
+            team_id=team2.uid,
+            classroom_ids=['Classroom_other'],
+            student_id='other',
+        )
+        Participant.put_multi([elsewhere, other_team])
+
+        self.export(team.uid, other, status=403)
+        self.export(classroom.uid, other, status=403)
+        self.export(self.program.uid, teammate, status=403)
+        self.export('Team_missing', teammate, status=404)
+
+        result = self.export(team.uid, teammate)
+        self.assertEqual(result.content_type, 'application/x-ndjson')
+        exported = [json.loads(l) for l in result.body.splitlines()]
+        self.assertEqual(sorted(d['uid'] for d in exported),
+                         sorted([ppnt.uid, elsewhere.uid]))
+        self.assertEqual(
+            next(d for d in exported if d['uid'] == ppnt.uid),
+            json.loads(json.dumps(ppnt.to_client_dict(),
+                                  default=util.json_dumps_default)),
+        )
+
+        result = self.export(classroom.uid, teammate, query='?format=csv')
+        self.assertEqual(result.content_type, 'text/csv')
+        rows = list(csv.DictReader(StringIO.StringIO(result.body)))
+        self.assertEqual([r['uid'] for r in rows], [ppnt.uid])
+        self.assertEqual(rows[0]['student_id'].decode('utf-8'),
+                         ppnt.student_id)
+        self.assertEqual(json.loads(rows[0]['classroom_ids']),
+                         [classroom.uid])
+
+        admin = User.create(email='super@admin.com', user_type='super_admin')
+        admin.put()
+        result = self.export(self.program.uid, admin)
+        self.assertEqual(
+            sorted(json.loads(l)['uid'] for l in result.body.splitlines()),
+            sorted([ppnt.uid, elsewhere.uid, other_team.uid]),
+        )
+
+    def test_export_pages(self):
+        """Exports follow Link headers a page at a time."""
+        (
+            other, teammate, contact, captain, team, classroom, ppnt
+        ) = self.create()
+        more = [
+            Participant.create(team_id=team.uid,
+                               classroom_ids=[classroom.uid],
+                               student_id='more{}'.format(x))
+            for x in range(4)
+        ]
+        Participant.put_multi(more)
+
+        url = '/api/teams/{}/participants/export?n=2&format=csv'.format(
+            team.uid)
+        pages = []
+        while url:
+            result = self.testapp.get(url, headers=jwt_headers(teammate))
+            pages.append([r['uid'] for r in
+                          csv.DictReader(StringIO.StringIO(result.body))])
+            link = result.headers.get('Link', None)
+            url = link[1:link.index('>')] if link else None
+
+        self.assertEqual([len(p) for p in pages], [2, 2, 1])
+        self.assertEqual(sorted(uid for p in pages for uid in p),
+                         sorted([ppnt.uid] + [p.uid for p in more]))
+
+        self.export(team.uid, teammate, status=400, query='?cursor=foo')
+        self.export(team.uid, teammate, status=400, query='?n=0')
+
+    def test_export_modified_since(self):
+        (
+            other, teammate, contact, captain, team, classroom, ppnt
+        ) = self.create()
+
+        with mysql_connection.connect() as sql:
+            sql.update_row(Participant.table, 'uid', ppnt.uid,
+                           modified=datetime.datetime(2019, 1, 1))
+        recent = Participant.create(
+            team_id=team.uid,
+            classroom_ids=[classroom.uid],
+            student_id='recent',
+        )
+        recent.put()
+
+        result = self.export(team.uid, teammate,
+                             query='?modified_since=2019-01-01T00:00:01Z')
+        self.assertEqual(
+            [json.loads(l)['uid'] for l in result.body.splitlines()],
+            [recent.uid],
+        )
+
+        # Ordered by modified, so the next modified_since is the last seen.
+        result = self.export(team.uid, teammate,
+                             query='?modified_since=2019-01-01T00:00:00Z')
+        self.assertEqual(
+            [json.loads(l)['uid'] for l in result.body.splitlines()],
+            [ppnt.uid, recent.uid],
+        )
+
+        self.export(team.uid, teammate, status=400,
+                    query='?modified_since=2019-01-01')
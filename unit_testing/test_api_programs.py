@@ -6,7 +6,18 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Classroom, Organization, Program, Team, User
+from model import (
+    Classroom,
+    NetworkClosure,
+    Organization,
+    Program,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import config
 import jwt_helper
@@ -39,10 +50,15 @@ class TestApiPrograms(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.ep = Program.create(
@@ -4,7 +4,7 @@ Indirectly tests RelatedQuery with SqlModel. Other suites may skip handlers
 naively inherit from the same code.
 """
 
-from google.appengine.ext import testbed
+from google.appengine.ext import blobstore, testbed
 from mock import patch, mock_open
 import datetime
 import hashlib
@@ -16,9 +16,23 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Classroom, Network, Organization, Program, Report, Team, User
+from model import (
+    Classroom,
+    Network,
+    NetworkClosure,
+    Organization,
+    Program,
+    Report,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import config
+import counters
 import json
 import jwt_helper
 import mysql_connection
@@ -57,11 +71,16 @@ class TestApiReports(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'report': Report.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         if self.valid_jwt is None:
@@ -482,6 +501,42 @@ class TestApiReports(ConsistencyTestCase):
         return (other, teammate, contact, captain, super_admin, team,
                 classroom, report_dict)
 
+    def test_post_pdf_dedup(self):
+        """Uploading a file that's already stored doesn't write it again."""
+        today_str = datetime.date.today().strftime(config.iso_date_format)
+        filename = 'Team_filewhack.{}.pdf'.format(today_str)
+        (
+            other, teammate, contact, captain, super_admin, team, classroom,
+            gcs_path, file_size
+        ) = self.create_for_post(filename)
+
+        for params in ({'team_id': team.uid},
+                       {'classroom_id': classroom.uid}):
+            params['filename'] = filename
+            response = self.testapp.post(
+                '/api/reports',
+                params,
+                upload_files=[('file', filename)],
+                headers=self.login_headers(super_admin),
+            )
+            fetched = Report.get_by_id(json.loads(response.body)['uid'])
+            self.assertEqual(str(fetched.gcs_path), gcs_path)
+            self.assertEqual(fetched.size, file_size)
+
+        os.unlink(filename)
+
+        self.assertEqual(
+            counters.get('report_uploads', ['files_written', 'bytes_written',
+                                            'files_deduplicated',
+                                            'bytes_deduplicated']),
+            {
+                'files_written': 1,
+                'bytes_written': file_size,
+                'files_deduplicated': 1,
+                'bytes_deduplicated': file_size,
+            },
+        )
+
     def test_post_class_dataset(self):
         today_str = datetime.date.today().strftime(config.iso_date_format)
         filename = 'Classroom_filewhack.{}.html'.format(today_str)
@@ -619,7 +674,12 @@ class TestApiReports(ConsistencyTestCase):
             response.headers['Content-Type'],
             'application/pdf',
         )
-        self.assertEqual(len(response.body), report_dict['size'])
+        # App Engine fills in the body from GCS.
+        self.assertEqual(
+            response.headers[blobstore.BLOB_KEY_HEADER],
+            str(blobstore.create_gs_key('/gs' + report_dict['gcs_path'])),
+        )
+        self.assertEqual(response.body, '')
 
     def test_get_pdf_super_allowed(self):
         """Can get a report, even without a token, if you're a super."""
@@ -670,6 +730,71 @@ class TestApiReports(ConsistencyTestCase):
 
         self.assert_pdf_response(report_dict, response)
 
+    def test_get_pdf_not_modified(self):
+        """Clients with the current file get a 304."""
+        (
+            other, teammate, contact, captain, super_admin, team, classroom,
+            report_dict
+        ) = self.test_post_team_pdf()
+        url = '/api/teams/{team_id}/reports/{filename}'.format(
+            team_id=team.uid,
+            filename=report_dict['filename'],
+        )
+
+        response = self.testapp.get(url, headers=self.login_headers(super_admin))
+        etag = response.headers['ETag']
+        self.assertEqual(etag, '"{}"'.format(
+            report_dict['gcs_path'].split('/')[-1]))
+
+        headers = dict(self.login_headers(super_admin), **{
+            'If-None-Match': etag})
+        response = self.testapp.get(url, headers=headers, status=304)
+        self.assertEqual(response.body, '')
+
+        # A different version gets the whole file.
+        headers['If-None-Match'] = '"{}"'.format('0' * 32)
+        response = self.testapp.get(url, headers=headers)
+        self.assert_pdf_response(report_dict, response)
+
+    def test_get_pdf_range(self):
+        """Clients can ask for part of the file."""
+        (
+            other, teammate, contact, captain, super_admin, team, classroom,
+            report_dict
+        ) = self.test_post_team_pdf()
+        url = '/api/teams/{team_id}/reports/{filename}'.format(
+            team_id=team.uid,
+            filename=report_dict['filename'],
+        )
+        size = report_dict['size']
+
+        def get_range(range_header, status, **extra):
+            headers = dict(self.login_headers(super_admin), Range=range_header,
+                           **extra)
+            return self.testapp.get(url, headers=headers, status=status)
+
+        # App Engine serves these ranges of the file, with a 206.
+        for range_header in ('bytes=0-3', 'bytes=4-', 'bytes=-5'):
+            response = get_range(range_header, 200)
+            self.assertEqual(
+                response.headers[blobstore.BLOB_RANGE_HEADER], range_header)
+            self.assert_pdf_response(report_dict, response)
+
+        response = get_range('bytes={}-'.format(size), 416)
+        self.assertEqual(response.headers['Content-Range'],
+                         'bytes */{}'.format(size))
+
+        # Invalid ranges, and ranges of an old version, get the whole file.
+        for range_header, extra in (
+            ('bytes=-', {}),
+            ('bytes=5-3', {}),
+            ('bytes=0-3,5-7', {}),
+            ('bytes=0-3', {'If-Range': '"{}"'.format('0' * 32)}),
+        ):
+            response = get_range(range_header, 200, **extra)
+            self.assertNotIn(blobstore.BLOB_RANGE_HEADER, response.headers)
+            self.assert_pdf_response(report_dict, response)
+
     def test_put_forbidden(self):
         (other, teammate, contact, captain, super_admin, team, classroom,
             classReport1, classReport2, teamReport) = self.create_reports()
@@ -801,3 +926,101 @@ class TestApiReports(ConsistencyTestCase):
         reports = Report.get()
         self.assertEqual(len(reports), 3)
         self.assertEqual(all(r.template == 'empty' for r in reports), True)
+
+    def test_batch_post(self):
+        """RServe can save many reports in one request."""
+        rserve_user = User.create(
+            id='rserve', email='rserve@perts.net', user_type='super_admin',
+        )
+        rserve_user.put()
+
+        org = Organization.create(
+            name='Organization', captain_id='User_cap',
+            program_id=self.program.uid
+        )
+        org.put()
+        team = Team.create(
+            name='Team Foo', captain_id='User_cap', organization_ids=[org.uid],
+            program_id=self.program.uid,
+        )
+        team.put()
+        classroom = Classroom.create(
+            name='Class foo', team_id=team.uid, code='trout viper',
+            contact_id='User_contact'
+        )
+        classroom.put()
+
+        report_date = datetime.date.today().strftime('%Y-%m-%d')
+        # An existing report, which should be updated rather than duplicated.
+        existing = Report.create(
+            team_id=team.uid,
+            filename='{}.html'.format(report_date),
+            template='empty',
+        )
+        existing.put()
+
+        records = [
+            dict(self.empty_report_params(report_date, org.uid),
+                 organization_id=org.uid),
+            dict(self.empty_report_params(report_date, team.uid),
+                 team_id=team.uid, template='team.html'),
+            dict(self.empty_report_params(report_date, classroom.uid),
+                 classroom_id=classroom.uid),
+            dict(self.empty_report_params(report_date, 'Team_missing'),
+                 team_id='Team_missing'),
+        ]
+
+        response = self.testapp.post_json(
+            '/api/reports/batch',
+            records,
+            headers=self.login_headers(rserve_user),
+        )
+        results = json.loads(response.body)
+
+        self.assertEqual([r['status'] for r in results], [200, 200, 200, 400])
+        self.assertIn('Team_missing', results[3]['error'])
+        self.assertEqual(results[1]['uid'], existing.uid)
+
+        reports = Report.get(n=float('inf'))
+        self.assertEqual(len(reports), 3)
+        self.assertEqual(Report.get_by_id(existing.uid).template, 'team.html')
+        class_report = Report.get_by_id(results[2]['uid'])
+        self.assertEqual(class_report.classroom_id, classroom.uid)
+        self.assertEqual(class_report.team_id, team.uid)
+
+        # The same records as ndjson are idempotent, and bad lines don't stop
+        # the others.
+        body = '\n'.join([json.dumps(r) for r in records[:3]] + ['{oops'])
+        response = self.testapp.post(
+            '/api/reports/batch',
+            body,
+            headers=self.login_headers(rserve_user),
+            content_type='application/x-ndjson',
+        )
+        results = json.loads(response.body)
+        self.assertEqual([r['status'] for r in results], [200, 200, 200, 400])
+        self.assertEqual(len(Report.get(n=float('inf'))), 3)
+
+        # Preview is read as a boolean, not by truthiness.
+        response = self.testapp.post_json(
+            '/api/reports/batch',
+            [dict(records[0], preview='false'),
+             dict(records[1], preview=True),
+             dict(records[2], preview='maybe')],
+            headers=self.login_headers(rserve_user),
+        )
+        results = json.loads(response.body)
+        self.assertEqual([r['status'] for r in results], [200, 200, 400])
+        self.assertFalse(Report.get_by_id(results[0]['uid']).preview)
+        self.assertTrue(Report.get_by_id(results[1]['uid']).preview)
+
+    def test_batch_post_forbidden(self):
+        (other, teammate, contact, captain, super_admin, team,
+            classroom) = self.create()
+
+        self.testapp.post_json(
+            '/api/reports/batch',
+            [],
+            headers=self.login_headers(captain),
+            status=403,
+        )
@@ -1,5 +1,7 @@
 """Tests /api/responses[/:id] and /api/teams/:team_id/responses[/:id]"""
 
+import StringIO
+import csv
 import datetime
 import json
 import logging
@@ -7,7 +9,25 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Classroom, Cycle, Organization, Program, Response, Team, User
+from model import (
+    Classroom,
+    Cycle,
+    JSON_TEXT_MAX,
+    JSON_TEXT_VALUE_MAX,
+    NetworkClosure,
+    Organization,
+    Program,
+    Response,
+    ResponseBackup,
+    ResponseBodyKey,
+    ResponseHistory,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase, jwt_headers
 import config
 import mysql_connection
@@ -47,11 +67,18 @@ class TestApiResponses(ConsistencyTestCase):
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'response': Response.get_table_definition(),
+                'response_body_key': ResponseBodyKey.get_table_definition(),
+                'response_history': ResponseHistory.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
@@ -251,6 +278,80 @@ class TestApiResponses(ConsistencyTestCase):
         for r in response_list:
             self.assertGreater(len(r['body']), 0)
 
+    def export(self, parent_id, user, status=200, query=''):
+        return self.testapp.get(
+            '/api/{}s/{}/responses/export{}'.format(
+                Response.get_kind(parent_id).lower(), parent_id, query),
+            headers=jwt_headers(user),
+            status=status,
+        )
+
+    def test_export(self):
+        other, teammate, team, cycles, responses = self.create()
+
+        self.export(team.uid, other, status=403)
+        self.export(cycles[0].uid, other, status=403)
+        self.export(self.program.uid, teammate, status=403)
+
+        result = self.export(team.uid, teammate)
+        self.assertEqual(result.content_type, 'application/x-ndjson')
+        exported = {d['uid']: d for d in
+                    (json.loads(l) for l in result.body.splitlines())}
+
+        # Redacted as when listing the team's responses.
+        listed = self.testapp.get(
+            '/api/teams/{}/responses'.format(team.uid),
+            headers=jwt_headers(teammate),
+        ).json
+        self.assertEqual(exported, {d['uid']: d for d in listed})
+        self.assertEqual(exported[responses['user_team_other'].uid]['body'],
+                         {})
+
+        # Cycles have their own user-level responses.
+        result = self.export(cycles[0].uid, teammate)
+        self.assertEqual(
+            sorted(json.loads(l)['uid'] for l in result.body.splitlines()),
+            sorted([responses['user_team_user1'].uid,
+                    responses['user_team_other'].uid]),
+        )
+
+        # Programs are all responses of their teams, for super admins.
+        admin = User.create(email='super@admin.com', name="Super",
+                            user_type='super_admin')
+        admin.put()
+        result = self.export(self.program.uid, admin, query='?format=csv')
+        self.assertEqual(result.content_type, 'text/csv')
+        rows = list(csv.DictReader(StringIO.StringIO(result.body)))
+        self.assertEqual(len(rows), 4)
+        for row in rows:
+            self.assertEqual(json.loads(row['body']), self.default_body())
+
+    def test_export_modified_since(self):
+        other, teammate, team, cycles, responses = self.create()
+
+        old = responses['user_team_user1']
+        with mysql_connection.connect() as sql:
+            sql.update_row(Response.table, 'uid', old.uid,
+                           modified=datetime.datetime(2019, 1, 1))
+
+        since = '2019-01-01T00:00:01Z'
+        result = self.export(team.uid, teammate,
+                             query='?modified_since={}'.format(since))
+        uids = [json.loads(l)['uid'] for l in result.body.splitlines()]
+        self.assertEqual(len(uids), 3)
+        self.assertNotIn(old.uid, uids)
+
+        # Ordered by modified, so everything is sent from the earliest.
+        result = self.export(team.uid, teammate,
+                             query='?modified_since=2019-01-01T00:00:00Z')
+        uids = [json.loads(l)['uid'] for l in result.body.splitlines()]
+        self.assertEqual(uids[0], old.uid)
+        self.assertEqual(len(uids), 4)
+
+        self.export(team.uid, teammate, status=400,
+                    query='?modified_since=yesterday')
+        self.export(team.uid, teammate, status=400, query='?format=xml')
+
     def test_get_requires_auth(self):
         self.testapp.get('/api/responses', status=401)
 
@@ -675,6 +776,130 @@ class TestApiResponses(ConsistencyTestCase):
             self.assertEqual(info['value'], fetched.body[k]['value'])
             self.assertTrue(fetched.body[k]['modified'] >= now)
 
+    def test_patch(self):
+        other, teammate, team, cycles, responses = self.create()
+        response_id = responses['team_team'].uid
+        ops = [
+            {'op': 'set', 'key': 'question', 'value': 'changed',
+             'modified': '2019-01-01T00:00:00Z'},
+            {'op': 'set', 'key': 'question_new', 'value': 'foo',
+             'modified': None},
+        ]
+
+        # Forbidden to patch other teams' responses.
+        self.testapp.patch_json(
+            '/api/responses/{}'.format(responses['team_other'].uid),
+            ops,
+            headers=jwt_headers(teammate),
+            status=403,
+        )
+
+        result = self.testapp.patch_json(
+            '/api/responses/{}'.format(response_id),
+            ops,
+            headers=jwt_headers(teammate),
+        ).json
+
+        # Only changed keys and their timestamps come back.
+        self.assertEqual(result['uid'], response_id)
+        self.assertEqual(set(result['body'].keys()),
+                         {'question', 'question_new'})
+
+        fetched = Response.get_by_id(response_id)
+        self.assertEqual(fetched.body['question']['value'], 'changed')
+        self.assertEqual(fetched.body['question_new']['value'], 'foo')
+        for k, modified in result['body'].items():
+            self.assertEqual(fetched.body[k]['modified'], modified)
+
+        # Removing a key needs its current timestamp.
+        self.testapp.patch_json(
+            '/api/responses/{}'.format(response_id),
+            [{'op': 'remove', 'key': 'question_new',
+              'modified': '2019-01-01T00:00:00Z'}],
+            headers=jwt_headers(teammate),
+            status=409,
+        )
+        result = self.testapp.patch_json(
+            '/api/responses/{}'.format(response_id),
+            [{'op': 'remove', 'key': 'question_new',
+              'modified': result['body']['question_new']}],
+            headers=jwt_headers(teammate),
+        ).json
+        self.assertEqual(result['body'], {'question_new': None})
+        self.assertNotIn('question_new',
+                         Response.get_by_id(response_id).body)
+
+    def test_patch_conflict(self):
+        other, teammate, team, cycles, responses = self.create()
+        response_id = responses['team_team'].uid
+
+        self.testapp.patch_json(
+            '/api/responses/{}'.format(response_id),
+            [
+                # based on stale data
+                {'op': 'set', 'key': 'question', 'value': 'bar',
+                 'modified': '2000-01-01T00:00:00Z'},
+                # this should be ignored b/c of above
+                {'op': 'set', 'key': 'question_new', 'value': 'foo',
+                 'modified': None},
+            ],
+            headers=jwt_headers(teammate),
+            status=409,
+        )
+
+        # Whole patch is rejected, body unchanged.
+        fetched = Response.get_by_id(response_id)
+        self.assertEqual(responses['team_team'].body, fetched.body)
+
+        # Invalid operations.
+        self.testapp.patch_json(
+            '/api/responses/{}'.format(response_id),
+            [{'op': 'replace', 'key': 'question', 'value': 'bar'}],
+            headers=jwt_headers(teammate),
+            status=400,
+        )
+
+    def test_history(self):
+        other, teammate, team, cycles, responses = self.create()
+        response_id = responses['team_team'].uid
+        url = '/api/responses/{}/history'.format(response_id)
+
+        # Nothing recorded yet.
+        self.testapp.get(url, headers=jwt_headers(teammate), status=404)
+
+        ResponseBackup.drain()
+        before_patch = datetime.datetime.now()
+        self.testapp.patch_json(
+            '/api/responses/{}'.format(response_id),
+            [{'op': 'set', 'key': 'question', 'value': 'changed',
+              'modified': '2019-01-01T00:00:00Z'}],
+            headers=jwt_headers(teammate),
+        )
+        ResponseBackup.drain()
+
+        # Forbidden to see other teams' history.
+        self.testapp.get(
+            '/api/responses/{}/history'.format(responses['team_other'].uid),
+            headers=jwt_headers(teammate),
+            status=403,
+        )
+
+        self.testapp.get(url, params={'at': 'foo'},
+                         headers=jwt_headers(teammate), status=400)
+
+        result = self.testapp.get(
+            url,
+            params={'at': ResponseHistory.format_time(before_patch)},
+            headers=jwt_headers(teammate),
+        ).json
+        self.assertEqual(result['uid'], response_id)
+        self.assertTrue(self.body_values_match(
+            result['body'], self.default_body()))
+
+        # Defaults to now.
+        result = self.testapp.get(url, headers=jwt_headers(teammate)).json
+        self.assertEqual(result['body']['question']['value'], 'changed')
+
     def test_delete(self):
         other, teammate, team, cycles, responses = self.create()
 
@@ -769,3 +994,34 @@ class TestApiResponses(ConsistencyTestCase):
         fetched_body = Response.get_by_id(resp_dict['uid']).body
         self.assertEqual(fetched_body.keys(), ['safe'])
         self.assertEqual(fetched_body['safe']['value'], 'data')
+
+    def test_body_too_long_in_total(self):
+        """Each save is small, but together they'd overflow the body."""
+        other, teammate, team, cycles, responses = self.create()
+        url = '/api/responses/{}'.format(responses['team_team'].uid)
+
+        # Somewhat more than half the limit at a time.
+        value_length = min(JSON_TEXT_VALUE_MAX, JSON_TEXT_MAX) // 2
+        num_keys = max(int(0.6 * JSON_TEXT_MAX / value_length), 1)
+
+        def half(prefix):
+            return {'{}{}'.format(prefix, x): {'value': 'x' * value_length}
+                    for x in range(num_keys)}
+
+        self.testapp.put_json(url, {'body': half('a')},
+                              headers=jwt_headers(teammate))
+        self.testapp.put_json(url, {'body': half('b')},
+                              headers=jwt_headers(teammate), status=413)
+        self.testapp.patch_json(
+            url,
+            [{'op': 'set', 'key': k, 'value': v['value'], 'modified': None}
+             for k, v in half('c').items()],
+            headers=jwt_headers(teammate),
+            status=413,
+        )
+
+        body = Response.get_by_id(responses['team_team'].uid).body
+        self.assertFalse([k for k in body
+                          if k.startswith('b') or k.startswith('c')])
+        # The whole body still fits where it's copied.
+        Response.get_by_id(responses['team_team'].uid).put()
@@ -9,7 +9,20 @@ import webapp2
 import webtest
 
 from api_handlers import api_routes
-from model import Classroom, Email, Metric, Program, Survey, Team, User
+from model import (
+    Classroom,
+    Email,
+    Metric,
+    NetworkClosure,
+    Program,
+    Survey,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import config
 import json
@@ -45,10 +58,15 @@ class TestApiSurveys(ConsistencyTestCase):
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
                 'metric': Metric.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'survey': Survey.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.ep_program = Program.create(
@@ -12,7 +12,20 @@ import webtest
 
 from api_handlers import api_routes
 from model import (
-    Classroom, Cycle, Email, Program, Organization, Report, Survey, Team, User
+    Classroom,
+    Cycle,
+    Email,
+    NetworkClosure,
+    Organization,
+    Program,
+    Report,
+    Survey,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
 )
 from unit_test_helper import ConsistencyTestCase
 import config
@@ -49,12 +62,17 @@ class TestApiTeams(ConsistencyTestCase):
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'report': Report.get_table_definition(),
                 'survey': Survey.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         # See #848. Remove once resolved.
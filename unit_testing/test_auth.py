@@ -4,7 +4,17 @@ import logging
 import webapp2
 import webtest
 
-from model import Classroom, Program, Team, User
+from model import (
+    Classroom,
+    NetworkClosure,
+    Program,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 
@@ -17,9 +27,14 @@ class TestAuth(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
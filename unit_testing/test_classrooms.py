@@ -3,7 +3,14 @@
 import logging
 import unittest
 
-from model import User, Classroom
+from model import (
+    Classroom,
+    NetworkClosure,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 import util
@@ -18,8 +25,12 @@ class TestClassrooms(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'network_closure': NetworkClosure.get_table_definition(),
                 'user': User.get_table_definition(),
                 'classroom': Classroom.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def test_client_dict_has_default_contact_name(self):
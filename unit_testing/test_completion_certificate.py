@@ -0,0 +1,85 @@
+"""Test the completion certificate's participation lookups."""
+
+from google.appengine.api import urlfetch
+from mock import patch
+import datetime
+
+from model import Classroom, Cycle, Team, User, UserTeam
+from neptune_stand_in import NeptuneStandIn
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+import view_handlers
+
+
+class TestCompletionCertificate(ConsistencyTestCase):
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestCompletionCertificate, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'classroom': Classroom.get_table_definition(),
+                'cycle': Cycle.get_table_definition(),
+                'team': Team.get_table_definition(),
+                'user': User.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
+            })
+
+    def create(self):
+        team = Team.create(name='Team Foo', program_id='Program_foo',
+                           captain_id='User_captain')
+        classrooms = [
+            Classroom.create(name='Class A', team_id=team.uid, num_students=5,
+                             contact_id='User_contact', code='foo'),
+            Classroom.create(name='Class B', team_id=team.uid, num_students=5,
+                             contact_id='User_contact', code='bar'),
+        ]
+        cycles = [
+            Cycle.create(
+                team_id=team.uid,
+                ordinal=x + 1,
+                start_date=datetime.date(2000, x + 1, 1),
+                end_date=datetime.date(2000, x + 1, 28),
+            )
+            for x in range(4)
+        ]
+        # Cycles without dates can't have participation.
+        cycles.append(Cycle.create(team_id=team.uid, ordinal=5))
+        return classrooms, cycles
+
+    def get_pct(self, neptune, classrooms, cycles):
+        with patch.object(urlfetch, 'create_rpc',
+                          side_effect=neptune.create_rpc), \
+                patch.object(urlfetch, 'make_fetch_call',
+                             side_effect=neptune.make_fetch_call):
+            handler = view_handlers.CompletionCertificate()
+            return handler.get_cycle_participation_pct(cycles, classrooms)
+
+    def test_cycle_participation(self):
+        classrooms, cycles = self.create()
+        neptune = NeptuneStandIn({'foo': 4, 'bar': 4})
+
+        pct = self.get_pct(neptune, classrooms, cycles)
+
+        self.assertEqual(
+            pct,
+            [{'ordinal': x + 1, 'pct': 80} for x in range(4)] +
+            [{'ordinal': 5, 'pct': 0}],
+        )
+        # One call per dated cycle, all with the same token.
+        self.assertEqual(len(neptune.requests), 4)
+        self.assertEqual(len(set(neptune.tokens)), 1)
+
+    def test_participation_memoized(self):
+        classrooms, cycles = self.create()
+        neptune = NeptuneStandIn({'foo': 4, 'bar': 4})
+
+        self.get_pct(neptune, classrooms, cycles)
+        self.get_pct(neptune, classrooms, cycles)
+        self.assertEqual(len(neptune.requests), 4)
+
+        # A different set of classrooms isn't cached.
+        self.get_pct(neptune, classrooms[:1], cycles)
+        self.assertEqual(len(neptune.requests), 8)
+
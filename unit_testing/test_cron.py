@@ -2,6 +2,7 @@
 
 from google.appengine.api import memcache
 from google.appengine.ext import testbed
+from mock import patch
 import datetime
 import json
 import logging
@@ -11,7 +12,20 @@ import webapp2
 import webtest
 
 from cron_handlers import cron_routes
-from model import Classroom, Organization, Program, Report, Team, User
+from model import (
+    Classroom,
+    NetworkClosure,
+    Organization,
+    Program,
+    Report,
+    ResponseHistory,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import cron_rserve
 import mysql_connection
@@ -27,11 +41,16 @@ class TestCron(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'report': Report.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         application = webapp2.WSGIApplication(
@@ -192,6 +211,11 @@ class TestCron(ConsistencyTestCase):
                           issue_date=week),
             Report.create(parent_id=cl_to_skip.uid, filename="foo",
                           issue_date=week),
+            # Reports from other weeks don't count.
+            Report.create(parent_id=team.uid, filename="bar",
+                          issue_date='2000-01-03'),
+            Report.create(parent_id=cl.uid, filename="bar",
+                          issue_date='2000-01-03'),
         ])
 
         # Skips all the parents who have reports already this week.
@@ -233,6 +257,44 @@ class TestCron(ConsistencyTestCase):
             {classroom1.uid, classroom2.uid},
         )
 
+    def test_rserve_batches(self):
+        """Can split reporting units into tasks."""
+        team = Team.create(name='Team Foo', captain_id='User_captain',
+                           program_id=self.ep_program.uid)
+        team.put()
+        Classroom.put_multi([
+            Classroom.create(name='Classroom {}'.format(x), team_id=team.uid,
+                             contact_id='User_contact',
+                             code='foo {}'.format(x))
+            for x in range(4)
+        ])
+
+        response = self.testapp.get(
+            '/cron/rserve/reports/ep?batch_size=2&send_email=false')
+        self.assertEqual(json.loads(response.body), {'tasks': 3})
+
+        # On their own queue, which limits retries, see queue.yaml.
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            queue_names=[cron_rserve.queue_name])
+        self.assertEqual(len(tasks), 3)
+        self.assertEqual(
+            sorted(len(json.loads(t.payload)) for t in tasks),
+            [1, 2, 2],
+        )
+        ids = set(ru['id'] for t in tasks for ru in json.loads(t.payload))
+        self.assertEqual(len(ids), 5)
+        for t in tasks:
+            self.assertEqual(
+                t.url, '/task/rserve_reports/ep?send_email=false')
+            # Secrets stay out of the queue.
+            self.assertNotIn('credentials', t.payload)
+
+    def test_rserve_invalid_batch_size(self):
+        self.testapp.get('/cron/rserve/reports/ep?batch_size=foo',
+                         status=400)
+        self.assertEqual(self.taskqueue_stub.get_filtered_tasks(
+            queue_names=[cron_rserve.queue_name]), [])
+
     def test_rserve_email_override(self):
         """Can request that emails are not sent."""
         team = Team.create(name='Team Foo', captain_id='User_captain',
@@ -280,3 +342,13 @@ class TestCron(ConsistencyTestCase):
         scheme, netloc, path, query_string, fragment = urlparse.urlsplit(url)
         logging.info(path)
         self.assertEqual('/api/scripts/ep', path)
+
+    def test_compact_response_history_limited(self):
+        summary = {'responses': 0, 'rows_removed': 0, 'snapshots': 0}
+        with patch.object(ResponseHistory, 'compact',
+                          return_value=summary) as compact:
+            response = self.testapp.get('/cron/compact_response_history')
+
+        compact.assert_called_once_with(
+            max_responses=ResponseHistory.max_responses_per_compact)
+        self.assertEqual(json.loads(response.body), summary)
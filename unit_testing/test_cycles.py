@@ -5,7 +5,20 @@ import logging
 from datetime import date, datetime, timedelta
 
 from task_handlers import TeamCycleEmails
-from model import Classroom, Cycle, Program, Response, Survey, Team, User
+from model import (
+    Classroom,
+    Cycle,
+    NetworkClosure,
+    Program,
+    Response,
+    Survey,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 import util
@@ -21,9 +34,14 @@ class TestCycles(ConsistencyTestCase):
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def test_reorders(self):
@@ -0,0 +1,155 @@
+"""Test the request-scoped cache of SqlModel.get_by_id()."""
+
+import json
+import webapp2
+import webtest
+
+from model import (Classroom, Team, User, UserNetwork, UserOrganization,
+                   UserTeam, identity_map)
+from model.identity_map import RequestScopeMiddleware
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+
+
+class AddStudents(webapp2.RequestHandler):
+    """Reads a classroom before and after a raw sql update to it."""
+    def get(self, classroom_id):
+        before = Classroom.get_by_id(classroom_id)
+        Classroom.add_num_students({classroom_id: 2})
+        after = Classroom.get_by_id(classroom_id)
+        self.response.write(json.dumps({
+            'active': identity_map.is_active(),
+            'before': before.num_students,
+            'after': after.num_students,
+        }))
+
+
+class ChangeUid(webapp2.RequestHandler):
+    """Reads a user's old and new ids before and after changing them."""
+    def get(self, old_id, new_id):
+        user = User.get_by_id(old_id)
+        User.get_by_id(new_id)  # remembered as missing
+        User.resolve_id_mismatch(user, new_id)
+        new_user = User.get_by_id(new_id)
+        self.response.write(json.dumps({
+            'active': identity_map.is_active(),
+            'old': User.get_by_id(old_id) is not None,
+            'new': new_user.uid if new_user else None,
+        }))
+
+
+class TestIdentityMap(ConsistencyTestCase):
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestIdentityMap, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'classroom': Classroom.get_table_definition(),
+                'team': Team.get_table_definition(),
+                'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
+            })
+
+    def test_inactive_outside_request(self):
+        user = User.create(email="user@perts.net")
+        user.put()
+
+        self.assertFalse(identity_map.is_active())
+        self.assertIsNot(User.get_by_id(user.uid), User.get_by_id(user.uid))
+
+    def test_repeat_lookup_hits(self):
+        user = User.create(email="user@perts.net")
+        user.put()
+
+        with identity_map.request_scope():
+            first = User.get_by_id(user.uid)
+            second = User.get_by_id(user.uid)
+            # Short uids map to the same entity.
+            third = User.get_by_id(User.convert_uid(user.uid))
+            stats = identity_map.stats()
+
+        self.assertIs(first, second)
+        self.assertIs(first, third)
+        self.assertEqual(stats, {'hits': 2, 'misses': 1})
+
+    def test_missing_id_remembered(self):
+        with identity_map.request_scope():
+            self.assertIsNone(User.get_by_id('User_dne'))
+            self.assertIsNone(User.get_by_id('User_dne'))
+            stats = identity_map.stats()
+
+        self.assertEqual(stats, {'hits': 1, 'misses': 1})
+
+    def test_multi_lookup_fetches_only_unknown(self):
+        user1 = User.create(email="user1@perts.net")
+        user2 = User.create(email="user2@perts.net")
+        User.put_multi([user1, user2])
+
+        with identity_map.request_scope():
+            User.get_by_id(user1.uid)
+            fetched = User.get_by_id([user1.uid, user2.uid, 'User_dne'])
+            stats = identity_map.stats()
+
+        self.assertEqual(set(fetched), {user1, user2})
+        self.assertEqual(stats, {'hits': 1, 'misses': 3})
+
+    def test_multi_lookup_in_order(self):
+        users = [User.create(email="user{}@perts.net".format(x))
+                 for x in range(4)]
+        User.put_multi(users)
+        ids = [u.uid for u in reversed(users)]
+
+        with identity_map.request_scope():
+            # Some known, some not.
+            User.get_by_id([users[0].uid, users[2].uid])
+            fetched = User.get_by_id(ids + [users[3].short_uid])
+
+        self.assertEqual([u.uid for u in fetched], ids)
+
+    def test_put_evicts(self):
+        user = User.create(email="user@perts.net", name="Before")
+        user.put()
+
+        with identity_map.request_scope():
+            fetched = User.get_by_id(user.uid)
+            user.name = "After"
+            user.put()
+            refetched = User.get_by_id(user.uid)
+
+        self.assertIsNot(fetched, refetched)
+        self.assertEqual(refetched.name, "After")
+
+    def test_delete_evicts(self):
+        user = User.create(email="user@perts.net")
+        user.put()
+
+        with identity_map.request_scope():
+            User.get_by_id(user.uid)
+            User.delete_multi([user])
+            self.assertIsNone(User.get_by_id(user.uid))
+
+    def test_handlers_see_raw_sql_writes(self):
+        """Writes that bypass put() still evict, within a request."""
+        app = webtest.TestApp(RequestScopeMiddleware(webapp2.WSGIApplication([
+            ('/add_students/(.*)', AddStudents),
+            ('/change_uid/(.*)/(.*)', ChangeUid),
+        ])))
+
+        classroom = Classroom.create(name='Classroom', team_id='Team_foo',
+                                     contact_id='User_foo', code='trout viper')
+        classroom.put()
+        result = json.loads(
+            app.get('/add_students/{}'.format(classroom.uid)).body)
+        self.assertEqual(result, {'active': True, 'before': 0, 'after': 2})
+        self.assertFalse(identity_map.is_active())
+
+        user = User.create(email="user@perts.net")
+        user.put()
+        result = json.loads(
+            app.get('/change_uid/{}/User_new'.format(user.uid)).body)
+        self.assertEqual(
+            result, {'active': True, 'old': False, 'new': 'User_new'})
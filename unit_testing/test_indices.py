@@ -0,0 +1,120 @@
+"""Test that common queries use indices rather than full table scans."""
+
+from mock import patch
+
+from model import (Classroom, Team, TeamOrganization, User, UserTeam,
+                   keyset)
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+import schema_check
+
+
+class RecordQueries(object):
+    """Stands in for mysql_connection.connect(), recording select queries.
+
+    Model methods build their own sql, so recording it is the only way to
+    test the query they really run.
+    """
+    def __init__(self, queries, connect):
+        self.queries = queries
+        self.connection = connect()
+
+    def __enter__(self):
+        self.sql = self.connection.__enter__()
+        select_query = self.sql.select_query
+
+        def recording_select_query(query, params=tuple(), *args, **kwargs):
+            self.queries.append((query, params))
+            return select_query(query, params, *args, **kwargs)
+
+        self.sql.select_query = recording_select_query
+        return self.sql
+
+    def __exit__(self, *args):
+        del self.sql.select_query
+        return self.connection.__exit__(*args)
+
+
+class TestIndices(ConsistencyTestCase):
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestIndices, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'classroom': Classroom.get_table_definition(),
+                'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
+                'user': User.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
+            })
+
+        # With only a row or two, MySQL may prefer to scan anyway.
+        teams = [
+            Team.create(name="Team {}".format(x),
+                        program_id='Program_00{}'.format(x % 3),
+                        captain_id='User_00{}'.format(x % 5))
+            for x in range(30)
+        ]
+        classrooms = [
+            Classroom.create(name="Class {}".format(x),
+                             code='trout viper {}'.format(x),
+                             team_id=teams[x % 30].uid,
+                             contact_id='User_00{}'.format(x % 7))
+            for x in range(90)
+        ]
+        Team.put_multi(teams)
+        Classroom.put_multi(classrooms)
+        self.team_id = teams[0].uid
+
+    def record_queries(self, f):
+        """List of (query, params) that calling f selects with."""
+        queries = []
+        connect = mysql_connection.connect
+        with patch.object(mysql_connection, 'connect',
+                          side_effect=lambda: RecordQueries(queries, connect)):
+            f()
+        return queries
+
+    def assert_no_full_scans(self, name, f):
+        queries = self.record_queries(f)
+        self.assertTrue(queries, "{} didn't query the db.".format(name))
+
+        with mysql_connection.connect() as sql:
+            for query, params in queries:
+                for row in sql.select_query('EXPLAIN ' + query, params):
+                    self.assertNotEqual(
+                        row['type'], 'ALL',
+                        "{} scans all of `{}`: {}".format(
+                            name, row['table'], query),
+                    )
+
+    def test_no_full_scans(self):
+        # Model methods that run often enough to need an index.
+        _, cursor = keyset.get_page(Classroom, {'team_id': self.team_id},
+                                    order='name', n=1)
+        methods = {
+            'Classroom.get(team_id=)':
+                lambda: Classroom.get(team_id=self.team_id),
+            'Classroom.get(contact_id=)':
+                lambda: Classroom.get(contact_id='User_001'),
+            'Classroom.get_by_code':
+                lambda: Classroom.get_by_code('trout viper 1'),
+            'Classroom.query_by_teams':
+                lambda: Classroom.query_by_teams([self.team_id, 'Team_002']),
+            'Classroom.get_by_program':
+                lambda: Classroom.get_by_program('Program_001'),
+            'keyset.get_page(Classroom, team_id=, order=name)':
+                lambda: keyset.get_page(Classroom, {'team_id': self.team_id},
+                                        order='name', cursor=cursor),
+            'Team.get(program_id=)':
+                lambda: Team.get(program_id='Program_001'),
+            'Team.get(captain_id=)':
+                lambda: Team.get(captain_id='User_001'),
+        }
+        for name, f in methods.items():
+            self.assert_no_full_scans(name, f)
+
+    def test_declared_indices_exist(self):
+        self.assertEqual(schema_check.diff_indices([Classroom, Team]), [])
@@ -0,0 +1,104 @@
+"""Test paging through tables with keyset cursors."""
+
+import datetime
+
+from model import (Classroom, Cycle, Team, TeamOrganization, UserTeam,
+                   keyset)
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+
+
+class TestKeyset(ConsistencyTestCase):
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestKeyset, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'classroom': Classroom.get_table_definition(),
+                'cycle': Cycle.get_table_definition(),
+                'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
+            })
+
+        # Duplicate names, so uid has to break ties.
+        self.teams = [
+            Team.create(name='Team {}'.format(x % 4),
+                        program_id='Program_00{}'.format(x % 2),
+                        captain_id='User_001')
+            for x in range(10)
+        ]
+        Team.put_multi(self.teams)
+
+    def test_walk(self):
+        walked = list(keyset.walk(Team, n=3))
+        # Each exactly once.
+        self.assertEqual(sorted(t.uid for t in walked),
+                         sorted(t.uid for t in self.teams))
+
+    def test_pages(self):
+        pages = list(keyset.pages(Team, {'program_id': 'Program_001'}, n=2))
+        self.assertEqual([len(p) for p in pages], [2, 2, 1])
+        for page in pages:
+            for team in page:
+                self.assertEqual(team.program_id, 'Program_001')
+
+        # Lists match any value.
+        where = {'program_id': ['Program_000', 'Program_001']}
+        self.assertEqual(len(list(keyset.walk(Team, where, n=4))), 10)
+        self.assertEqual(list(keyset.walk(Team, {'program_id': []})), [])
+
+    def test_order(self):
+        walked = list(keyset.walk(Team, order='-name', n=3))
+        self.assertEqual([t.name for t in walked],
+                         sorted([t.name for t in self.teams], reverse=True))
+        self.assertEqual(sorted(t.uid for t in walked),
+                         sorted(t.uid for t in self.teams))
+
+        with self.assertRaises(ValueError):
+            keyset.get_page(Team, order='dne')
+
+    def test_cursor(self):
+        page, cursor = keyset.get_page(Team, order='name', n=4)
+        self.assertEqual(len(page), 4)
+
+        next_page, next_cursor = keyset.get_page(Team, order='name',
+                                                 cursor=cursor, n=4)
+        self.assertEqual(len(next_page), 4)
+        self.assertGreaterEqual(next_page[0].name, page[-1].name)
+        self.assertFalse(set(t.uid for t in page) &
+                         set(t.uid for t in next_page))
+
+        # Cursors are only good for the order they came from.
+        for bad_cursor in ('foo', keyset.encode_cursor(['x'])):
+            with self.assertRaises(keyset.InvalidCursor):
+                keyset.get_page(Team, order='name', cursor=bad_cursor)
+
+    def test_date_order(self):
+        # Duplicate dates, so uid has to break ties, and a NULL, which pages
+        # as the earliest date.
+        cycles = [
+            Cycle.create(team_id='Team_001', ordinal=x + 1,
+                         start_date=datetime.date(2019, 1, 1 + x // 2),
+                         end_date=datetime.date(2019, 2, 1))
+            for x in range(5)
+        ]
+        cycles.append(Cycle.create(team_id='Team_001', ordinal=6))
+        Cycle.put_multi(cycles)
+
+        page, cursor = keyset.get_page(Cycle, order='start_date', n=3)
+        self.assertEqual(page[0].start_date, None)
+        self.assertEqual(keyset.decode_cursor(cursor, 2),
+                         ['2019-01-01', page[-1].uid])
+
+        page, cursor = keyset.get_page(Cycle, order='start_date', n=1)
+        self.assertEqual(keyset.decode_cursor(cursor, 2),
+                         ['1000-01-01', page[-1].uid])
+
+        walked = list(keyset.walk(Cycle, order='-start_date', n=2))
+        self.assertEqual([c.start_date for c in walked],
+                         sorted([c.start_date for c in cycles], reverse=True))
+        self.assertEqual(sorted(c.uid for c in walked),
+                         sorted(c.uid for c in cycles))
@@ -3,7 +3,7 @@
 import datetime
 import logging
 
-from model import User
+from model import NetworkClosure, User, UserNetwork, UserOrganization, UserTeam
 from unit_test_helper import ConsistencyTestCase
 import config
 import mysql_connection
@@ -22,7 +22,11 @@ class TestModel(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'network_closure': NetworkClosure.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def test_get_one_by_id(self):
@@ -4,12 +4,18 @@ import logging
 import unittest
 
 from model import (
+    Classroom,
     InvalidNetworkAssociation,
     Network,
+    NetworkClosure,
     Organization,
     Program,
     Team,
+    TeamOrganization,
     User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
 )
 from unit_test_helper import ConsistencyTestCase
 from permission import (
@@ -30,11 +36,17 @@ class TestNetworks(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'classroom': Classroom.get_table_definition(),
                 'network': Network.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         ep_program = Program.create(
@@ -141,3 +153,67 @@ class TestNetworks(ConsistencyTestCase):
             net_admin.to_client_dict()['networked_organizations'],
             [org.uid]
         )
+
+    def test_closure_updates_ancestors(self):
+        """Changing a child network changes what its ancestors can reach."""
+        (
+            meta_admin, net_admin, meta_network, network, org, team
+        ) = self.create_for_permission()
+        other_org = Organization.create(
+            name="Other Org", program_id=self.ep_program.uid)
+        other_org.put()
+
+        network.association_ids = [other_org.uid]
+        network.put()
+
+        self.assertEqual(meta_network.associated_organization_ids(),
+                         {other_org.uid})
+        self.assertEqual(meta_admin.get_networked_organization_ids(),
+                         {other_org.uid})
+
+    def test_closure_deep_nesting(self):
+        (
+            meta_admin, net_admin, meta_network, network, org, team
+        ) = self.create_for_permission()
+        meta_meta_network = Network.create(
+            name="Foo Meta Meta Network",
+            program_id=self.ep_program.uid,
+            association_ids=[meta_network.uid],
+        )
+        meta_meta_network.put()
+
+        self.assertEqual(meta_meta_network.associated_organization_ids(),
+                         {org.uid})
+
+        # Closing the loop at any depth is still caught.
+        network.association_ids = [org.uid, meta_meta_network.uid]
+        with self.assertRaises(InvalidNetworkAssociation):
+            network.put()
+
+    def test_closure_after_delete(self):
+        (
+            meta_admin, net_admin, meta_network, network, org, team
+        ) = self.create_for_permission()
+
+        Network.delete_multi([network])
+
+        self.assertEqual(meta_network.associated_organization_ids(), set())
+        self.assertFalse(is_supervisor_via_network(meta_admin, team))
+
+    def test_get_closures(self):
+        (
+            meta_admin, net_admin, meta_network, network, org, team
+        ) = self.create_for_permission()
+        empty = Network.create(name="Empty", program_id=self.ep_program.uid)
+        empty.put()
+
+        # Networks that reach nothing are there, missing ones aren't.
+        self.assertEqual(
+            Network.get_closures(
+                [meta_network.uid, network.uid, empty.uid, 'Network_dne']),
+            {
+                meta_network.uid: {network.uid, org.uid},
+                network.uid: {org.uid},
+                empty.uid: set(),
+            },
+        )
@@ -3,7 +3,15 @@
 import datetime
 import logging
 
-from model import Digest, Notification, User
+from model import (
+    Digest,
+    NetworkClosure,
+    Notification,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 import util
@@ -18,8 +26,12 @@ class TestNotifications(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'digest': Digest.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'notification': Notification.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def test_create(self, user=None, note_type='generic',
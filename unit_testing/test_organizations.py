@@ -3,7 +3,18 @@
 import logging
 import unittest
 
-from model import Organization, Program, Team, User
+from model import (
+    Classroom,
+    NetworkClosure,
+    Organization,
+    Program,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 import util
@@ -20,10 +31,16 @@ class TestOrganizations(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'organization': Organization.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         ep_program = Program.create(
@@ -59,8 +76,9 @@ class TestOrganizations(ConsistencyTestCase):
         # Populate memcache with the org's original value of 0 users.
         cached = Organization.update_cached_properties(org.uid)
 
-        # This should trigger a memcache update.
+        # This should mark the org to be recomputed.
         user.put()
+        Organization.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(org.uid))
         self.assertEqual(cached['num_users'], 1)
 
@@ -72,9 +90,10 @@ class TestOrganizations(ConsistencyTestCase):
     def test_updating_user_caches_rel_count(self):
         org, user = self.test_creating_user_caches_rel_count()
 
-        # This should trigger a memcache update.
+        # This should mark the org to be recomputed.
         user.owned_organizations = []
         user.put()
+        Organization.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(org.uid))
         self.assertEqual(cached['num_users'], 0)
 
@@ -93,8 +112,9 @@ class TestOrganizations(ConsistencyTestCase):
         # Populate memcache with the org's original value of 0 teams.
         cached = Organization.update_cached_properties(org.uid)
 
-        # This should trigger a memcache update.
+        # This should mark the org to be recomputed.
         team.put()
+        Organization.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(org.uid))
         self.assertEqual(cached['num_teams'], 1)
 
@@ -106,9 +126,10 @@ class TestOrganizations(ConsistencyTestCase):
     def test_updating_team_caches_rel_count(self):
         org, team = self.test_creating_team_caches_rel_count()
 
-        # This should trigger a memcache update.
+        # This should mark the org to be recomputed.
         team.organization_ids = []
         team.put()
+        Organization.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(org.uid))
         self.assertEqual(cached['num_teams'], 0)
 
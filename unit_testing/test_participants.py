@@ -1,9 +1,10 @@
 """Test participant methods."""
 
+from mock import patch
 import logging
 
 from cron_handlers import ReleasePreviews
-from model import Participant
+from model import Classroom, Participant, ParticipantClassroom, Team
 from unit_test_helper import ConsistencyTestCase
 import MySQLdb
 import mysql_connection
@@ -17,7 +18,9 @@ class TestParticipants(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'classroom': Classroom.get_table_definition(),
                 'participant': Participant.get_table_definition(),
+                'participant_classroom': ParticipantClassroom.get_table_definition(),
             })
 
     def create(self):
@@ -71,3 +74,109 @@ class TestParticipants(ConsistencyTestCase):
             student_ids=[p1.student_id],
         )
         self.assertEqual([p1], ppts)
+
+    def test_get_for_classroom_after_leaving(self):
+        p1, p2, p3 = self.create()
+
+        p2.classroom_ids = ['Classroom_002']
+        p2.put()
+
+        ppts = Participant.get_for_classroom(p1.team_id, 'Classroom_001')
+        self.assertEqual([p1], ppts)
+
+    def test_count_for_classroom(self):
+        p1, p2, p3 = self.create()
+
+        self.assertEqual(Participant.count_for_classroom('Classroom_001'), 2)
+        self.assertEqual(Participant.count_for_classroom('Classroom_003'), 1)
+        self.assertEqual(Participant.count_for_classroom('Classroom_X'), 0)
+
+        Participant.delete_multi([p1])
+        self.assertEqual(Participant.count_for_classroom('Classroom_001'), 1)
+
+    def create_classrooms(self):
+        classrooms = [
+            Classroom.create(name="Classroom {}".format(x),
+                             team_id='Team_001', code='code {}'.format(x),
+                             contact_id='User_contact')
+            for x in range(3)
+        ]
+        Classroom.put_multi(classrooms)
+        return classrooms
+
+    def num_students(self, classrooms):
+        return [Classroom.get_by_id(c.uid).num_students for c in classrooms]
+
+    def test_num_students_counted(self):
+        c1, c2, c3 = classrooms = self.create_classrooms()
+
+        p1 = Participant.create(student_id='4321', team_id='Team_001',
+                                classroom_ids=[c1.uid, c2.uid])
+        p2 = Participant.create(student_id='4322', team_id='Team_001',
+                                classroom_ids=[c1.uid])
+        Participant.put_multi([p1, p2])
+        self.assertEqual(self.num_students(classrooms), [2, 1, 0])
+
+        # Saving again without changes counts nothing.
+        p1.put()
+        self.assertEqual(self.num_students(classrooms), [2, 1, 0])
+
+        # Moving between classrooms.
+        p1.classroom_ids = [c2.uid, c3.uid]
+        p1.put()
+        self.assertEqual(self.num_students(classrooms), [1, 1, 1])
+
+        # Leaving all of them.
+        p2.classroom_ids = []
+        p2.put()
+        self.assertEqual(self.num_students(classrooms), [0, 1, 1])
+
+        Participant.delete_multi([p1])
+        self.assertEqual(self.num_students(classrooms), [0, 0, 0])
+
+    def test_put_multi_syncs_once(self):
+        c1, c2, c3 = classrooms = self.create_classrooms()
+        ppts = [
+            Participant.create(student_id='432{}'.format(x),
+                               team_id='Team_001', classroom_ids=[c1.uid])
+            for x in range(5)
+        ]
+
+        get_ids = ParticipantClassroom.get_related_ids_multi
+        with patch.object(ParticipantClassroom, 'get_related_ids_multi',
+                          side_effect=get_ids) as get_mock, \
+                patch.object(Classroom, 'add_num_students',
+                             wraps=Classroom.add_num_students) as add_mock, \
+                patch.object(Team, 'mark_dirty') as dirty_mock:
+            Participant.put_multi(ppts)
+
+        self.assertEqual(get_mock.call_count, 1)
+        self.assertEqual(add_mock.call_count, 1)
+        dirty_mock.assert_called_once_with(['Team_001'])
+        self.assertEqual(self.num_students(classrooms), [5, 0, 0])
+        self.assertEqual(
+            ParticipantClassroom.get_related_ids_multi([ppts[0].uid]),
+            {ppts[0].uid: {c1.uid}},
+        )
+
+    def test_reconcile_num_students(self):
+        c1, c2, c3 = classrooms = self.create_classrooms()
+        Participant.put_multi([
+            Participant.create(student_id='432{}'.format(x),
+                               team_id='Team_001', classroom_ids=[c1.uid])
+            for x in range(3)
+        ])
+
+        # Nothing to fix.
+        self.assertEqual(Classroom.reconcile_num_students()['drifted'], 0)
+
+        # A stale classroom put over the count.
+        c1.num_students = 1
+        c1.put()
+        c2.num_students = 2
+        c2.put()
+
+        result = Classroom.reconcile_num_students()
+        self.assertEqual(result['drifted'], 2)
+        self.assertEqual(result['drift'], {c1.uid: 2, c2.uid: -2})
+        self.assertEqual(self.num_students(classrooms), [3, 0, 0])
@@ -0,0 +1,160 @@
+"""Test the cached client for Neptune's participation api."""
+
+from contextlib import nested
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+from mock import patch
+import datetime
+
+from model import Classroom, Cycle
+from neptune_stand_in import FetchResult, NeptuneStandIn
+from unit_test_helper import ConsistencyTestCase
+import participation
+
+
+class TestParticipation(ConsistencyTestCase):
+
+    def create(self):
+        classrooms = [
+            Classroom.create(name='Class A', team_id='Team_foo',
+                             contact_id='User_contact', code='foo'),
+            Classroom.create(name='Class B', team_id='Team_foo',
+                             contact_id='User_contact', code='bar'),
+        ]
+        cycles = [
+            Cycle.create(
+                team_id='Team_foo',
+                ordinal=x + 1,
+                start_date=datetime.date(2000, x + 1, 1),
+                end_date=datetime.date(2000, x + 1, 28),
+            )
+            for x in range(2)
+        ]
+        return classrooms, cycles
+
+    def patch_neptune(self, neptune):
+        return nested(
+            patch.object(urlfetch, 'create_rpc',
+                         side_effect=neptune.create_rpc),
+            patch.object(urlfetch, 'make_fetch_call',
+                         side_effect=neptune.make_fetch_call),
+        )
+
+    def test_get_multi(self):
+        classrooms, cycles = self.create()
+        neptune = NeptuneStandIn({'foo': 1, 'bar': 2})
+
+        with self.patch_neptune(neptune):
+            results = participation.get_multi(
+                [(c, classrooms) for c in cycles] +
+                [(cycles[0], classrooms[:1])]
+            )
+
+        self.assertEqual(len(neptune.requests), 3)
+        self.assertEqual(results[0], {
+            'foo': [{'value': '100', 'n': 1}],
+            'bar': [{'value': '100', 'n': 2}],
+        })
+        self.assertEqual(results[2], {'foo': [{'value': '100', 'n': 1}]})
+        # Only one token for the two requests with the same classrooms.
+        self.assertEqual(len(set(neptune.tokens)), 2)
+
+    def test_end_date_included(self):
+        classrooms, cycles = self.create()
+        last_day = datetime.datetime.combine(cycles[0].end_date,
+                                             datetime.time(15, 30))
+        day_after = last_day + datetime.timedelta(days=1)
+        neptune = NeptuneStandIn(
+            completed_at_by_code={'foo': [last_day, day_after]})
+
+        with self.patch_neptune(neptune):
+            result = participation.get(cycles[0], classrooms)
+
+        # Completions any time on the cycle's last day are counted.
+        self.assertEqual(result['foo'], [{'value': '100', 'n': 1}])
+
+    def test_cache_shared(self):
+        classrooms, cycles = self.create()
+        neptune = NeptuneStandIn({'foo': 1, 'bar': 2})
+
+        with self.patch_neptune(neptune):
+            participation.get_multi([(c, classrooms) for c in cycles])
+            # Same classrooms in a different order, and a different cycle
+            # object with the same dates.
+            same_dates = Cycle.create(team_id='Team_bar', ordinal=1,
+                                      start_date=cycles[0].start_date,
+                                      end_date=cycles[0].end_date)
+            participation.get(same_dates, list(reversed(classrooms)))
+
+        self.assertEqual(len(neptune.requests), 2)
+
+        stats = participation.stats()
+        self.assertEqual(stats['miss'], 2)
+        self.assertEqual(stats['hit'], 1)
+        self.assertEqual(stats['fetch'], 2)
+        self.assertEqual(stats['hit_rate'], 1.0 / 3)
+
+    def test_stale_refreshed(self):
+        classrooms, cycles = self.create()
+        k = participation.key(cycles[0], classrooms)
+        memcache.set(k, {'fetched': 0, 'participation': {'foo': []}})
+        neptune = NeptuneStandIn({'foo': 1})
+
+        with self.patch_neptune(neptune):
+            result = participation.get(cycles[0], classrooms)
+
+        self.assertEqual(len(neptune.requests), 1)
+        self.assertEqual(result['foo'], [{'value': '100', 'n': 1}])
+        self.assertGreater(memcache.get(k)['fetched'], 0)
+
+    def test_stale_while_refreshing(self):
+        classrooms, cycles = self.create()
+        k = participation.key(cycles[0], classrooms)
+        memcache.set(k, {'fetched': 0, 'participation': {'foo': []}})
+        # Someone else is refreshing it.
+        memcache.set(participation.lock_key(k), 1)
+        neptune = NeptuneStandIn({'foo': 1})
+
+        with self.patch_neptune(neptune):
+            result = participation.get(cycles[0], classrooms)
+
+        self.assertEqual(neptune.requests, [])
+        self.assertEqual(result, {'foo': []})
+
+    def test_miss_while_fetching(self):
+        classrooms, cycles = self.create()
+        k = participation.key(cycles[0], classrooms)
+        # Someone else is fetching it for the first time.
+        memcache.set(participation.lock_key(k), 1)
+        neptune = NeptuneStandIn({'foo': 1})
+
+        with self.patch_neptune(neptune):
+            result = participation.get(cycles[0], classrooms)
+
+        # Fetched rather than waiting, and the other caller's lock is kept.
+        self.assertEqual(len(neptune.requests), 1)
+        self.assertEqual(result['foo'], [{'value': '100', 'n': 1}])
+        self.assertEqual(memcache.get(participation.lock_key(k)), 1)
+
+    def test_stale_on_error(self):
+        classrooms, cycles = self.create()
+        k = participation.key(cycles[0], classrooms)
+        memcache.set(k, {'fetched': 0, 'participation': {'foo': []}})
+        neptune = NeptuneStandIn()
+
+        def fail(rpc, url, **kwargs):
+            rpc.result = FetchResult(500, '"Error."')
+
+        with nested(
+            patch.object(urlfetch, 'create_rpc',
+                         side_effect=neptune.create_rpc),
+            patch.object(urlfetch, 'make_fetch_call', side_effect=fail),
+        ):
+            result = participation.get(cycles[0], classrooms)
+            self.assertEqual(result, {'foo': []})
+
+            # Without anything stale, errors are raised.
+            with self.assertRaises(Exception):
+                participation.get(cycles[1], classrooms)
+
+        self.assertEqual(participation.stats()['fetch_error'], 2)
@@ -0,0 +1,169 @@
+"""Test that bulk permission checks agree with owns()."""
+
+import datetime
+
+from model import (
+    Classroom,
+    Cycle,
+    Network,
+    NetworkClosure,
+    Organization,
+    Participant,
+    ParticipantClassroom,
+    Program,
+    Report,
+    Response,
+    Survey,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
+from permission import filter_owned, owns, owns_many
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+
+
+class TestPermission(ConsistencyTestCase):
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestPermission, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'classroom': Classroom.get_table_definition(),
+                'cycle': Cycle.get_table_definition(),
+                'network': Network.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
+                'organization': Organization.get_table_definition(),
+                'participant': Participant.get_table_definition(),
+                'participant_classroom':
+                    ParticipantClassroom.get_table_definition(),
+                'program': Program.get_table_definition(),
+                'survey': Survey.get_table_definition(),
+                'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
+                'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
+            })
+
+    def create(self):
+        """Two teams, one in an org that's in a network, and users with every
+        kind of relationship to them."""
+        program = Program.create(
+            name="Engagement Project",
+            label='ep18',
+            active=True,
+            preview_url='foo.com',
+        )
+        program.put()
+
+        org = Organization.create(name="Org", program_id=program.uid)
+        org.put()
+        network = Network.create(name="Network", program_id=program.uid,
+                                 association_ids=[org.uid])
+        network.put()
+
+        users = {
+            'captain': User.create(email="captain@perts.net"),
+            'member': User.create(email="member@perts.net"),
+            'contact': User.create(email="contact@perts.net"),
+            'org_admin': User.create(email="org@perts.net",
+                                     owned_organizations=[org.uid]),
+            'net_admin': User.create(email="net@perts.net",
+                                     owned_networks=[network.uid]),
+            'stranger': User.create(email="stranger@perts.net"),
+            'super': User.create(email="super@perts.net",
+                                 user_type='super_admin'),
+        }
+
+        org_team = Team.create(name="Org Team", program_id=program.uid,
+                               captain_id=users['captain'].uid,
+                               organization_ids=[org.uid])
+        lone_team = Team.create(name="Lone Team", program_id=program.uid,
+                                captain_id=users['captain'].uid)
+        Team.put_multi([org_team, lone_team])
+
+        users['captain'].owned_teams = [org_team.uid, lone_team.uid]
+        users['member'].owned_teams = [lone_team.uid]
+        User.put_multi(users.values())
+
+        entities = []
+        for team in (org_team, lone_team):
+            classroom = Classroom.create(
+                name="Class", code='trout viper ' + team.name, team_id=team.uid,
+                contact_id=users['contact'].uid)
+            classroom.put()
+            survey = Survey.create(team_id=team.uid)
+            survey.put()
+            cycle = Cycle.create(
+                team_id=team.uid,
+                ordinal=1,
+                start_date=datetime.date(2000, 1, 1),
+                end_date=datetime.date(2000, 2, 1),
+            )
+            cycle.put()
+            participant = Participant.create(
+                student_id='student ' + team.name,
+                team_id=team.uid,
+                classroom_ids=[classroom.uid],
+            )
+            participant.put()
+
+            # Unsaved; owns() doesn't need these in the db when given the
+            # entity.
+            class_report = Report.create(
+                team_id=team.uid, classroom_id=classroom.uid,
+                filename='class.pdf', gcs_path='/bucket/class.pdf',
+                content_type='application/pdf', preview=False)
+            team_report = Report.create(
+                team_id=team.uid, classroom_id=None,
+                filename='team.pdf', gcs_path='/bucket/team.pdf',
+                content_type='application/pdf', preview=False)
+            user_response = Response.create(
+                user_id=users['member'].uid, team_id=team.uid,
+                parent_id=cycle.uid, module_label='ModuleFoo', body={})
+            team_response = Response.create(
+                type=Response.TEAM_LEVEL_SYMBOL, user_id='', team_id=team.uid,
+                parent_id=cycle.uid, module_label='ModuleFoo', body={})
+
+            entities += [
+                team, team.uid, classroom, classroom.uid, survey.uid,
+                cycle.uid, participant, participant.uid, class_report,
+                team_report, user_response, team_response,
+            ]
+
+        entities += [
+            org, org.uid, network.uid, 'Team_missing',
+            users['member'].uid, users['contact'],
+        ]
+
+        return users, entities
+
+    def test_owns_many_matches_owns(self):
+        users, entities = self.create()
+
+        for name, user in users.items():
+            expected = [owns(user, e) for e in entities]
+            self.assertEqual(owns_many(user, entities), expected,
+                             "Mismatch for {}".format(name))
+
+    def test_filter_owned(self):
+        users, entities = self.create()
+
+        owned = filter_owned(users['org_admin'], entities)
+
+        self.assertEqual(owned, [e for e in entities
+                                 if owns(users['org_admin'], e)])
+        # The org admin owns something on their org's team, but not the other.
+        self.assertTrue(0 < len(owned) < len(entities))
+
+    def test_empty(self):
+        users, entities = self.create()
+        self.assertEqual(owns_many(users['stranger'], []), [])
+        self.assertEqual(filter_owned(users['stranger'], []), [])
@@ -3,7 +3,19 @@
 import logging
 
 from cron_handlers import ReleasePreviews
-from model import Classroom, Notification, Program, Report, Team, User
+from model import (
+    Classroom,
+    NetworkClosure,
+    Notification,
+    Program,
+    Report,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import MySQLdb
 import mysql_connection
@@ -19,11 +31,16 @@ class TestReports(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'notification': Notification.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'report': Report.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
@@ -1,6 +1,8 @@
 """Test responses."""
 
 from google.appengine.ext import testbed
+from mock import patch
+import datetime
 import json
 import logging
 import MySQLdb
@@ -8,13 +10,58 @@ import unittest
 import webapp2
 import webtest
 
-from model import Response, ResponseBackup, User
+from model import (
+    NetworkClosure,
+    Response,
+    ResponseBackup,
+    ResponseBodyKey,
+    ResponseBodyKeyConflict,
+    ResponseHistory,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 from task_handlers import task_routes
 import mysql_connection
 import util
 
 
+class RecordCalls(object):
+    """Stands in for mysql_connection.connect(), recording the name of each
+    connection method called, but not the calls they make themselves."""
+    methods = ('query', 'select_query', 'select_row_for_update',
+               'insert_row_dicts', 'update_row')
+
+    def __init__(self, calls, connection):
+        self.calls = calls
+        self.connection = connection
+        self.depth = 0
+
+    def __enter__(self):
+        self.sql = self.connection.__enter__()
+        for name in self.methods:
+            setattr(self.sql, name, self.record(name, getattr(self.sql, name)))
+        return self.sql
+
+    def record(self, name, method):
+        def recording_method(*args, **kwargs):
+            if self.depth == 0:
+                self.calls.append(name)
+            self.depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.depth -= 1
+        return recording_method
+
+    def __exit__(self, *args):
+        for name in self.methods:
+            delattr(self.sql, name)
+        return self.connection.__exit__(*args)
+
+
 class TestResponses(ConsistencyTestCase):
     response_params = {
         'type': None,
@@ -39,9 +86,15 @@ class TestResponses(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'network_closure': NetworkClosure.get_table_definition(),
                 'response': Response.get_table_definition(),
                 'response_backup': ResponseBackup.get_table_definition(),
+                'response_body_key': ResponseBodyKey.get_table_definition(),
+                'response_history': ResponseHistory.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         application = webapp2.WSGIApplication(task_routes)
@@ -83,16 +136,197 @@ class TestResponses(ConsistencyTestCase):
         r = Response.create(**user_response_params)
         r.put() # Creates one task.
 
-        # Modifying should create a (second) task.
+        # Modifying should create a (second) task, with only what changed.
         new_params = dict(user_response_params, progress = 100)
         updated = Response.update_or_conflict(r.uid, new_params, False)
-        expected_payload = json.dumps(
-            updated.to_dict(),
-            default=util.json_dumps_default,
-        )
         tasks = self.taskqueue_stub.get_filtered_tasks()
         self.assertEqual(len(tasks), 2)
-        self.assertEqual(tasks[1].payload, expected_payload)
+        payload = json.loads(tasks[1].payload)
+        self.assertEqual(payload['uid'], r.uid)
+        self.assertEqual(payload['kind'], ResponseHistory.DELTA)
+        self.assertEqual(payload['progress'], 100)
+        # The body was sent unchanged.
+        self.assertEqual(payload['body'], {})
+        self.assertEqual(
+            ResponseHistory.parse_time(payload['modified'])
+                .replace(microsecond=0),
+            updated.modified,
+        )
+
+    def test_returned_timestamps_persisted(self):
+        """Writes set timestamps themselves rather than reading them back."""
+        r = Response.insert_or_conflict(dict(
+            self.response_params,
+            type=Response.USER_LEVEL_SYMBOL,
+            private=True,
+            user_id='User_foo',
+        ))
+        fetched = Response.get_by_id(r.uid)
+        self.assertEqual(r.created, fetched.created)
+        self.assertEqual(r.modified, fetched.modified)
+        self.assertEqual(r.to_dict(), fetched.to_dict())
+
+        updated = Response.update_or_conflict(
+            r.uid,
+            {'progress': 100, 'body': {
+                'question2': {'modified': None, 'value': 'bar'},
+            }},
+            False,
+        )
+        fetched = Response.get_by_id(r.uid)
+        self.assertEqual(updated.created, fetched.created)
+        self.assertEqual(updated.modified, fetched.modified)
+        self.assertGreaterEqual(updated.modified, r.modified)
+        self.assertEqual(updated.to_dict(), fetched.to_dict())
+
+        # History gets the same values.
+        payload = json.loads(self.taskqueue_stub.get_filtered_tasks()[-1]
+                             .payload)
+        self.assertEqual(
+            ResponseHistory.parse_time(payload['modified'])
+                .replace(microsecond=0),
+            fetched.modified,
+        )
+        self.assertEqual(
+            payload['body'],
+            {'question2': fetched.to_client_dict()['body']['question2']},
+        )
+
+    def test_update_doesnt_read_back(self):
+        """Nothing is selected after the update is written."""
+        r = Response.insert_or_conflict(dict(
+            self.response_params,
+            type=Response.USER_LEVEL_SYMBOL,
+            private=True,
+            user_id='User_foo',
+        ))
+
+        calls = []
+        connect = mysql_connection.connect
+        with patch.object(
+            mysql_connection,
+            'connect',
+            side_effect=lambda *args, **kwargs: RecordCalls(
+                calls, connect(*args, **kwargs)),
+        ):
+            updated = Response.update_or_conflict(
+                r.uid,
+                {'progress': 100, 'body': {
+                    'question2': {'modified': None, 'value': 'bar'},
+                }},
+                False,
+            )
+
+        first_write = calls.index('query')  # upserting body keys
+        self.assertEqual(calls[-1], 'update_row')
+        self.assertNotIn('select_query', calls[first_write:])
+        self.assertNotIn('select_row_for_update', calls[first_write:])
+
+        # Still the whole body, as it was saved.
+        fetched = Response.get_by_id(r.uid)
+        self.assertEqual(set(updated.body.keys()), {'question1', 'question2'})
+        self.assertEqual(updated.to_client_dict(), fetched.to_client_dict())
+
+    def test_update_writes_changed_keys(self):
+        r = Response.insert_or_conflict(dict(
+            self.response_params,
+            type=Response.USER_LEVEL_SYMBOL,
+            private=True,
+            user_id='User_foo',
+            body={
+                'question1': {'modified': '2019-01-01T00:00:00Z',
+                              'value': 'foo'},
+                'question2': {'modified': '2019-01-01T00:00:00Z',
+                              'value': 'bar'},
+            },
+        ))
+
+        # Stored as key rows.
+        with mysql_connection.connect() as sql:
+            key_rows = sql.select_star_where(ResponseBodyKey.table)
+        self.assertEqual(
+            sorted(kr['key'] for kr in key_rows), ['question1', 'question2'])
+
+        updated = Response.update_or_conflict(
+            r.uid,
+            {'body': {
+                'question2': {'modified': '2019-01-01T00:00:00Z',
+                              'value': 'baz'},
+                'question3': {'modified': None, 'value': 'qux'},
+            }},
+            False,
+        )
+
+        # Untouched keys keep their timestamps.
+        self.assertEqual(updated.body['question1'], r.body['question1'])
+        self.assertEqual(updated.body['question2']['value'], 'baz')
+        self.assertGreater(updated.body['question2']['modified'],
+                           '2019-01-01T00:00:00Z')
+        self.assertEqual(updated.body['question3']['value'], 'qux')
+
+        # Clients see the same body however it's read.
+        fetched = Response.get_by_id(r.uid)
+        self.assertEqual(fetched.to_client_dict()['body'], updated.body)
+        [for_team] = Response.get_for_teams_unsafe(['Team_foo'])
+        self.assertEqual(for_team.body, updated.body)
+
+    def test_stale_keys(self):
+        """Keys changed since the client saw them are found in sql."""
+        r = Response.insert_or_conflict(dict(
+            self.response_params,
+            type=Response.USER_LEVEL_SYMBOL,
+            private=True,
+            user_id='User_foo',
+        ))
+        current = r.body['question1']
+
+        with mysql_connection.connect() as sql:
+            for modifieds, expected in (
+                ({'question1': '2019-01-01T00:00:00Z'}, {}),
+                ({'question1': '2018-01-01T00:00:00Z'},
+                 {'question1': current}),
+                ({'question1': None}, {'question1': current}),
+                ({'question2': None}, {}),
+            ):
+                self.assertEqual(
+                    ResponseBodyKey.get_stale(sql, r.uid, modifieds),
+                    expected,
+                )
+
+        def stale_params(value):
+            return {'body': {'question1': {
+                'modified': '2018-01-01T00:00:00Z', 'value': value}}}
+
+        # Stale but unchanged is no conflict, and not written.
+        updated = Response.update_or_conflict(
+            r.uid, stale_params('foo'), False)
+        self.assertEqual(updated.body, r.body)
+
+        with self.assertRaises(ResponseBodyKeyConflict):
+            Response.update_or_conflict(r.uid, stale_params('bar'), False)
+        self.assertEqual(Response.get_by_id(r.uid).body, r.body)
+
+    def test_update_migrates_body_column(self):
+        """Responses saved before key rows existed are still readable and
+        updatable."""
+        r = Response.create(**dict(
+            self.response_params,
+            type=Response.USER_LEVEL_SYMBOL,
+            private=True,
+            user_id='User_foo',
+        ))
+        r.put()
+        ResponseBodyKey.delete_for_responses([r.uid])
+        self.assertEqual(Response.get_by_id(r.uid).body, r.body)
+
+        updated = Response.update_or_conflict(
+            r.uid,
+            {'body': {'question2': {'modified': None, 'value': 'bar'}}},
+            False,
+        )
+
+        self.assertEqual(set(updated.body.keys()), {'question1', 'question2'})
+        self.assertEqual(Response.get_by_id(r.uid).body, updated.body)
 
     def test_atomic_updates(self):
         """Not exactly a test; more of a proof of concept that mysql
@@ -163,6 +397,205 @@ class TestResponses(ConsistencyTestCase):
             dict(r.to_dict(), backup_id=1),
         )
 
+    def test_drain_history(self):
+        r = Response.insert_or_conflict(dict(
+            self.response_params,
+            type=Response.USER_LEVEL_SYMBOL,
+            private=True,
+            user_id='User_foo',
+        ))
+        Response.update_or_conflict(r.uid, {'progress': 100}, False)
+        Response.patch_body(r.uid, [
+            {'op': 'set', 'key': 'question2', 'value': 'bar',
+             'modified': None},
+            {'op': 'remove', 'key': 'question1', 'modified': None},
+        ], force=True)
+
+        # Nothing is written until the queue is drained, then all at once.
+        with mysql_connection.connect() as sql:
+            self.assertEqual(sql.select_star_where(ResponseHistory.table), [])
+
+        result = ResponseBackup.drain()
+        self.assertEqual(result['written'], 3)
+        self.assertEqual(result['batches'], 1)
+        self.assertGreaterEqual(result['lag_seconds'], 0)
+
+        with mysql_connection.connect() as sql:
+            rows = sorted(sql.select_star_where(ResponseHistory.table),
+                          key=lambda row: row['history_id'])
+        self.assertEqual(
+            [row['kind'] for row in rows],
+            [ResponseHistory.SNAPSHOT, ResponseHistory.DELTA,
+             ResponseHistory.DELTA],
+        )
+        self.assertEqual([row['progress'] for row in rows], [50, 100, None])
+        # Deltas hold only changed keys, with removed keys as null.
+        self.assertEqual(json.loads(rows[1]['body']), {})
+        patched = json.loads(rows[2]['body'])
+        self.assertEqual(sorted(patched.keys()), ['question1', 'question2'])
+        self.assertIsNone(patched['question1'])
+
+        # Replaying all of it gives the response as stored.
+        fetched = Response.get_by_id(r.uid)
+        state = ResponseHistory.get_as_of(r.uid, datetime.datetime.now())
+        self.assertEqual(state['body'], fetched.to_client_dict()['body'])
+        self.assertEqual(state['progress'], 100)
+
+        # Drained tasks aren't written again.
+        self.assertEqual(ResponseBackup.drain()['written'], 0)
+
+        stats = ResponseBackup.stats()
+        self.assertEqual(stats['queued'], 3)
+        self.assertEqual(stats['written'], 3)
+
+    def test_drain_skips_invalid(self):
+        """Bad payloads are dropped without holding up their batch."""
+        valid = self.history_payload(datetime.datetime(2019, 1, 1),
+                                     ResponseHistory.DELTA, {'q': None})
+        ResponseBackup.queue([
+            valid,
+            dict(valid, modified=None),
+            dict(valid, modified='yesterday'),
+            dict(valid, kind='other'),
+            {'body': {}},
+            ['not', 'a', 'dict'],
+        ])
+
+        self.assertEqual(ResponseBackup.drain()['written'], 1)
+        with mysql_connection.connect() as sql:
+            [row] = sql.select_star_where(ResponseHistory.table)
+        self.assertEqual(row['response_id'], valid['uid'])
+
+        # Nothing is left to retry.
+        self.assertEqual(ResponseBackup.drain()['written'], 0)
+
+    def history_payload(self, modified, kind, body, progress=None):
+        return {
+            'uid': 'Response_foo',
+            'modified': ResponseHistory.format_time(modified),
+            'kind': kind,
+            'progress': progress,
+            'page': None,
+            'body': body,
+        }
+
+    def test_history_as_of(self):
+        t = datetime.datetime(2019, 1, 1)
+        second = datetime.timedelta(seconds=1)
+        half = datetime.timedelta(milliseconds=500)
+        entry = lambda v: {'value': v, 'modified': '2019-01-01T00:00:00Z'}
+        ResponseHistory.insert_payloads([
+            self.history_payload(t, ResponseHistory.SNAPSHOT,
+                                 {'q1': entry('a')}, progress=0),
+            self.history_payload(t + second, ResponseHistory.DELTA,
+                                 {'q2': entry('b')}, progress=50),
+            # Within the same second, and delivered twice.
+            self.history_payload(t + second + half, ResponseHistory.DELTA,
+                                 {'q1': None}),
+            self.history_payload(t + second + half, ResponseHistory.DELTA,
+                                 {'q1': None}),
+        ])
+
+        self.assertIsNone(
+            ResponseHistory.get_as_of('Response_foo', t - second))
+
+        state = ResponseHistory.get_as_of('Response_foo', t)
+        self.assertEqual(state['body'], {'q1': entry('a')})
+        self.assertEqual(state['progress'], 0)
+
+        state = ResponseHistory.get_as_of('Response_foo', t + second)
+        self.assertEqual(state['body'], {'q1': entry('a'), 'q2': entry('b')})
+        self.assertEqual(state['progress'], 50)
+
+        state = ResponseHistory.get_as_of('Response_foo', t + second * 2)
+        self.assertEqual(state['body'], {'q2': entry('b')})
+        # Unchanged by the later deltas.
+        self.assertEqual(state['progress'], 50)
+        self.assertEqual(state['modified'], t + second + half)
+
+    def test_history_compact(self):
+        day = datetime.timedelta(days=1)
+        hour = datetime.timedelta(hours=1)
+        t = datetime.datetime(2019, 1, 1, 12)
+        entry = lambda v: {'value': v, 'modified': '2019-01-01T00:00:00Z'}
+        ResponseHistory.insert_payloads(
+            [self.history_payload(t, ResponseHistory.SNAPSHOT, {},
+                                  progress=0)] +
+            [self.history_payload(t + hour * i, ResponseHistory.DELTA,
+                                  {'q1': entry(i)}, progress=i)
+             for i in range(1, 4)] +
+            [self.history_payload(t + day + hour * i, ResponseHistory.DELTA,
+                                  {'q2': entry(i)})
+             for i in range(1, 4)] +
+            # After the cutoff, left alone.
+            [self.history_payload(t + day * 3, ResponseHistory.DELTA,
+                                  {'q3': entry(0)})]
+        )
+        before_compact = ResponseHistory.get_as_of('Response_foo', t + day * 4)
+
+        result = ResponseHistory.compact(before=t + day * 2)
+        self.assertEqual(
+            result, {'responses': 1, 'rows_removed': 7, 'snapshots': 2})
+
+        with mysql_connection.connect() as sql:
+            rows = sql.select_star_where(ResponseHistory.table)
+        self.assertEqual(len(rows), 3)
+
+        # The end of each day is kept, and the present is unchanged.
+        state = ResponseHistory.get_as_of('Response_foo', t + day - hour)
+        self.assertEqual(state['body'], {'q1': entry(3)})
+        self.assertEqual(state['progress'], 3)
+        self.assertEqual(
+            ResponseHistory.get_as_of('Response_foo', t + day * 4),
+            before_compact,
+        )
+
+        # Nothing left to compact.
+        self.assertEqual(
+            ResponseHistory.compact(before=t + day * 2)['responses'], 0)
+
+    def test_redaction_matches_unsafe(self):
+        """Redacting in sql gives the same result as redacting after."""
+        user = User.create(email='foo@bar.com')
+        admin = User.create(email='admin@bar.com', user_type='super_admin')
+        cases = [
+            (Response.TEAM_LEVEL_SYMBOL, '', False),
+            (Response.TEAM_LEVEL_SYMBOL, '', True),
+            (Response.USER_LEVEL_SYMBOL, user.uid, True),
+            (Response.USER_LEVEL_SYMBOL, user.uid, False),
+            (Response.USER_LEVEL_SYMBOL, 'User_other', True),
+            (Response.USER_LEVEL_SYMBOL, 'User_other', False),
+        ]
+        responses = [
+            Response.create(**dict(
+                self.response_params,
+                type=type,
+                user_id=user_id,
+                private=private,
+                module_label='Module{}'.format(i),
+            ))
+            for i, (type, user_id, private) in enumerate(cases)
+        ]
+        Response.put_multi(responses)
+        # One saved before bodies were stored as keys.
+        ResponseBodyKey.delete_for_responses([responses[-1].uid])
+
+        team_ids = [self.response_params['team_id']]
+        to_dicts = lambda rs: sorted(
+            [r.to_dict() for r in rs], key=lambda d: d['uid'])
+
+        for u in (user, admin):
+            expected = Response.redact_private_responses(
+                Response.get_for_teams_unsafe(team_ids), u)
+            self.assertEqual(
+                to_dicts(Response.get_for_teams(u, team_ids)),
+                to_dicts(expected),
+            )
+
+        redacted = [r for r in Response.get_for_teams(user, team_ids)
+                    if r.body == {}]
+        self.assertEqual(len(redacted), 2)
+
     def test_redaction_public_team_level(self):
         user = User.create(email='foo@bar.com')
         team_params = dict(
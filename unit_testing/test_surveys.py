@@ -3,7 +3,16 @@
 import datetime
 import logging
 
-from model import Cycle, Metric, Program, Survey, Team
+from model import (
+    Classroom,
+    Cycle,
+    Metric,
+    Program,
+    Survey,
+    Team,
+    TeamOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 import util
@@ -17,11 +26,14 @@ class TestSurveys(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
                 'metric': Metric.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'survey': Survey.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def test_get_metrics(self):
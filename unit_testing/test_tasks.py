@@ -1,6 +1,7 @@
 """Test task handlers."""
 
 from google.appengine.api import urlfetch
+from contextlib import nested
 from mock import patch
 import codecs
 import datetime
@@ -8,15 +9,28 @@ import json
 import logging
 import sys
 import urlparse
+import webapp2
 
-from model import (Classroom, Cycle, Email, Metric, Program, Response, Survey,
-                   Team, User)
+from model import (Classroom, Cycle, Email, Metric, NetworkClosure, Program,
+                   Response, ResponseBodyKey, Survey, Team, TeamOrganization,
+                   User, UserNetwork, UserOrganization, UserTeam)
+from neptune_stand_in import NeptuneStandIn
 from unit_test_helper import ConsistencyTestCase
 import config
 import mysql_connection
+import participation
 import task_handlers
 
 
+def patch_neptune(neptune):
+    """Send async urlfetch calls to a NeptuneStandIn."""
+    return nested(
+        patch.object(urlfetch, 'create_rpc', side_effect=neptune.create_rpc),
+        patch.object(urlfetch, 'make_fetch_call',
+                     side_effect=neptune.make_fetch_call),
+    )
+
+
 class TestTasks(ConsistencyTestCase):
 
     # This tests one of the only datastore entities in triton: Email. We're
@@ -33,11 +47,17 @@ class TestTasks(ConsistencyTestCase):
                 'classroom': Classroom.get_table_definition(),
                 'cycle': Cycle.get_table_definition(),
                 'metric': Metric.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'response': Response.get_table_definition(),
+                'response_body_key': ResponseBodyKey.get_table_definition(),
                 'survey': Survey.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def create(self, program_label):
@@ -85,7 +105,7 @@ class TestTasks(ConsistencyTestCase):
         program, captain, team, classrooms, cycle = self.create('ep19')
 
 
-        url = task_handlers.participation_query_url(cycle, classrooms)
+        url = participation.query_url(cycle, classrooms)
         scheme, netloc, path, query_string, fragment = urlparse.urlsplit(url)
         self.assertEqual(path, '/api/project_cohorts/participation')
         query_params = urlparse.parse_qs(query_string)  # all fields as lists
@@ -108,14 +128,9 @@ class TestTasks(ConsistencyTestCase):
         program, captain, team, classrooms, cycle = self.create('ep19')
 
         # Mock Neptune's participation API.
+        neptune = NeptuneStandIn()
 
-        class MockFetchResult(object):
-            status_code = 200
-            content = r'{}'
-
-        with patch.object(
-            urlfetch, 'fetch', return_value=MockFetchResult()
-        ) as _:
+        with patch_neptune(neptune):
             handler = task_handlers.TeamCycleEmails()
             # Run the task.
             handler.post(team.uid)
@@ -128,19 +143,61 @@ class TestTasks(ConsistencyTestCase):
         program, captain, team, classrooms, cycle = self.create('ep19')
 
         # Mock Neptune's participation API.
+        neptune = NeptuneStandIn({c.code: 3 for c in classrooms})
 
-        class MockFetchResult(object):
-            status_code = 200
-            content = json.dumps({
-                c.code: [{'value': '100', 'n': 3}] for c in classrooms
-            })
-
-        with patch.object(
-            urlfetch, 'fetch', return_value=MockFetchResult()
-        ) as _:
+        with patch_neptune(neptune):
             handler = task_handlers.TeamParticipation()
             # Run the task.
             handler.post(team.uid)
 
         # The cycle should show 3 * 3 = 9 students complete
         self.assertEqual(Cycle.get_by_id(cycle.uid).students_completed, 9)
+
+    def test_team_participation_batch(self):
+        program, captain, team, classrooms, cycle = self.create('ep19')
+
+        # A second team with the same cycle dates, and a third with different
+        # dates.
+        other_teams = []
+        other_cycles = []
+        for x, offset in ((1, 0), (2, 1)):
+            other_team = Team.create(name='Team {}'.format(x),
+                                     program_id=program.uid,
+                                     captain_id=captain.uid)
+            other_team.put()
+            Classroom.create(name='Class {}'.format(x), team_id=other_team.uid,
+                             contact_id='User_contact',
+                             code='other {}'.format(x)).put()
+            other_cycle = Cycle.create(
+                team_id=other_team.uid,
+                ordinal=1,
+                start_date=cycle.start_date - datetime.timedelta(days=offset),
+                end_date=cycle.end_date,
+            )
+            other_cycle.put()
+            other_teams.append(other_team)
+            other_cycles.append(other_cycle)
+
+        # A team with no current cycle is skipped.
+        idle_team = Team.create(name='Idle', program_id=program.uid,
+                                captain_id=captain.uid)
+        idle_team.put()
+
+        neptune = NeptuneStandIn({
+            'foo': 1, 'bar': 2, 'baz': 3, 'other-1': 4, 'other-2': 5})
+        team_ids = [team.uid, idle_team.uid] + [t.uid for t in other_teams]
+
+        with patch_neptune(neptune):
+            handler = task_handlers.TeamParticipationBatch()
+            handler.request = webapp2.Request.blank(
+                '/', POST={'team_ids': ','.join(team_ids)})
+            handler.post()
+
+        # One request for each distinct set of cycle dates.
+        self.assertEqual(len(neptune.requests), 2)
+
+        self.assertEqual(Cycle.get_by_id(cycle.uid).students_completed, 6)
+        self.assertEqual(
+            Cycle.get_by_id(other_cycles[0].uid).students_completed, 4)
+        self.assertEqual(
+            Cycle.get_by_id(other_cycles[1].uid).students_completed, 5)
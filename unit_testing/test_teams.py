@@ -1,9 +1,21 @@
 """Test team methods."""
 
+from mock import patch
 import logging
 import unittest
 
-from model import Classroom, Program, Team, User
+from model import (
+    Classroom,
+    NetworkClosure,
+    Program,
+    Team,
+    TeamOrganization,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+    cached_properties,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 import util
@@ -19,9 +31,14 @@ class TestTeams(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'classroom': Classroom.get_table_definition(),
+                'network_closure': NetworkClosure.get_table_definition(),
                 'program': Program.get_table_definition(),
                 'team': Team.get_table_definition(),
+                'team_organization': TeamOrganization.get_table_definition(),
                 'user': User.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
         self.program = Program.create(
@@ -59,8 +76,9 @@ class TestTeams(ConsistencyTestCase):
         # Populate memcache with the team's original value of 0 users.
         cached = Team.update_cached_properties(team.uid)
 
-        # This should trigger a memcache update.
+        # This should mark the team to be recomputed.
         user.put()
+        Team.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(team.uid))
         self.assertEqual(cached['num_users'], 1)
 
@@ -72,9 +90,10 @@ class TestTeams(ConsistencyTestCase):
     def test_updating_user_caches_rel_count(self):
         team, user = self.test_creating_user_caches_rel_count()
 
-        # This should trigger a memcache update.
+        # This should mark the team to be recomputed.
         user.owned_teams = []
         user.put()
+        Team.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(team.uid))
         self.assertEqual(cached['num_users'], 0)
 
@@ -93,8 +112,9 @@ class TestTeams(ConsistencyTestCase):
         # Populate memcache with the team's original value of 0 classrooms.
         cached = Team.update_cached_properties(team.uid)
 
-        # This should trigger a memcache update.
+        # This should mark the team to be recomputed.
         classroom.put()
+        Team.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(team.uid))
         self.assertEqual(cached['num_classrooms'], 1)
 
@@ -106,15 +126,63 @@ class TestTeams(ConsistencyTestCase):
     def test_updating_classroom_caches_rel_count(self):
         team, classroom = self.test_creating_classroom_caches_rel_count()
 
-        # Change the number of students. This should trigger a memcache update.
+        # Change the number of students. This should mark the team to be
+        # recomputed.
         classroom.num_students = 5
         classroom.put()
+        Team.recompute_dirty()
         cached = memcache.get(util.cached_properties_key(team.uid))
         self.assertEqual(cached['participation_base'], 5)
 
         # Should see the same count on object.
         self.assertEqual(team.to_client_dict()['participation_base'], 5)
 
+    def test_dirty_recomputed_once(self):
+        team = Team.create(name="Team", captain_id="User_cap",
+                           program_id=self.program.uid)
+        team.put()
+        Team.update_cached_properties(team.uid)
+
+        users = [User.create(email="foo{}@bar.com".format(x),
+                             owned_teams=[team.uid])
+                 for x in range(5)]
+        for user in users:
+            user.put()
+
+        # Readers get the stale value until the team is recomputed.
+        cached = memcache.get(util.cached_properties_key(team.uid))
+        self.assertEqual(cached['num_users'], 0)
+
+        # Five marks, one recompute.
+        with patch.object(
+            Team,
+            'get_cached_properties_from_db_multi',
+            wraps=Team.get_cached_properties_from_db_multi,
+        ) as from_db:
+            result = Team.recompute_dirty()
+        from_db.assert_called_once_with([team.uid])
+        self.assertEqual(result, {'marks': 5, 'recomputed': 1})
+
+        cached = memcache.get(util.cached_properties_key(team.uid))
+        self.assertEqual(cached['num_users'], 5)
+
+        # Nothing left to do.
+        self.assertEqual(Team.recompute_dirty()['marks'], 0)
+
+    def test_deleted_uncached(self):
+        team = Team.create(name="Team", captain_id="User_cap",
+                           program_id=self.program.uid)
+        team.put()
+        Team.update_cached_properties(team.uid)
+
+        Team.delete_multi([team])
+        self.assertEqual(Team.get_cached_properties_from_db_multi([team.uid]),
+                         {})
+
+        Team.mark_dirty([team.uid])
+        Team.recompute_dirty()
+        self.assertIsNone(memcache.get(util.cached_properties_key(team.uid)))
+
     def test_recovers_from_cache_miss(self):
         team, user = self.test_creating_user_caches_rel_count()
 
@@ -122,6 +190,38 @@ class TestTeams(ConsistencyTestCase):
 
         self.assertEqual(team.to_client_dict()['num_users'], 1)
 
+    def test_list_serialization_batched(self):
+        teams = [
+            Team.create(name="Team {}".format(x), captain_id="User_cap",
+                        program_id=self.program.uid)
+            for x in range(3)
+        ]
+        Team.put_multi(teams)
+        Classroom.create(
+            name="Class Foo", code='trout viper', team_id=teams[0].uid,
+            contact_id='User_contact', num_students=5,
+        ).put()
+        memcache.flush_all()
+
+        keys = [util.cached_properties_key(t.uid) for t in teams]
+
+        # Loading alone doesn't fetch anything.
+        fetched = Team.get(program_id=self.program.uid)
+        self.assertEqual(memcache.get_multi(keys), {})
+
+        # Prefetching the list cached all of them at once.
+        cached_properties.prefetch(fetched)
+        self.assertEqual(len(memcache.get_multi(keys)), 3)
+
+        with patch.object(Team, 'get_cached_properties_multi') as get_multi:
+            dicts = [t.to_client_dict() for t in fetched]
+            self.assertEqual(get_multi.call_count, 0)
+
+        dicts_by_id = {d['uid']: d for d in dicts}
+        self.assertEqual(dicts_by_id[teams[0].uid]['num_classrooms'], 1)
+        self.assertEqual(dicts_by_id[teams[0].uid]['participation_base'], 5)
+        self.assertEqual(dicts_by_id[teams[1].uid]['num_classrooms'], 0)
+
     def test_default_task_data(self):
         team = Team.create(name="Team", captain_id="User_cap",
                            program_id=self.program.uid)
@@ -2,7 +2,14 @@
 
 import logging
 
-from model import User, Classroom
+from model import (
+    Classroom,
+    NetworkClosure,
+    User,
+    UserNetwork,
+    UserOrganization,
+    UserTeam,
+)
 from unit_test_helper import ConsistencyTestCase
 import mysql_connection
 import util
@@ -16,8 +23,12 @@ class TestUsers(ConsistencyTestCase):
 
         with mysql_connection.connect() as sql:
             sql.reset({
+                'network_closure': NetworkClosure.get_table_definition(),
                 'user': User.get_table_definition(),
                 'classroom': Classroom.get_table_definition(),
+                'user_network': UserNetwork.get_table_definition(),
+                'user_organization': UserOrganization.get_table_definition(),
+                'user_team': UserTeam.get_table_definition(),
             })
 
     def test_get_main_contacts(self):
@@ -36,3 +47,51 @@ class TestUsers(ConsistencyTestCase):
 
     def test_get_empty_main_contacts(self):
         self.assertEqual(User.get_main_contacts([]), [])
+
+    def test_query_by_team(self):
+        user1 = User.create(email="user1@perts.net",
+                            owned_teams=['Team_001', 'Team_002'])
+        user2 = User.create(email="user2@perts.net", owned_teams=['Team_002'])
+        User.put_multi([user1, user2])
+
+        self.assertEqual(User.query_by_team('Team_001'), [user1])
+        # Owning several of the queried teams doesn't duplicate the user.
+        self.assertEqual(
+            set(User.query_by_team(['Team_001', 'Team_002'])),
+            {user1, user2},
+        )
+        self.assertEqual(User.query_by_team([]), [])
+
+    def test_query_by_team_after_leaving(self):
+        user = User.create(email="user@perts.net", owned_teams=['Team_001'])
+        user.put()
+
+        user.owned_teams = []
+        user.put()
+
+        self.assertEqual(User.query_by_team('Team_001'), [])
+
+    def test_query_by_organization_and_network(self):
+        user = User.create(
+            email="user@perts.net",
+            owned_organizations=['Organization_001'],
+            owned_networks=['Network_001'],
+        )
+        user.put()
+
+        self.assertEqual(User.query_by_organization('Organization_001'),
+                         [user])
+        self.assertEqual(User.query_by_network('Network_001'), [user])
+
+    def test_delete_removes_membership(self):
+        user = User.create(email="user@perts.net", owned_teams=['Team_001'])
+        user.put()
+
+        User.delete_multi([user])
+
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query(
+                'SELECT * FROM `user_team` WHERE `user_id` = %s',
+                (user.uid,),
+            )
+        self.assertEqual(len(rows), 0)
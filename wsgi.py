@@ -9,6 +9,7 @@ import webapp2
 from api_handlers import api_routes
 from cron_handlers import cron_routes
 from model import SecretValue
+from model.identity_map import RequestScopeMiddleware
 from task_handlers import task_routes
 from view_handlers import view_routes
 import config
@@ -43,9 +44,10 @@ webapp2_config = {
 allowed = webapp2.WSGIApplication.allowed_methods
 webapp2.WSGIApplication.allowed_methods = allowed.union(('PATCH',))
 
-application = webapp2.WSGIApplication(
+# Each request gets its own identity map, see model/identity_map.py.
+application = RequestScopeMiddleware(webapp2.WSGIApplication(
     # Keep view_routes last, because it has a catch-all route.
     task_routes + cron_routes + api_routes + view_routes,
     config=webapp2_config,
     debug=util.is_development()
-)
+))